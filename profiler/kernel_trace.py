@@ -0,0 +1,249 @@
+# Sample commands:
+# python3 kernel_trace.py data/a100/gpt data/a100/diffusion
+# python3 kernel_trace.py --workers 4 --print data/a100/*
+#
+# Streams the ncu (batchsize_N_output_ncu.csv) and nsys gputrace
+# (batchsize_N_output_nsys_gputrace.csv) exports of profiler.sh in chunks,
+# so memory stays bounded by the number of distinct kernels rather than the
+# size of the trace. Each model directory is reduced to a signature per
+# batch size: per-kernel launches, duration, SM and memory throughput and
+# achieved occupancy, plus how busy the GPU was and how often it went idle.
+# Signatures are written next to the traces as batchsize_N_signature.json
+# and reused until a trace changes. --workers parses several model
+# directories in parallel, one process each.
+
+import argparse
+import json
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from glob import glob
+import numpy as np
+import pandas as pd
+
+CHUNK_ROWS = 500000
+TOP_KERNELS = 32 # kernels kept by name in a signature, the rest are summed up
+GAP_NS = 20000 # idle time between kernels that counts as a host sync
+
+NCU_FILE = "batchsize_{}_output_ncu.csv"
+NSYS_FILE = "batchsize_{}_output_nsys_gputrace.csv"
+SIGNATURE_FILE = "batchsize_{}_signature.json"
+
+# (section, metric) of the ncu --set detailed report => signature field
+NCU_METRICS = {
+    ("GPU Speed Of Light Throughput", "Duration"): "duration",
+    ("GPU Speed Of Light Throughput", "Compute (SM) Throughput"): "sm",
+    ("GPU Speed Of Light Throughput", "Memory Throughput"): "memory",
+    ("Occupancy", "Achieved Occupancy"): "occupancy",
+}
+DURATION_UNITS = {"nsecond": 1, "usecond": 1e3, "msecond": 1e6, "second": 1e9}
+NCU_COLUMNS = ["ID", "Kernel Name", "Section Name", "Metric Name", "Metric Unit", "Metric Value"]
+NSYS_COLUMNS = ["Start (ns)", "Duration (ns)", "Name"]
+
+
+def find_header(path, first_column):
+    # Number of lines before the CSV header; ncu and nsys print their own
+    # log lines ahead of it
+    with open(path) as f:
+        for i, line in enumerate(f):
+            if line.startswith(f'"{first_column}"') or line.startswith(first_column):
+                return i
+    raise ValueError(f"No CSV header starting with {first_column} in {path}")
+
+
+class KernelStats:
+    # Running per-kernel totals; throughputs and occupancy are weighted by
+    # duration so they can be combined across chunks and kernels
+    def __init__(self):
+        self.kernels = {}
+
+    def add(self, names, launches, duration, weighted):
+        for i, name in enumerate(names):
+            stats = self.kernels.setdefault(name, {"launches": 0, "duration": 0.0,
+                                                   "sm": 0.0, "memory": 0.0, "occupancy": 0.0})
+            stats["launches"] += int(launches[i])
+            stats["duration"] += float(duration[i])
+            for field, values in weighted.items():
+                stats[field] += float(values[i])
+
+    def summary(self, top=TOP_KERNELS):
+        # Top kernels by duration, with throughputs back as fractions
+        kernels = sorted(self.kernels.items(), key=lambda item: -item[1]["duration"])
+        rows = []
+        other = {"launches": 0, "duration": 0.0, "sm": 0.0, "memory": 0.0, "occupancy": 0.0}
+        for i, (name, stats) in enumerate(kernels):
+            if i < top:
+                rows.append(dict(stats, name=name))
+            else:
+                for field in other:
+                    other[field] += stats[field]
+        if other["launches"]:
+            rows.append(dict(other, name="<other>"))
+
+        totals = {"launches": 0, "duration": 0.0, "sm": 0.0, "memory": 0.0, "occupancy": 0.0}
+        for row in rows:
+            for field in totals:
+                totals[field] += row[field]
+            for field in ["sm", "memory", "occupancy"]:
+                row[field] = row[field] / row["duration"] / 100 if row["duration"] else 0.0
+        for field in ["sm", "memory", "occupancy"]:
+            totals[field] = totals[field] / totals["duration"] / 100 if totals["duration"] else 0.0
+        return rows, totals
+
+
+def parse_ncu(path, chunk_rows=CHUNK_ROWS):
+    # One row per (kernel launch, metric). Launches are numbered by ID in
+    # order, so the rows of the last ID of a chunk are carried over to the
+    # next one in case the launch continues there.
+    stats = KernelStats()
+    carry = None
+    reader = pd.read_csv(path, skiprows=find_header(path, "ID"), usecols=NCU_COLUMNS,
+                         dtype=str, chunksize=chunk_rows)
+    for chunk in reader:
+        if carry is not None:
+            chunk = pd.concat([carry, chunk])
+        last_id = chunk["ID"].iloc[-1]
+        carry = chunk[chunk["ID"] == last_id]
+        _add_ncu_rows(stats, chunk[chunk["ID"] != last_id])
+    if carry is not None:
+        _add_ncu_rows(stats, carry)
+    return stats
+
+
+def _add_ncu_rows(stats, rows):
+    field = pd.Series(list(zip(rows["Section Name"], rows["Metric Name"])), index=rows.index).map(NCU_METRICS)
+    rows = rows.assign(field=field).dropna(subset=["field"])
+    if rows.empty:
+        return
+    values = pd.to_numeric(rows["Metric Value"].str.replace(",", ""), errors="coerce")
+    scale = np.where(rows["field"] == "duration", rows["Metric Unit"].map(DURATION_UNITS).fillna(1), 1)
+    rows = rows.assign(value=values * scale)
+
+    launches = rows.pivot_table(index=["ID", "Kernel Name"], columns="field", values="value", aggfunc="first")
+    launches = launches.reindex(columns=["duration", "sm", "memory", "occupancy"]).fillna(0)
+    launches = launches.reset_index()
+    duration = launches["duration"]
+    per_kernel = pd.DataFrame({
+        "name": launches["Kernel Name"],
+        "launches": 1,
+        "duration": duration,
+        "sm": launches["sm"] * duration,
+        "memory": launches["memory"] * duration,
+        "occupancy": launches["occupancy"] * duration,
+    }).groupby("name", sort=False).sum()
+    stats.add(per_kernel.index, per_kernel["launches"].to_numpy(), per_kernel["duration"].to_numpy(),
+              {field: per_kernel[field].to_numpy() for field in ["sm", "memory", "occupancy"]})
+
+
+def parse_nsys(path, chunk_rows=CHUNK_ROWS, gap_ns=GAP_NS):
+    # One row per kernel or memcpy, ordered by start time. Busy time is
+    # the union of the rows, so overlapping streams are counted once.
+    stats = KernelStats()
+    first_start = None
+    busy_end = None
+    busy = 0
+    num_gaps = 0
+    reader = pd.read_csv(path, skiprows=find_header(path, "Start (ns)"), usecols=NSYS_COLUMNS,
+                         chunksize=chunk_rows)
+    for chunk in reader:
+        start = chunk["Start (ns)"].to_numpy(dtype=np.int64)
+        end = start + chunk["Duration (ns)"].to_numpy(dtype=np.int64)
+        if first_start is None:
+            first_start = int(start[0])
+            busy_end = int(start[0])
+
+        # Merge the intervals of the chunk, continuing from the previous one
+        reach = np.maximum.accumulate(np.concatenate([[busy_end], end]))
+        gaps = start - reach[:-1]
+        num_gaps += int((gaps > gap_ns).sum())
+        busy += int(np.minimum(end - start, np.maximum(end - reach[:-1], 0)).sum())
+        busy_end = int(reach[-1])
+
+        per_kernel = chunk.groupby("Name", sort=False)["Duration (ns)"].agg(["count", "sum"])
+        stats.add(per_kernel.index, per_kernel["count"].to_numpy(), per_kernel["sum"].to_numpy(), {})
+
+    span = busy_end - first_start if first_start is not None else 0
+    return stats, {"span_ns": span, "busy_ns": busy, "num_gaps": num_gaps}
+
+
+def trace_files(model_dir):
+    # batch size => (ncu path or None, nsys path or None)
+    batches = {}
+    for path in glob(os.path.join(model_dir, "batchsize_*_output_*.csv")):
+        match = re.match(r"batchsize_(\d+)_output_(ncu|nsys_gputrace)\.csv$", os.path.basename(path))
+        if match:
+            kind = 0 if match.group(2) == "ncu" else 1
+            files = batches.setdefault(int(match.group(1)), [None, None])
+            files[kind] = path
+    return batches
+
+
+def _mtimes(paths):
+    return {os.path.basename(path): os.path.getmtime(path) for path in paths if path is not None}
+
+
+def build_signature(ncu_path, nsys_path):
+    signature = {"sources": _mtimes([ncu_path, nsys_path])}
+    if ncu_path is not None:
+        kernels, totals = parse_ncu(ncu_path).summary()
+        signature["ncu"] = {"kernels": kernels, "totals": totals}
+    if nsys_path is not None:
+        stats, timeline = parse_nsys(nsys_path)
+        kernels, totals = stats.summary()
+        signature["nsys"] = {"kernels": kernels, "totals": totals, **timeline}
+    return signature
+
+
+def load_signatures(model_dir):
+    # batch size => signature, rebuilt only for traces that changed
+    signatures = {}
+    for batch_size, (ncu_path, nsys_path) in trace_files(model_dir).items():
+        path = os.path.join(model_dir, SIGNATURE_FILE.format(batch_size))
+        if os.path.exists(path):
+            with open(path) as f:
+                signature = json.load(f)
+            if signature["sources"] == _mtimes([ncu_path, nsys_path]):
+                signatures[batch_size] = signature
+                continue
+
+        signature = build_signature(ncu_path, nsys_path)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(signature, f, indent=1)
+        os.replace(tmp_path, path)
+        signatures[batch_size] = signature
+    return signatures
+
+
+def load_all(model_dirs, workers=1):
+    # model dir => {batch size => signature}, one process per model dir
+    if workers <= 1:
+        return {model_dir: load_signatures(model_dir) for model_dir in model_dirs}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return dict(zip(model_dirs, pool.map(load_signatures, model_dirs)))
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(allow_abbrev=False)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--print", action="store_true", help="Print the top kernels of every signature")
+    parser.add_argument("model_dirs", nargs="+", help="Dirs with the traces of one model (data/<gpu>/<model>)")
+    opt = parser.parse_args()
+
+    for model_dir, signatures in load_all(opt.model_dirs, opt.workers).items():
+        for batch_size, signature in sorted(signatures.items()):
+            print(f"{model_dir} batch size {batch_size}")
+            for source in ["ncu", "nsys"]:
+                if source not in signature:
+                    continue
+                totals = signature[source]["totals"]
+                print(f"  {source}: {totals['launches']} launches, {totals['duration'] / 1e6:.1f} ms of kernels")
+                if source == "ncu":
+                    print(f"  SM {totals['sm']:.0%}, memory {totals['memory']:.0%}, occupancy {totals['occupancy']:.0%}")
+                else:
+                    print(f"  GPU busy {signature['nsys']['busy_ns'] / max(signature['nsys']['span_ns'], 1):.0%} "
+                          f"of {signature['nsys']['span_ns'] / 1e6:.1f} ms, {signature['nsys']['num_gaps']} idle gaps")
+                if opt.print:
+                    for kernel in signature[source]["kernels"]:
+                        print(f"    {kernel['launches']:>8} {kernel['duration'] / 1e6:>10.2f} ms  {kernel['name'][:100]}")
@@ -90,6 +90,8 @@ profile_model() {
 
     echo 'NSYS CONVERSION TO CSV...'
     ${SUDO} -E nsys stats --report gputrace --format csv,column --force-export=true --output ${result_dir}/batchsize_${batch}_output_nsys,- ${result_dir}/batchsize_${batch}_output_nsys.nsys-rep
+    # Time in each phase of the requests (NVTX ranges of src/phases.py)
+    ${SUDO} -E nsys stats --report nvtx_sum --format csv --force-export=true --output ${result_dir}/batchsize_${batch}_output_nsys ${result_dir}/batchsize_${batch}_output_nsys.nsys-rep
     sed -i '/^"ID","Process ID"/,$!d' ${result_dir}/batchsize_${batch}_output_ncu.csv
 }
 
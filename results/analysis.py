@@ -1,9 +1,13 @@
+import os
+import sys
 import pandas as pd
 import numpy as np
-from glob import glob
 import matplotlib.pyplot as plt
 import seaborn as sns
-from datasets import Dataset
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+from power import energy as integrate_energy # type: ignore
+from store import ResultStore
 
 # Source: https://lambdalabs.com/service/gpu-cloud#pricing
 RTX_COST = 0.50 # price/hr for an RTX 6000 24 GB
@@ -18,115 +22,129 @@ GPU_LIFETIME = 4 * 352 * 24 * 60 * 60 # years * days/year * hours/day * minutes/
 
 COST_CARBON_DICT = {'4090': [RTX_COST, RTX_EMBODIED_CARBON], 'a100': [A100_COST, A100_EMBODIED_CARBON], 'a6000': [A6000_COST, A6000_EMBODIED_CARBON]}
 
-def aggregate_results():
+ENERGY_WINDOW = 300 # secs at the end of the run the energy is computed over
+RUN_DURATION = 60 * 5 # secs a mix is assumed to share the GPU for
+
+def aggregate_results(mode=None, load=1.0):
 
-    configuration = glob("*/*/*")
+    # Only new or changed runs are re-ingested, the rest comes from the index.
+    # One row per (run, mode, load), at full load by default.
+    store = ResultStore(".").update()
+    configuration = []
     devices = []
     mixes = []
+    modes = []
     energy = []
     latency_stats = []
     throughput = []
-    for c in configuration:
-        
-        pwr = pd.read_csv(c+"/pwr.csv")
-        if c.startswith("a100"):
-            pwr = pwr[0::4]
-        elif c.startswith("a6000"):
-            pwr = pwr[0::8]
-        elif c.startswith("4090"):
-            pass
+    for entry in store.query(mode=mode, load=load):
+        data = store.load(entry)
+        row = entry['row']
+
+        # Every experiment run into a directory rewrites its power file, so
+        # the samples belong to the last row
+        samples = data['pwr']
+        if entry['last_row']:
+            energy.append(integrate_energy(samples, start_ns=samples['t'][-1] - ENERGY_WINDOW * 1e9))
         else:
-            assert(1==0)
-
-        pwr = pwr[-301:]
-        t = pd.to_datetime(pwr['timestamp'], format='%Y/%m/%d %H:%M:%S.%f')
-        δt = (np.diff(t)/1e9).astype("float")
-        P = np.array(pwr[' power.draw [W]'][:-1].str.replace(' W', '')).astype(float)
-        energy.append(np.sum(δt*P))
-
-        tput = pd.read_csv(c+"/tput.csv").to_numpy()[0][2:]
-        p0 = pd.read_csv(c+"/total_p0.csv").to_numpy()[0][2:]
-        p50 = pd.read_csv(c+"/total_p50.csv").to_numpy()[0][2:]
-        p90 = pd.read_csv(c+"/total_p90.csv").to_numpy()[0][2:]
-        p100 = pd.read_csv(c+"/total_p100.csv").to_numpy()[0][2:]
-
-        latency = np.vstack([p0,p50,p90,p100])
-
-        while len(tput) <3:
-            tput = np.hstack([tput,np.nan])
-            latency = np.hstack([latency,[[np.nan],[np.nan],[np.nan],[np.nan]]])
-        
-        devices.append(c.split('/')[0])
-        mixes.append(c.split('/')[1])
-        latency_stats.append(latency)
-        throughput.append(tput)
-    
-    dataset = Dataset.from_dict({
+            energy.append(np.nan)
+
+        configuration.append(entry['path'])
+        devices.append(entry['device'])
+        mixes.append(entry['mix'])
+        modes.append(entry['mode'])
+        latency_stats.append(np.vstack([data['total_p0'][row], data['total_p50'][row], data['total_p90'][row], data['total_p100'][row]]))
+        throughput.append(data['tput'][row])
+
+    return pd.DataFrame({
         'device': devices,
         'mix': mixes,
+        'mode': modes,
         'energy': energy,
         'latency_stats': latency_stats,
         'throughput': throughput,
         'configuration': configuration,
     })
-    return dataset
-    
-def construct_df(dataset: Dataset):
-
-    df_rows = [] # mix, device, sharing_style, num_inferences, latency, energy, embodied carbon, cost, GPU hours
-
-    for gpu in ['4090', 'a100']:
-        device_rows = dataset.filter(lambda x: x['device'] == '4090')
-        for row in device_rows:
-            jobs = row['mix'].split('-')
-            if len(jobs) > 1:
-                
-                # Calculate number completed while sharing in 5 minutes
-                num_reqs = 0
-                num_reqs_per_job = []
-                for i in range(len(jobs)):
-                    num_reqs += 60*5*row['throughput'][i]
-                    num_reqs_per_job.append(60*5*row['throughput'][i])
-                single_row = ["\n".join(jobs), 
-                              gpu, 
-                              'Single GPU', 
-                              num_reqs, 
-                              300, 
-                              row['energy'], 
-                              (COST_CARBON_DICT[gpu][1] * 60 * 5) / GPU_LIFETIME,  
-                              (COST_CARBON_DICT[gpu][0] * 60 * 5) / 3600,
-                              5 / 60]
-
-                
-                
-                # Construct multi-GPU row for mix
-                latency = -1
-                energy = 0
-                embodied_carbons = []
-                costs = []
-                latencies = []
-                for i, job in enumerate(jobs):
-                    single_model_row = device_rows.filter(lambda y: y['mix'] == job)[0]
-                    curr_latency = single_model_row['latency_stats'][3][0] / 1000
-                    energy += single_model_row['energy'] / (single_model_row['throughput'][0] * 60 * 5) * num_reqs_per_job[i]
-                    embodied_carbons.append((COST_CARBON_DICT[gpu][1] * curr_latency * num_reqs_per_job[i]) / GPU_LIFETIME)
-                    costs.append((COST_CARBON_DICT[gpu][0] * curr_latency * num_reqs_per_job[i]) / 3600)
-                    latencies.append(curr_latency * num_reqs_per_job[i])
-
-                    if curr_latency * num_reqs_per_job[i] > latency:
-                        latency = curr_latency * num_reqs_per_job[i]
-                multi_row = ["\n".join(jobs), gpu, 'GPU/model', num_reqs, latency, energy, sum(embodied_carbons), sum(costs), sum(latencies) / 3600]
-                
-                df_rows.append(single_row)
-                df_rows.append(multi_row)
-        
-    df = pd.DataFrame(df_rows, columns=['mix', 'device', 'sharing_style', 'num_inferences', 'latency', 'energy', 'embodied_carbon', 'cost', 'gpu_hours'])
-    return df
+
+def construct_df(runs: pd.DataFrame):
+    # Compares every co-located mix (Single GPU) against running each of its
+    # models on a GPU of its own (GPU/model), using the single-model runs of
+    # the same device directory as baselines. All mixes of all devices are
+    # handled in one join instead of a scan per job.
+    runs = runs.assign(gpu=runs['device'].str.split('-').str[0], jobs=runs['mix'].str.split('-'))
+    runs = runs[runs['gpu'].isin(list(COST_CARBON_DICT))]
+    cost = runs['gpu'].map(lambda gpu: COST_CARBON_DICT[gpu][0])
+    carbon = runs['gpu'].map(lambda gpu: COST_CARBON_DICT[gpu][1])
+    runs = runs.assign(cost_rate=cost, carbon_rate=carbon)
+
+    # Baselines are the single-model rows with power samples, in any mode
+    single_model = (runs['jobs'].str.len() == 1) & runs['energy'].notna()
+    baselines = pd.DataFrame({
+        'device': runs.loc[single_model, 'device'],
+        'job': runs.loc[single_model, 'mix'],
+        'base_energy': runs.loc[single_model, 'energy'],
+        'base_tput': runs.loc[single_model, 'throughput'].map(lambda x: x[0]).astype(float),
+        'base_latency': runs.loc[single_model, 'latency_stats'].map(lambda x: x[3][0] / 1000),
+    }).drop_duplicates(['device', 'job'])
+
+    mixes = runs[runs['jobs'].str.len() > 1].reset_index(drop=True)
+    mixes['mix_id'] = mixes.index
+
+    # One row per (mix, job): requests completed while sharing for RUN_DURATION
+    jobs = mixes[['mix_id', 'device', 'jobs', 'throughput', 'cost_rate', 'carbon_rate']]
+    jobs = jobs.explode(['jobs', 'throughput']).rename(columns={'jobs': 'job'})
+    jobs['num_reqs'] = RUN_DURATION * jobs['throughput'].astype(float)
+    jobs = jobs.merge(baselines, on=['device', 'job'], how='left')
+
+    # Time and energy the same requests take on a dedicated GPU
+    jobs['gpu_secs'] = jobs['base_latency'] * jobs['num_reqs']
+    jobs['job_energy'] = jobs['base_energy'] / (jobs['base_tput'] * RUN_DURATION) * jobs['num_reqs']
+    jobs['job_carbon'] = jobs['carbon_rate'] * jobs['gpu_secs'] / GPU_LIFETIME
+    jobs['job_cost'] = jobs['cost_rate'] * jobs['gpu_secs'] / 3600
+    per_mix = jobs.groupby('mix_id').agg(
+        num_inferences=('num_reqs', 'sum'),
+        latency=('gpu_secs', 'max'),
+        energy=('job_energy', 'sum'),
+        embodied_carbon=('job_carbon', 'sum'),
+        cost=('job_cost', 'sum'),
+        gpu_secs=('gpu_secs', 'sum'),
+    ).reindex(mixes['mix_id'])
+
+    common = {
+        'mix': mixes['mix'].str.replace('-', '\n'),
+        'device': mixes['device'],
+        'mode': mixes['mode'],
+        'gpu': mixes['gpu'],
+        'num_inferences': per_mix['num_inferences'].to_numpy(),
+    }
+    single_rows = pd.DataFrame({
+        **common,
+        'sharing_style': 'Single GPU',
+        'latency': RUN_DURATION,
+        'energy': mixes['energy'],
+        'embodied_carbon': mixes['carbon_rate'] * RUN_DURATION / GPU_LIFETIME,
+        'cost': mixes['cost_rate'] * RUN_DURATION / 3600,
+        'gpu_hours': RUN_DURATION / 3600,
+    })
+    multi_rows = pd.DataFrame({
+        **common,
+        'sharing_style': 'GPU/model',
+        'latency': per_mix['latency'].to_numpy(),
+        'energy': per_mix['energy'].to_numpy(),
+        'embodied_carbon': per_mix['embodied_carbon'].to_numpy(),
+        'cost': per_mix['cost'].to_numpy(),
+        'gpu_hours': per_mix['gpu_secs'].to_numpy() / 3600,
+    })
+
+    # Keep each mix's Single GPU row next to its GPU/model row
+    df = pd.concat([single_rows, multi_rows], keys=[0, 1]).swaplevel().sort_index().reset_index(drop=True)
+    return df[['mix', 'device', 'mode', 'gpu', 'sharing_style', 'num_inferences', 'latency', 'energy', 'embodied_carbon', 'cost', 'gpu_hours']]
 
 def plot_grid(df: pd.DataFrame):
     print(df)
-    for device in ['4090', 'a100']:
-        df_device = df[df['device'] == device]
+    for (device, mode), df_device in df.groupby(['device', 'mode']):
+        # Run dirs with several modes get a plot per mode
+        name = device if df[df['device'] == device]['mode'].nunique() == 1 else f'{device}-{mode}'
         sns.set_style("whitegrid", {'grid.linestyle': ':'})
         fig, axs = plt.subplots(2, 2, figsize=(13, 6), constrained_layout = True)
 
@@ -150,7 +168,7 @@ def plot_grid(df: pd.DataFrame):
         p4.set_xlabel('')
         p4.set_ylabel('Embodied Carbon (g CO2)')
 
-        plt.savefig(f'./plots/{device}.pdf', bbox_inches='tight', dpi=400, format='pdf')
+        plt.savefig(f'./plots/{name}.pdf', bbox_inches='tight', dpi=400, format='pdf')
         plt.close()
     
 
@@ -158,6 +176,6 @@ def plot_grid(df: pd.DataFrame):
 
 
 if __name__=='__main__':
-    dataset = aggregate_results()
-    df = construct_df(dataset=dataset)
+    runs = aggregate_results()
+    df = construct_df(runs=runs)
     plot_grid(df=df)
\ No newline at end of file
@@ -0,0 +1,449 @@
+# Sample commands:
+# python3 simulator.py --validate
+# python3 simulator.py --device 4090-tm --models bert,whisper,gpt,diffusion \
+#    --batch-sizes 1,2,4 --max-mix-size 3 --output candidates.csv
+#
+# Discrete-event simulator of co-located models, driven by the single-model
+# runs of a device directory (tput, total_p* and power) and, when present,
+# the signatures of the kernel traces of profiler/profile-models.sh. Every request of a
+# model alternates between CPU gaps and GPU bursts (one burst per host
+# synchronization point: a denoising or decode step), split in the ratio
+# of the GPU utilization measured running alone. Sharing modes:
+#   tm         one context holds the GPU at a time, switching every
+#              quantum or when its burst ends (round-robin)
+#   mps-uncap  bursts run concurrently and slow down once their combined
+#              SM intensity exceeds the GPU
+#   slice      like tm, but switches only at burst boundaries (host.py
+#              --time-slice round-robin)
+# All candidate mixes are simulated together, one event per mix per numpy
+# step. The tm quantum and the default MPS intensity are fitted per device
+# against the measured mixes (--validate prints the fit).
+
+import argparse
+import itertools
+import os
+import time
+import warnings
+import sys
+import numpy as np
+import pandas as pd
+
+from store import ResultStore
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "profiler"))
+from kernel_trace import load_signatures # type: ignore
+
+PERCENTILES = np.array([0, 50, 90, 99, 100])
+LATENCY_FILES = ["total_p0", "total_p50", "total_p90", "total_p99", "total_p100"]
+MODES = ["tm", "mps-uncap", "slice"]
+
+# Host synchronization points per request at batch size 1: BERT is one
+# forward pass, GPT and Whisper sync every decode step (max_length=100 with
+# ~20 prompt tokens for GPT, a short transcription for Whisper) and SDXL
+# runs 50 denoising steps
+NUM_BURSTS = {"bert": 1, "whisper": 32, "gpt": 80, "diffusion": 50}
+
+# profiler.sh only captures the timed request of executor.py --num-infer 1
+# (the "start" NVTX range for ncu, cudaProfilerStart for nsys)
+PROFILED_REQS = 1
+PROFILE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "profiler", "data")
+
+QUANTA = [0.5e-3, 1e-3, 2e-3, 4e-3, 8e-3, 16e-3] # secs, tm fit
+INTENSITIES = [0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0] # mps-uncap fit
+HORIZON = 10 # virtual secs simulated per mix
+MIN_SAMPLES = 20 # latency samples below which percentiles are extrapolated
+MAX_SAMPLES = 512 # latency samples kept per model of a mix
+RUN_DURATION = 60 * 5 # secs, energy is reported over a run of this length
+EPS = 1e-12
+
+
+class ModelProfile:
+    # A model at one batch size on one device, measured running alone
+    def __init__(self, model, batch_size, latencies, gpu_frac, dynamic_power,
+                 intensity=None, num_bursts=1):
+        self.model = model
+        self.batch_size = batch_size
+        self.latencies = latencies # secs at PERCENTILES
+        self.gpu_frac = gpu_frac
+        self.dynamic_power = dynamic_power # W over idle while its kernels run
+        self.intensity = intensity # SM demand in [0, 1], None until profiled
+        self.num_bursts = num_bursts
+
+    @property
+    def name(self):
+        return f"{self.model}-{self.batch_size}"
+
+    def scaled(self, batch_size):
+        # Unprofiled batch sizes: GPU time grows linearly with the batch
+        # and CPU time stays the same
+        factor = 1 + self.gpu_frac * (batch_size / self.batch_size - 1)
+        return ModelProfile(
+            self.model, batch_size, self.latencies * factor,
+            self.gpu_frac * batch_size / self.batch_size / factor,
+            self.dynamic_power, self.intensity, self.num_bursts
+        )
+
+
+class DeviceProfile:
+    def __init__(self, device, gpu, idle_power, max_power, profiles):
+        self.device = device
+        self.gpu = gpu
+        self.idle_power = idle_power
+        self.max_power = max_power
+        self.profiles = profiles # name => ModelProfile
+        self.quantum = 2e-3
+        self.intensity = 0.7
+
+    def profile(self, model, batch_size):
+        name = f"{model}-{batch_size}"
+        if name in self.profiles:
+            return self.profiles[name]
+        measured = [p for p in self.profiles.values() if p.model == model]
+        if not measured:
+            raise KeyError(f"No single-model run of {model} in {self.device}")
+        nearest = min(measured, key=lambda p: abs(p.batch_size - batch_size))
+        return nearest.scaled(batch_size)
+
+
+def steady_state(samples):
+    # Samples while the model(s) ran, leaving out loading and tear down
+    busy = samples[samples['util'] >= 50]
+    return busy if len(busy) else samples
+
+
+def parse_model_column(column):
+    # "1_whisper-2" => ("whisper", 2)
+    model, batch_size = column.split('_', 1)[1].rsplit('-', 1)
+    return model, int(batch_size)
+
+
+def load_device(store, device, profile_dir=PROFILE_DIR):
+    profiles = {}
+    idle = []
+    peak = []
+    for entry in store.query(device=device, load=1.0):
+        samples = store.load(entry)['pwr']
+        idle.append(samples['power'][samples['util'] == 0])
+        peak.append(samples['power'].max())
+        if len(entry['models']) != 1:
+            continue
+
+        data = store.load(entry)
+        model, batch_size = parse_model_column(entry['models'][0])
+        latencies = np.array([data[f][entry['row'], 0] for f in LATENCY_FILES]) / 1000
+        busy = steady_state(samples)
+        profiles[f"{model}-{batch_size}"] = ModelProfile(
+            model, batch_size, latencies,
+            gpu_frac=min(1.0, busy['util'].mean() / 100),
+            dynamic_power=float(busy['power'].mean()),
+            num_bursts=NUM_BURSTS.get(model, 1)
+        )
+
+    idle = np.concatenate(idle)
+    idle_power = float(np.median(idle)) if len(idle) else min(float(np.min(p)) for p in peak)
+    for profile in profiles.values():
+        # Kernel trace signatures (see kernel_trace.py) refine the GPU busy
+        # fraction and the bursts, and give the SM/memory intensity
+        model_dir = os.path.join(profile_dir, device.split('-')[0], profile.model)
+        signature = load_signatures(model_dir).get(profile.batch_size, {}) if os.path.isdir(model_dir) else {}
+        if "ncu" in signature:
+            totals = signature["ncu"]["totals"]
+            profile.intensity = max(totals["sm"], totals["memory"])
+            busy = totals["duration"] / 1e9 / PROFILED_REQS
+            profile.gpu_frac = min(1.0, busy / profile.latencies[1])
+        if "nsys" in signature:
+            nsys = signature["nsys"]
+            profile.gpu_frac = nsys["busy_ns"] / max(nsys["span_ns"], 1)
+            profile.num_bursts = max(1, round(nsys["num_gaps"] / PROFILED_REQS))
+        profile.dynamic_power = max(0.0, profile.dynamic_power - idle_power) / max(profile.gpu_frac, EPS)
+
+    return DeviceProfile(device, device.split('-')[0], idle_power, float(max(peak)), profiles)
+
+
+def simulate(device, mixes, mode, horizon=HORIZON, seed=0):
+    # mixes: [[ModelProfile, ...], ...]. Returns per model of every mix the
+    # throughput (reqs/sec), p50 and p99 latency (secs), padded with NaN,
+    # and the mean power (W) of every mix.
+    rng = np.random.default_rng(seed)
+    num_mixes = len(mixes)
+    width = max(len(mix) for mix in mixes)
+    valid = np.zeros((num_mixes, width), dtype=bool)
+    lat_q = np.ones((num_mixes, width, len(PERCENTILES)))
+    gpu_frac = np.zeros((num_mixes, width))
+    bursts = np.ones((num_mixes, width), dtype=np.int64)
+    power = np.zeros((num_mixes, width))
+    intensity = np.ones((num_mixes, width))
+    batch = np.ones((num_mixes, width))
+    for m, mix in enumerate(mixes):
+        for k, profile in enumerate(mix):
+            valid[m, k] = True
+            lat_q[m, k] = profile.latencies
+            gpu_frac[m, k] = profile.gpu_frac
+            bursts[m, k] = profile.num_bursts
+            power[m, k] = profile.dynamic_power
+            intensity[m, k] = profile.intensity if profile.intensity is not None else device.intensity
+            batch[m, k] = profile.batch_size
+
+    quantum = {"tm": device.quantum, "slice": np.inf}.get(mode)
+    rows = np.arange(num_mixes)
+    cols = np.arange(width)
+
+    def sample_requests(m_idx, k_idx):
+        # Solo latency of new requests, drawn from the measured percentiles
+        # by linear interpolation, split into their CPU gaps and bursts
+        x = rng.random(len(m_idx)) * 100
+        seg = np.clip(np.searchsorted(PERCENTILES, x, side="right") - 1, 0, len(PERCENTILES) - 2)
+        lo = lat_q[m_idx, k_idx, seg]
+        hi = lat_q[m_idx, k_idx, seg + 1]
+        latency = lo + (hi - lo) * (x - PERCENTILES[seg]) / (PERCENTILES[seg + 1] - PERCENTILES[seg])
+        frac = gpu_frac[m_idx, k_idx]
+        n = bursts[m_idx, k_idx]
+        cpu_burst[m_idx, k_idx] = latency * (1 - frac) / n
+        gpu_burst[m_idx, k_idx] = latency * frac / n
+
+    now = np.zeros(num_mixes)
+    energy = np.zeros(num_mixes)
+    phase = np.zeros((num_mixes, width), dtype=np.int8) # 0: CPU gap, 1: GPU burst
+    cpu_burst = np.zeros((num_mixes, width))
+    gpu_burst = np.zeros((num_mixes, width))
+    sample_requests(*np.nonzero(valid))
+    remaining = cpu_burst.copy()
+    bursts_left = bursts.copy()
+    req_start = np.zeros((num_mixes, width))
+    completed = np.zeros((num_mixes, width))
+    samples = np.full((num_mixes, width, MAX_SAMPLES), np.nan)
+    holder = np.full(num_mixes, -1)
+    last_holder = np.full(num_mixes, -1)
+    slice_left = np.full(num_mixes, np.inf)
+
+    while True:
+        running = now < horizon - EPS
+        if not running.any():
+            break
+        on_gpu = valid & (phase == 1)
+
+        # Speed at which each model makes progress in its current phase
+        if mode == "mps-uncap":
+            demand = np.where(on_gpu, intensity, 0).sum(axis=1, keepdims=True)
+            gpu_rate = np.where(on_gpu, 1 / np.maximum(1, demand), 0)
+        else:
+            gpu_rate = np.where(on_gpu & (cols == holder[:, None]), 1.0, 0)
+        rate = np.where(valid & (phase == 0), 1.0, gpu_rate)
+        rate[~running] = 0
+
+        # Next event: a phase ending, the quantum expiring or the horizon
+        with np.errstate(divide="ignore", invalid="ignore"):
+            t_done = np.where(rate > 0, remaining / rate, np.inf)
+        # The quantum only matters once another context waits for the GPU
+        contended = (on_gpu & (cols != holder[:, None])).any(axis=1) & (holder >= 0)
+        dt = np.minimum(t_done.min(axis=1), np.where(contended, np.maximum(slice_left, 0), np.inf))
+        dt = np.where(running, np.minimum(dt, horizon - now), 0)
+
+        remaining -= rate * dt[:, None]
+        slice_left -= dt
+        now += dt
+        gpu_power = (np.where(phase == 1, gpu_rate, 0) * power).sum(axis=1)
+        energy += dt * np.minimum(device.idle_power + gpu_power, device.max_power)
+
+        done = valid & (rate > 0) & (remaining <= EPS)
+        to_gpu = done & (phase == 0)
+        burst_end = done & (phase == 1)
+        bursts_left -= burst_end
+        finished = burst_end & (bursts_left == 0)
+        to_cpu = burst_end & ~finished
+
+        # Requests that completed start over with a newly sampled request
+        if finished.any():
+            m_idx, k_idx = np.nonzero(finished)
+            slot = completed[m_idx, k_idx].astype(np.int64) % MAX_SAMPLES
+            samples[m_idx, k_idx, slot] = now[m_idx] - req_start[m_idx, k_idx]
+            completed += finished
+            req_start[finished] = now[m_idx]
+            bursts_left[finished] = bursts[finished]
+            sample_requests(m_idx, k_idx)
+
+        phase[to_gpu] = 1
+        remaining[to_gpu] = gpu_burst[to_gpu]
+        phase[burst_end] = 0
+        remaining[burst_end] = cpu_burst[burst_end]
+
+        if mode == "mps-uncap":
+            continue
+
+        # The holder gives up the GPU when its burst ends, or once its
+        # quantum has expired and another context is waiting. A holder
+        # running alone keeps its expired quantum, so a context that starts
+        # waiting then gets the GPU right away.
+        waiting = valid & (phase == 1)
+        released = (holder >= 0) & burst_end[rows, np.maximum(holder, 0)]
+        holder = np.where(released, -1, holder)
+        has_holder = holder >= 0
+        others = waiting & (cols != holder[:, None])
+        preempt = has_holder & (slice_left <= EPS) & others.any(axis=1)
+
+        # Round-robin to the next waiting context after the last holder
+        last_holder = np.where(has_holder, holder, last_holder)
+        pick = (~has_holder | preempt) & waiting.any(axis=1)
+        order = (cols - last_holder[:, None] - 1) % width
+        candidates = np.where(preempt[:, None], others, waiting)
+        nxt = np.where(candidates, order, width).argmin(axis=1)
+        holder = np.where(pick, nxt, np.where(preempt, -1, holder))
+        slice_left = np.where(pick, quantum, np.where(holder >= 0, slice_left, np.inf))
+
+    # Throughput counts the finished part of the request in progress too
+    progress = (bursts - bursts_left) / bursts
+    tput = np.where(valid, (completed + progress) * batch / now[:, None], np.nan)
+
+    # Models with few completed requests (SDXL next to BERT) extrapolate
+    # their solo latency by how much they slowed down
+    slowdown = (batch / lat_q[..., 1]) / np.where(valid, tput, 1)
+    with warnings.catch_warnings():
+        # Slots without a completed request are all NaN
+        warnings.simplefilter("ignore", RuntimeWarning)
+        p50 = np.nanpercentile(samples, 50, axis=2)
+        p99 = np.nanpercentile(samples, 99, axis=2)
+    few = valid & (completed < MIN_SAMPLES)
+    p50 = np.where(few, lat_q[..., 1] * slowdown, p50)
+    p99 = np.where(few, lat_q[..., 3] * slowdown, p99)
+    p50[~valid] = np.nan
+    p99[~valid] = np.nan
+    return tput, p50, p99, energy / now
+
+
+def measured_mixes(store, device, mode=None):
+    # (entry, profiles, tput, p50, p99, mean power) of every co-located run
+    # of the mode at full load
+    mixes = []
+    for entry in store.query(device=device.device, mode=mode, load=1.0):
+        if len(entry['models']) < 2:
+            continue
+        data = store.load(entry)
+        try:
+            mix = [device.profile(*parse_model_column(column)) for column in entry['models']]
+        except KeyError:
+            continue
+        row = entry['row']
+        mixes.append((entry, mix, data['tput'][row], data['total_p50'][row] / 1000, data['total_p99'][row] / 1000,
+                      float(steady_state(data['pwr'])['power'].mean())))
+    return mixes
+
+
+def log_error(predicted, measured):
+    return np.abs(np.log(np.asarray(predicted, dtype=float) / np.asarray(measured, dtype=float)))
+
+
+def calibrate(device, mode, measured):
+    # Grid search of the parameter the mode depends on, minimizing the
+    # mean log error of the predicted throughput
+    if not measured or mode == "slice":
+        return
+    param, grid = ("quantum", QUANTA) if mode == "tm" else ("intensity", INTENSITIES)
+    mixes = [mix for _, mix, *_ in measured]
+    best = None
+    for value in grid:
+        setattr(device, param, value)
+        tput = simulate(device, mixes, mode)[0]
+        error = np.mean([log_error(tput[i, :len(mix)], measured_tput).mean()
+                         for i, (_, mix, measured_tput, *_) in enumerate(measured)])
+        if best is None or error < best[0]:
+            best = (error, value)
+    setattr(device, param, best[1])
+
+
+def mape(predicted, measured):
+    predicted = np.asarray(predicted, dtype=float)
+    measured = np.asarray(measured, dtype=float)
+    return 100 * np.mean(np.abs(predicted - measured) / measured)
+
+
+def validate(store, devices):
+    summary = []
+    for device_name in devices:
+        entries = store.query(device=device_name)
+        if not entries:
+            continue
+        mode = entries[0]['mode']
+        device_profiles = load_device(store, device_name)
+        measured = measured_mixes(store, device_profiles, mode)
+        calibrate(device_profiles, mode, measured)
+        if not measured:
+            print(f"{device_name}: no co-located runs to validate against")
+            continue
+
+        tput, p50, p99, power = simulate(device_profiles, [mix for _, mix, *_ in measured], mode)
+        errors = {"tput": [], "p50": [], "p99": [], "power": []}
+        print(f"{device_name} ({mode}, quantum {device_profiles.quantum * 1000:g} ms, "
+              f"intensity {device_profiles.intensity:g}, idle {device_profiles.idle_power:.0f} W)")
+        for i, (entry, mix, m_tput, m_p50, m_p99, m_power) in enumerate(measured):
+            n = len(mix)
+            errors["tput"].append(mape(tput[i, :n], m_tput))
+            errors["p50"].append(mape(p50[i, :n], m_p50))
+            errors["p99"].append(mape(p99[i, :n], m_p99))
+            errors["power"].append(mape(power[i], m_power))
+            print(f"  {entry['mix']:<24} tput {np.round(tput[i, :n], 2)} vs {np.round(m_tput, 2)}, "
+                  f"p50 {np.round(p50[i, :n] * 1000, 1)} vs {np.round(m_p50 * 1000, 1)} ms, "
+                  f"power {power[i]:.0f} vs {m_power:.0f} W")
+        summary.append({"device": device_name, "mode": mode, "mixes": len(measured),
+                        **{f"{key}_mape": np.mean(value) for key, value in errors.items()}})
+    return pd.DataFrame(summary)
+
+
+def candidate_mixes(device, models, batch_sizes, max_mix_size):
+    # Every combination of up to max_mix_size distinct models, each at
+    # every batch size
+    mixes = []
+    for size in range(1, max_mix_size + 1):
+        for names in itertools.combinations(models, size):
+            for sizes in itertools.product(batch_sizes, repeat=size):
+                mixes.append([device.profile(name, b) for name, b in zip(names, sizes)])
+    return mixes
+
+
+def evaluate(device, mixes, mode):
+    tput, p50, p99, power = simulate(device, mixes, mode)
+    rows = []
+    for i, mix in enumerate(mixes):
+        n = len(mix)
+        rows.append({
+            "mix": "_".join(profile.name for profile in mix),
+            "mode": mode,
+            "tput": tput[i, :n].tolist(),
+            "p50_ms": (p50[i, :n] * 1000).tolist(),
+            "p99_ms": (p99[i, :n] * 1000).tolist(),
+            "power": power[i],
+            "energy": power[i] * RUN_DURATION,
+            "joules_per_req": power[i] / tput[i, :n].sum(),
+        })
+    return pd.DataFrame(rows)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(allow_abbrev=False)
+    parser.add_argument("--validate", action="store_true",
+                        help="Compare predictions with the measured mixes of --devices")
+    parser.add_argument("--devices", type=lambda x: x.split(","), default=["a100", "4090-tm", "4090-mps"])
+    parser.add_argument("--device", type=str, default="4090-tm",
+                        help="Device directory whose single-model runs are the profiles")
+    parser.add_argument("--mode", type=str, default=None, choices=MODES,
+                        help="Sharing mode to simulate (default: the device directory's)")
+    parser.add_argument("--models", type=lambda x: x.split(","), default=list(NUM_BURSTS))
+    parser.add_argument("--batch-sizes", type=lambda x: [int(b) for b in x.split(",")], default=[1])
+    parser.add_argument("--max-mix-size", type=int, default=3)
+    parser.add_argument("--output", type=str, default=None)
+    opt = parser.parse_args()
+
+    store = ResultStore(os.path.dirname(os.path.abspath(__file__))).update()
+    if opt.validate:
+        print(validate(store, opt.devices).to_string(index=False))
+    else:
+        device_profiles = load_device(store, opt.device)
+        mode = opt.mode or store.query(device=opt.device)[0]['mode']
+        calibrate(device_profiles, mode, measured_mixes(store, device_profiles, mode))
+        mixes = candidate_mixes(device_profiles, opt.models, opt.batch_sizes, opt.max_mix_size)
+        start_time = time.perf_counter()
+        df = evaluate(device_profiles, mixes, mode)
+        print(f"Simulated {len(mixes)} mixes in {time.perf_counter() - start_time:.1f} secs")
+        if opt.output:
+            df.to_csv(opt.output, index=False)
+        else:
+            print(df.sort_values("joules_per_req").to_string(index=False))
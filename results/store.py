@@ -0,0 +1,166 @@
+# Columnar, incrementally indexed store of the run directories under results/.
+#
+# Every <device>/<mix>/<run> directory is converted once into a single .npz
+# file (power samples + every metric CSV) under .store/, and a manifest keyed
+# by run path remembers the mtimes the conversion was made from. Re-running
+# only converts new or changed runs, and device/mix/mode queries are served
+# from the manifest without touching the run directories. A run directory
+# holds one CSV row per (mode, load) it was run at, e.g. the default
+# mps-uncap,tm of run.sh or a load sweep, and queries return one entry per
+# row.
+
+import json
+import os
+import sys
+from glob import glob
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+from power import POWER_FILE, POWER_DTYPE, load_power # type: ignore
+
+STORE_DIR = ".store"
+MANIFEST = "manifest.json"
+METRIC_FILES = ["tput", "total_p0", "total_p50", "total_p90", "total_p99", "total_p100"]
+# Per-model energy of runs recorded with timelines (src/timeline.py)
+OPTIONAL_METRIC_FILES = ["energy", "energy_req"]
+
+# nvidia-smi writes one pwr.csv row per GPU of the machine
+PWR_CSV_STRIDE = {'4090': 1, 'a100': 4, 'a6000': 8}
+
+
+def parse_gpu(device):
+    # "4090-mps" => "4090", "a100" => "a100"
+    gpu = device.split('-')[0]
+    return gpu if gpu in PWR_CSV_STRIDE else None
+
+
+def load_pwr_csv(path, stride):
+    pwr = pd.read_csv(path)[0::stride]
+    samples = np.zeros(len(pwr), dtype=POWER_DTYPE)
+    t = pd.to_datetime(pwr['timestamp'], format='%Y/%m/%d %H:%M:%S.%f')
+    samples['t'] = t.to_numpy().astype('datetime64[ns]').astype(np.int64)
+    samples['power'] = pwr[' power.draw [W]'].str.replace(' W', '').astype(float)
+    samples['util'] = pwr[' utilization.gpu [%]'].str.replace(' %', '').astype(float)
+    samples['mem_used'] = pwr[' memory.used [MiB]'].str.replace(' MiB', '').astype(float)
+    return samples
+
+
+def run_mtime(run_dir):
+    return max(os.path.getmtime(path) for path in glob(os.path.join(run_dir, "*")))
+
+
+class ResultStore:
+    def __init__(self, root="."):
+        self.root = root
+        self.store_dir = os.path.join(root, STORE_DIR)
+        self.manifest_path = os.path.join(self.store_dir, MANIFEST)
+        self.manifest = {}
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path) as f:
+                self.manifest = json.load(f)
+
+    def _save_manifest(self):
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.manifest, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.manifest_path)
+
+    def _ingest(self, run):
+        device, mix, run_id = run.split('/')
+        gpu = parse_gpu(device)
+        run_dir = os.path.join(self.root, run)
+
+        arrays = {}
+        if os.path.exists(os.path.join(run_dir, POWER_FILE)):
+            arrays['pwr'] = load_power(os.path.join(run_dir, POWER_FILE))
+        else:
+            arrays['pwr'] = load_pwr_csv(os.path.join(run_dir, "pwr.csv"), PWR_CSV_STRIDE[gpu])
+
+        models = None
+        rows = None
+        for metric in METRIC_FILES:
+            df = pd.read_csv(os.path.join(run_dir, f"{metric}.csv"))
+            arrays[metric] = df.iloc[:, 2:].to_numpy(dtype=np.float64)
+            models = list(df.columns[2:])
+            rows = [{'mode': mode, 'load': float(load)} for mode, load in zip(df['mode'], df['load'])]
+        for metric in OPTIONAL_METRIC_FILES:
+            if os.path.exists(os.path.join(run_dir, f"{metric}.csv")):
+                df = pd.read_csv(os.path.join(run_dir, f"{metric}.csv"))
+                arrays[metric] = df.iloc[:, 2:].to_numpy(dtype=np.float64)
+
+        npz = os.path.join(STORE_DIR, device, mix, f"{run_id}.npz")
+        os.makedirs(os.path.dirname(os.path.join(self.root, npz)), exist_ok=True)
+        np.savez(os.path.join(self.root, npz), **arrays)
+        return {
+            'device': device,
+            'gpu': gpu,
+            'mix': mix,
+            'run': run_id,
+            'models': models,
+            'rows': rows,
+            'npz': npz,
+        }
+
+    def update(self):
+        # Convert new or changed runs and forget deleted ones
+        runs = set()
+        for run_dir in glob(os.path.join(self.root, "*/*/*")):
+            run = os.path.relpath(run_dir, self.root)
+            if not os.path.isdir(run_dir) or parse_gpu(run.split('/')[0]) is None:
+                continue
+            if not all(os.path.exists(os.path.join(run_dir, f"{m}.csv")) for m in METRIC_FILES):
+                continue
+            if not any(os.path.exists(os.path.join(run_dir, f)) for f in [POWER_FILE, "pwr.csv"]):
+                continue
+            runs.add(run)
+
+            mtime = run_mtime(run_dir)
+            entry = self.manifest.get(run)
+            # Entries indexed before rows were are converted again
+            if entry is not None and entry['mtime'] == mtime and 'rows' in entry:
+                continue
+            print(f"Ingesting {run}")
+            entry = self._ingest(run)
+            entry['mtime'] = mtime
+            self.manifest[run] = entry
+
+        for run in set(self.manifest) - runs:
+            npz = os.path.join(self.root, self.manifest.pop(run)['npz'])
+            if os.path.exists(npz):
+                os.remove(npz)
+
+        os.makedirs(self.store_dir, exist_ok=True)
+        self._save_manifest()
+        return self
+
+    def query(self, device=None, gpu=None, mix=None, mode=None, load=None):
+        # One entry per (run, mode, load) row, entry['row'] indexes the
+        # metric arrays of load()
+        entries = []
+        for run in sorted(self.manifest):
+            run_entry = self.manifest[run]
+            if device is not None and run_entry['device'] != device:
+                continue
+            if gpu is not None and run_entry['gpu'] != gpu:
+                continue
+            if mix is not None and run_entry['mix'] != mix:
+                continue
+            for row, row_entry in enumerate(run_entry['rows']):
+                if mode is not None and row_entry['mode'] != mode:
+                    continue
+                if load is not None and row_entry['load'] != load:
+                    continue
+                entry = {key: value for key, value in run_entry.items() if key != 'rows'}
+                entries.append(dict(entry, path=run, row=row, last_row=row == len(run_entry['rows']) - 1,
+                                    **row_entry))
+        return entries
+
+    def load(self, entry):
+        with np.load(os.path.join(self.root, entry['npz'])) as data:
+            return {key: data[key] for key in data.files}
+
+
+if __name__ == '__main__':
+    store = ResultStore(os.path.dirname(os.path.abspath(__file__))).update()
+    print(f"{len(store.manifest)} runs indexed in {store.store_dir}")
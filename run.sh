@@ -19,14 +19,24 @@ print_help() {
     log "Options:"
     log "  --device-type   DEVICE_TYPE                   v100, a100, h100                                   (required)"
     log "  --device-id     DEVICE_ID                     0, 1, 2, ..                                        (required)"
-    log "  --modes         MODE1,MODE2,MODE3             mps-uncap,tm                                       (default mps-uncap,tm)"
+    log "  --modes         MODE1,MODE2,MODE3             mps-uncap,tm,inproc,slice                          (default mps-uncap,tm)"
     log "  --duration      DURATION_OF_EXPR_IN_SECONDS"
+    log "  --load-mode     LOAD_MODE                     closed, poisson, trace                             (default closed)"
+    log "  --loads         LOAD1,LOAD2,LOAD3             fraction of closed loop capacity to offer          (default 1.0)"
+    log "  --trace-file    TRACE_FILE                    arrival timestamps replayed by --load-mode trace"
+    log "  --max-batch-size MAX_BATCH_SIZE               dynamically batch open loop requests up to this size"
+    log "  --max-wait-ms   MAX_WAIT_MS                   longest a request waits for its batch to fill      (default 0)"
+    log "  --batching      BATCHING                      static, continuous (gpt: per decode step batching) (default static)"
+    log "  --slo-ms        SLO_MS                        p99 latency limit when picking <model>-auto batch sizes"
+    log "  --mem-budget-mb MEM_BUDGET_MB                 memory limit when picking <model>-auto batch sizes"
     log "  -h, --help                                    Show this help message"
     log -e "\n"
 
     log "Examples:"
     log " $0 --device-type 4090 --device-id 0 -modes tm --duration 10 diffusion-1"
     log " $0 --device-type a100 --device-id 1 --modes tm --duration 20 diffusion-1 whisper-1"
+    log " $0 --device-type a100 --device-id 1 --modes tm --load-mode poisson --loads 0.5,0.8,1.0 bert-1 whisper-1"
+    log " $0 --device-type a100 --device-id 1 --modes tm --slo-ms 200 bert-auto whisper-1"
     log -e "\n"
 
     echo "NOTE: Only support closed loop and TM right now. MPS support in progress"
@@ -36,6 +46,14 @@ get_input() {
     model_run_params=()
     duration=120
     modes=("mps-uncap" "tm")
+    load_mode="closed"
+    loads=("1.0")
+    trace_file=""
+    max_batch_size=""
+    max_wait_ms=0
+    batching="static"
+    slo_ms=""
+    mem_budget_mb=""
     while [[ $# -gt 0 ]]; do
         case "$1" in
             --device-type)
@@ -55,6 +73,39 @@ get_input() {
                 IFS=',' read -r -a modes <<< "$2"
                 shift 2
                 ;;
+            --load-mode)
+                load_mode="$2"
+                shift 2
+                ;;
+            --loads)
+                unset loads
+                IFS=',' read -r -a loads <<< "$2"
+                shift 2
+                ;;
+            --trace-file)
+                trace_file=$(realpath "$2")
+                shift 2
+                ;;
+            --max-batch-size)
+                max_batch_size="$2"
+                shift 2
+                ;;
+            --max-wait-ms)
+                max_wait_ms="$2"
+                shift 2
+                ;;
+            --batching)
+                batching="$2"
+                shift 2
+                ;;
+            --slo-ms)
+                slo_ms="$2"
+                shift 2
+                ;;
+            --mem-budget-mb)
+                mem_budget_mb="$2"
+                shift 2
+                ;;
             -h|--help)
                 print_help
                 exit 0
@@ -89,9 +140,48 @@ validate_input() {
 
     for mode in ${modes[@]}
     do
-        if [[ ${mode} != "tm" && ${mode} != "mps-uncap" ]]; then
+        if [[ ${mode} != "tm" && ${mode} != "mps-uncap" && ${mode} != "inproc" && ${mode} != "slice" ]]; then
             log "Invalid mode: ${mode}"
-            log "Must be one of: tm"
+            log "Must be one of: tm, mps-uncap, inproc, slice"
+            print_help
+            exit 1
+        fi
+    done
+
+    if [[ ${load_mode} != "closed" && ${load_mode} != "poisson" && ${load_mode} != "trace" ]]; then
+        log "Invalid load-mode: ${load_mode}"
+        print_help
+        exit 1
+    fi
+
+    if [[ ${load_mode} == "trace" && ! -f ${trace_file} ]]; then
+        log "Trace file not found: ${trace_file}"
+        print_help
+        exit 1
+    fi
+
+    if [[ ${load_mode} != "closed" && (" ${modes[@]} " =~ " inproc " || " ${modes[@]} " =~ " slice ") ]]; then
+        log "inproc and slice modes only support closed loop"
+        print_help
+        exit 1
+    fi
+
+    if [[ -n ${max_batch_size} && ${load_mode} == "closed" && ${batching} == "static" ]]; then
+        log "--max-batch-size needs an open loop --load-mode"
+        print_help
+        exit 1
+    fi
+
+    if [[ ${batching} != "static" && ${batching} != "continuous" ]]; then
+        log "Invalid batching: ${batching}"
+        print_help
+        exit 1
+    fi
+
+    for load in ${loads[@]}
+    do
+        if [[ ! ${load} =~ ^[0-9]*\.?[0-9]+$ ]]; then
+            log "Invalid load: ${load}"
             print_help
             exit 1
         fi
@@ -113,6 +203,14 @@ parse_input() {
         fi
         models[$i]=$(echo $element | cut -d'-' -f1)
         batch_sizes[$i]=$(echo $element | cut -d'-' -f2)
+        # <model>-auto: the best batch size in the device's autotuned table
+        # (executor.py --autotune) within the SLO and memory budget
+        if [[ ${batch_sizes[$i]} == "auto" ]]; then
+            batch_sizes[$i]=$(python3 src/autotune.py --device-type ${device_type} --model ${models[$i]} \
+                --execution ${EXECUTION:-eager} ${slo_ms:+--slo-ms ${slo_ms}} \
+                ${mem_budget_mb:+--mem-budget-mb ${mem_budget_mb}}) || exit 1
+            log "Autotuned batch size of ${models[$i]}: ${batch_sizes[$i]}"
+        fi
         models_and_batch_sizes[$i]=${models[$i]}"-"${batch_sizes[$i]}
     done
 }
@@ -199,11 +297,27 @@ run_cmd() {
 generate_json_input() {
     export model="\"$1\""
     export batch_size=$2
+    export load_mode="\"$3\""
+    export load=$4
 
     template=$(cat model-param.json.template)
     json_input=$(echo $template | envsubst)
 
-    unset model batch_size
+    if [[ -n ${trace_file} ]]; then
+        json_input=$(jq -c --arg trace "${trace_file}" '. + {"trace-file": $trace}' <<< "${json_input}")
+    fi
+
+    if [[ -n ${max_batch_size} ]]; then
+        json_input=$(jq -c --argjson bs ${max_batch_size} --argjson wait ${max_wait_ms} \
+            '. + {"max-batch-size": $bs, "max-wait-ms": $wait}' <<< "${json_input}")
+    fi
+
+    # Only the GPT model has a continuous batching engine
+    if [[ ${batching} == "continuous" && $1 == "gpt" ]]; then
+        json_input=$(jq -c '. + {"batching": "continuous"}' <<< "${json_input}")
+    fi
+
+    unset model batch_size load_mode load
 }
 
 generate_model_params() {
@@ -214,11 +328,14 @@ generate_model_params() {
     done
 }
 
-generate_closed_loop_load() {
+generate_load() {
+    local load_mode_arg=$1
+    local load_arg=$2
+
     json_array=()
     for (( i=0; i<${num_procs}; i++ ))
     do
-        generate_json_input ${models[$i]} ${batch_sizes[$i]} 0
+        generate_json_input ${models[$i]} ${batch_sizes[$i]} ${load_mode_arg} ${load_arg}
         json_array+=("${json_input}")
     done
 
@@ -228,16 +345,31 @@ generate_closed_loop_load() {
     do
         local run_id_arg=$(uuidgen)
         cmd="./run_job_mix.sh --device-type ${device_type} --run-id ${run_id_arg} '${model_params}'"
-        log "Running closed loop experiment for ${mode}"
+        if [[ ${load_mode_arg} == "closed" ]]; then
+            log "Running closed loop experiment for ${mode}"
+        else
+            log "Running ${load_mode_arg} open loop experiment at load ${load_arg} for ${mode}"
+        fi
         run_cmd "${cmd}" ${device_id} ${mode} ${duration} ${run_id_arg}
     done
+}
 
+generate_loads() {
+    # Closed loop always runs at full load, so there is nothing to sweep
+    if [[ ${load_mode} == "closed" ]]; then
+        generate_load closed 1.0
+        return
+    fi
 
+    for load in ${loads[@]}
+    do
+        generate_load ${load_mode} ${load}
+    done
 }
 
 get_input $@
 validate_input
 parse_input
 setup_expr
-generate_closed_loop_load
+generate_loads
 log "Run success: results are stored in ${result_dir}"
@@ -82,6 +82,11 @@ cleanup_handler() {
         cleanup ${modes_ran[$y]} ${device_ids_ran[$y]} || :
     done
 
+    # Unpublish the shared weights of the executors killed above
+    if [[ -n ${SHARE_WEIGHTS} ]]; then
+        python3 src/weight_share.py --cleanup || :
+    fi
+
     # Clean up the fifo pipe created
     rm -f ${fifo_pipe} || :
 
@@ -133,15 +138,12 @@ compute_stats() {
     echo "Results stored in: ${result_dir_arg}"
 }
 
-start_expr() {
+start_executors() {
     local mode_arg=$1
     local device_id_arg=$2
     local uuid_arg=$3
     local run_id_arg=$4
 
-    enable_mps_if_needed ${mode_arg} ${device_id_arg}
-
-    cmd_arr=()
     for (( c=0; c<${num_procs}; c++ )); do
         if [[ ${mode_arg} == "mps-uncap" ]]; then
             export_prefix="export CUDA_MPS_ENABLE_PER_CTX_DEVICE_MULTIPROCESSOR_PARTITIONING=0 && \
@@ -159,6 +161,10 @@ start_expr() {
             taskset -c ${cpu} python3 src/executor.py \
             --device-id 0 \
             ${model_run_params[$c]} \
+            ${WEIGHT_CACHE:+--weight-cache ${WEIGHT_CACHE}} \
+            ${EXECUTION:+--execution ${EXECUTION}} \
+            ${TIMELINE:+--timeline ${result_dir}} \
+            ${SHARE_WEIGHTS:+--share-weights} \
             --run-id ${run_id_arg} \
             --tid ${c} \
             --uuid ${uuid_arg} > /dev/null &"
@@ -166,14 +172,70 @@ start_expr() {
         eval $cmd
         cmd_arr+=("${cmd}")
     done
+}
+
+start_host() {
+    local device_id_arg=$1
+    local uuid_arg=$2
+    local run_id_arg=$3
+    local mode_arg=$4
+
+    # In slice mode the models take turns at step boundaries
+    local slice_args=""
+    if [[ ${mode_arg} == "slice" ]]; then
+        slice_args="--time-slice ${SLICE_POLICY:-round-robin}"
+    elif [[ -n ${EXECUTION} ]]; then
+        # Compiled models can't yield between steps, slice mode stays eager
+        slice_args="--execution ${EXECUTION}"
+    fi
+
+    # A single process hosts every model, one execution lane per model
+    local mix=()
+    for (( c=0; c<${num_procs}; c++ )); do
+        mix+=("${models[$c]}-${batch_sizes[$c]}")
+    done
+
+    cpus="$(((device_id_arg * 7) + 1))-$(((device_id_arg * 7) + num_procs))"
+    cmd="export CUDA_VISIBLE_DEVICES=${device_id_arg} && \
+        taskset -c ${cpus} python3 src/host.py \
+        --device-id 0 \
+        --mix ${mix[@]} \
+        ${WEIGHT_CACHE:+--weight-cache ${WEIGHT_CACHE}} \
+        ${slice_args} \
+        ${TIMELINE:+--timeline ${result_dir}} \
+        ${SHARE_WEIGHTS:+--share-weights} \
+        --run-id ${run_id_arg} \
+        --tid 0 \
+        --uuid ${uuid_arg} > /dev/null &"
+
+    eval $cmd
+    cmd_arr+=("${cmd}")
+}
+
+start_expr() {
+    local mode_arg=$1
+    local device_id_arg=$2
+    local uuid_arg=$3
+    local run_id_arg=$4
+
+    enable_mps_if_needed ${mode_arg} ${device_id_arg}
+
+    cmd_arr=()
+    if [[ ${mode_arg} == "inproc" || ${mode_arg} == "slice" ]]; then
+        start_host ${device_id_arg} ${uuid_arg} ${run_id_arg} ${mode_arg}
+        expected_procs=1
+    else
+        start_executors ${mode_arg} ${device_id_arg} ${uuid_arg} ${run_id_arg}
+        expected_procs=${num_procs}
+    fi
 
     # Check if processes are alive
-    readarray -t forked_pids < <(ps -eaf | grep executor.py |
+    readarray -t forked_pids < <(ps -eaf | egrep "executor.py|host.py" |
         grep ${uuid_arg} | grep -v grep |
         awk '{for (i=1; i<=NF; i++) if ($i == "--tid") print $(i+1),$0}' |
         sort -n | cut -d' ' -f2- | awk '{print $2}')
-    if [[ ${#forked_pids[@]} -ne ${num_procs} ]]; then
-        echo "Expected ${num_procs} processes. But found ${#forked_pids[@]}}"
+    if [[ ${#forked_pids[@]} -ne ${expected_procs} ]]; then
+        echo "Expected ${expected_procs} processes. But found ${#forked_pids[@]}}"
         echo "Examine commands: "
         for cmd in "${cmd_arr[@]}"
         do
@@ -236,7 +298,7 @@ run_expr() {
     read_fifo ${fifo_pipe}
     
     # Launch metric collection
-    pwr_cmd="nvidia-smi --query-gpu=timestamp,name,pstate,temperature.gpu,memory.total,memory.free,memory.used,utilization.memory,utilization.gpu,power.draw --format=csv -l 1 > ${result_dir}/pwr.csv &"
+    pwr_cmd="python3 src/power.py --device-id ${device_id_to_run} --interval-ms ${PWR_INTERVAL_MS:-100} --output ${result_dir}/pwr.bin &"
     echo "${pwr_cmd}"
     eval $pwr_cmd
     pwr_pid=$!
@@ -269,8 +331,9 @@ run_expr() {
     # Make sure to stop all inferences
     safe_clean_gpu prev[@] ${prev_mode_run} ${prev_device_id_run}
 
-    # Stop power metrics collection
+    # Stop power metrics collection, pwr.bin is complete once it exited
     kill $pwr_pid
+    wait $pwr_pid 2>/dev/null
 
     # Wait for the process to exit and get stats pkl file
     pkl_files=()
@@ -282,6 +345,10 @@ run_expr() {
     done
 
     mode_run=${prev_mode_run}
+    # Compiled runs get their own rows, e.g. tm+compile next to tm
+    if [[ -n ${EXECUTION} && ${EXECUTION} != "eager" && ${mode_run} != "slice" ]]; then
+        mode_run="${mode_run}+${EXECUTION}"
+    fi
     if [[ ${#pkl_files[@]} -gt 0 ]]; then
         compute_stats pkl_files[@] ${mode_run} ${result_dir}
     else
@@ -0,0 +1,70 @@
+import random
+import threading
+import time
+
+
+def poisson_offsets(rate, seed=None):
+    # Exponential inter-arrival gaps => Poisson arrivals at `rate` reqs/sec
+    rng = random.Random(seed)
+    offset = 0.0
+    while True:
+        offset += rng.expovariate(rate)
+        yield offset
+
+
+def load_trace(trace_file):
+    # One arrival per line, first comma separated column is the timestamp
+    # in seconds. Headers and comment lines are skipped.
+    timestamps = []
+    with open(trace_file) as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            try:
+                timestamps.append(float(line.split(",")[0]))
+            except ValueError:
+                continue
+    if len(timestamps) < 2:
+        raise ValueError(f"Trace '{trace_file}' needs at least 2 arrivals")
+    timestamps.sort()
+    return [t - timestamps[0] for t in timestamps]
+
+
+def trace_offsets(timestamps, rate):
+    # Keep the shape of the trace but rescale it so that its mean rate is
+    # `rate`, and replay it from the start if it runs out
+    span = timestamps[-1]
+    if span <= 0:
+        raise ValueError("Trace timestamps must span a non-zero interval")
+    scale = (len(timestamps) - 1) / (span * rate)
+    period = (span * scale) + (1.0 / rate)
+    base = 0.0
+    while True:
+        for t in timestamps:
+            yield base + (t * scale)
+        base += period
+
+
+class ArrivalThread(threading.Thread):
+    def __init__(self, offsets, arrival_queue):
+        super().__init__(daemon=True)
+        self._offsets = offsets
+        self._arrival_queue = arrival_queue
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def run(self):
+        # Requests are stamped with their scheduled arrival time, so a slow
+        # consumer shows up as queueing delay rather than a lower offered load
+        start = time.monotonic()
+        for offset in self._offsets:
+            arrival = start + offset
+            delay = arrival - time.monotonic()
+            if delay > 0 and self._stop_event.wait(delay):
+                break
+            if self._stop_event.is_set():
+                break
+            self._arrival_queue.put(arrival)
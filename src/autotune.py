@@ -0,0 +1,246 @@
+# Sample commands:
+# python3 src/executor.py --autotune --device-type a100 --model bert --batch-sizes 1,2,4,8,16,32,64
+# python3 src/executor.py --autotune --device-type cpu --cpu --model synthetic:bert --autotune-secs 2
+# python3 src/autotune.py --device-type a100 --model bert --slo-ms 100 --mem-budget-mb 20000
+#
+# Batch size autotuning of a model on a device. executor.py --autotune
+# loads the model once and serves it closed loop at each batch size for a
+# few seconds. For each size it records throughput, p99 latency, peak
+# memory and energy per request, the energy from NVML and so GPU only.
+# The results go to <result root>/<device type>/batch_sizes.csv, one row
+# per (model, execution, batch size). Sizes are tried in increasing order.
+# The first size that runs out of memory (or goes over --mem-budget-mb)
+# ends the sweep. The sizes between it and the last one that fit are then
+# bisected, so the table reaches close to the largest batch that fits.
+# run.sh reads the table for models given as <model>-auto. It picks the
+# batch size with the highest throughput whose p99 latency and peak
+# memory are within its --slo-ms and --mem-budget-mb. tests/test_autotune.py
+# sweeps a fake model that runs out of memory.
+
+import argparse
+import contextlib
+import gc
+import math
+import os
+import sys
+import tempfile
+import time
+import pandas as pd
+from histogram import LogHistogram # type: ignore
+
+TABLE_FILE = "batch_sizes.csv"
+# energy_status: "ok", or why energy_req_j is NaN, "cpu" (NVML only sees
+# GPUs) or "no-pynvml"
+COLUMNS = ["model", "execution", "batch_size", "status", "tput", "p99_ms", "peak_mem_mb", "energy_req_j",
+           "energy_status"]
+DEFAULT_BATCH_SIZES = [1, 2, 4, 8, 16, 32, 64]
+DEFAULT_SECS = 10 # secs served at each batch size
+POWER_INTERVAL = 0.05 # secs
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_RESULT_ROOT = os.path.join(os.path.dirname(SRC_DIR), "results")
+
+
+def is_oom(exc):
+    # CUDA's OutOfMemoryError is a RuntimeError, so is the CPU allocator's
+    message = str(exc).lower()
+    return isinstance(exc, MemoryError) or (isinstance(exc, RuntimeError) and (
+        "out of memory" in message or "can't allocate memory" in message))
+
+
+def table_path(device_type, result_root=DEFAULT_RESULT_ROOT):
+    return os.path.join(result_root, device_type, TABLE_FILE)
+
+
+def sweep(measure, batch_sizes, mem_budget_mb=None, recover=None):
+    # measure(batch_size) => {"tput", "p99_ms", "peak_mem_mb", "energy_req_j",
+    # "energy_status"},
+    # recover() frees what a batch that ran out of memory left behind.
+    # => one row per batch size tried, in the order they were tried.
+    rows = []
+
+    def fits(batch_size):
+        try:
+            row = measure(batch_size)
+        except Exception as exc:
+            if not is_oom(exc):
+                raise
+            row = None
+        # Out of the except block, the traceback no longer holds the
+        # tensors of the failed batch
+        if row is None:
+            if recover is not None:
+                recover()
+            rows.append({"batch_size": batch_size, "status": "oom"})
+            print(f"batch size {batch_size}: out of memory")
+            return False
+        status = "ok" if mem_budget_mb is None or row["peak_mem_mb"] <= mem_budget_mb else "oom"
+        rows.append({"batch_size": batch_size, "status": status, **row})
+        print(f"batch size {batch_size}: {row['tput']:.1f} reqs/s, p99 {row['p99_ms']:.1f} ms, "
+              f"peak {row['peak_mem_mb']:.0f} MiB, {row['energy_req_j']:.3f} J/request"
+              f"{'' if status == 'ok' else ', over the memory budget'}")
+        return status == "ok"
+
+    largest, smallest_oom = 0, None
+    for batch_size in sorted(batch_sizes):
+        if not fits(batch_size):
+            smallest_oom = batch_size
+            break
+        largest = batch_size
+
+    # Back off from the first size that did not fit, down to an eighth of
+    # the largest that did
+    while smallest_oom is not None and smallest_oom - largest > max(1, largest // 8):
+        batch_size = (largest + smallest_oom) // 2
+        if fits(batch_size):
+            largest = batch_size
+        else:
+            smallest_oom = batch_size
+    return rows
+
+
+def save_table(path, model, execution, rows):
+    # Replaces the rows of (model, execution) in the device's table
+    table = load_table(path)
+    table = table[(table["model"] != model) | (table["execution"] != execution)]
+    new_rows = pd.DataFrame([{"model": model, "execution": execution, **row} for row in rows], columns=COLUMNS)
+    table = pd.concat([table, new_rows]) if len(table) else new_rows
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    table.sort_values(["model", "execution", "batch_size"]).to_csv(path, index=False)
+
+
+def load_table(path):
+    if not os.path.exists(path):
+        return pd.DataFrame(columns=COLUMNS)
+    return pd.read_csv(path)
+
+
+def pick(table, model, execution="eager", slo_ms=None, mem_budget_mb=None):
+    # Batch size with the highest throughput within the SLO and budget,
+    # None if no measured size is
+    rows = table[(table["model"] == model) & (table["execution"] == execution) & (table["status"] == "ok")]
+    if slo_ms is not None:
+        rows = rows[rows["p99_ms"] <= slo_ms]
+    if mem_budget_mb is not None:
+        rows = rows[rows["peak_mem_mb"] <= mem_budget_mb]
+    if not len(rows):
+        return None
+    return int(rows.loc[rows["tput"].idxmax(), "batch_size"])
+
+
+def _nvml_index(device):
+    # NVML ignores CUDA_VISIBLE_DEVICES, executors see their GPU as 0
+    visible = os.environ.get("CUDA_VISIBLE_DEVICES", "").split(",")
+    index = device.index or 0
+    if index < len(visible) and visible[index].strip().isdigit():
+        return int(visible[index])
+    return index
+
+
+def _reset_peak_rss():
+    # Resets VmHWM (Linux), the peak RSS getrusage can't reset
+    with contextlib.suppress(OSError), open("/proc/self/clear_refs", "w") as f:
+        f.write("5")
+
+
+def _peak_rss():
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) * 1024
+    return 0
+
+
+def measure_batch_size(model_obj, batch_size, duration=DEFAULT_SECS):
+    # Closed loop at one batch size, after a warm up batch (which compiles
+    # the new shape of compiled models)
+    import torch
+    from power import NVMLBackend, PowerSampler, load_power, energy # type: ignore
+    device = model_obj._device
+    requests = [model_obj.sample_request() for _ in range(batch_size)]
+    if device.type == "cuda":
+        torch.cuda.reset_peak_memory_stats(device)
+    else:
+        _reset_peak_rss()
+    model_obj.infer_batch(requests)
+
+    sampler = None
+    power_file = None
+    energy_status = "cpu"
+    if device.type == "cuda":
+        try:
+            power_file = tempfile.NamedTemporaryFile(suffix=".bin", delete=False).name
+            sampler = PowerSampler(NVMLBackend(_nvml_index(device)), power_file, POWER_INTERVAL)
+            sampler.start()
+            energy_status = "ok"
+        except ImportError:
+            energy_status = "no-pynvml"
+            print("pynvml is not installed, energy per request is not measured")
+    hist = LogHistogram()
+    served = 0
+    start_time = time.monotonic()
+    while served == 0 or time.monotonic() - start_time < duration:
+        batch_start = time.monotonic()
+        served += model_obj.infer_batch(requests)
+        hist.record(time.monotonic() - batch_start)
+    elapsed = time.monotonic() - start_time
+    if model_obj.postprocessor is not None:
+        model_obj.postprocessor.drain()
+
+    energy_req = math.nan
+    if sampler is not None:
+        sampler.stop()
+        energy_req = energy(load_power(power_file)) / served
+    if power_file is not None:
+        os.remove(power_file)
+    peak_mem = torch.cuda.max_memory_allocated(device) if device.type == "cuda" else _peak_rss()
+    return {"tput": served / elapsed, "p99_ms": hist.percentile(99) * 1000,
+            "peak_mem_mb": peak_mem / 2**20, "energy_req_j": energy_req, "energy_status": energy_status}
+
+
+def autotune(model_obj, batch_sizes=DEFAULT_BATCH_SIZES, duration=DEFAULT_SECS, mem_budget_mb=None):
+    # Sweeps the batch sizes of a model that executor.py created, on its
+    # device. On a GPU the budget also caps the caching allocator, so
+    # going over it is a real out of memory error.
+    import torch
+    device = model_obj._device
+    if device.type == "cuda" and mem_budget_mb is not None:
+        total = torch.cuda.get_device_properties(device).total_memory
+        torch.cuda.set_per_process_memory_fraction(min(1.0, mem_budget_mb * 2**20 / total), device)
+    model_obj.load_model()
+    model_obj.load_data()
+
+    def recover():
+        gc.collect()
+        if device.type == "cuda":
+            torch.cuda.empty_cache()
+
+    return sweep(lambda batch_size: measure_batch_size(model_obj, batch_size, duration),
+                 batch_sizes, mem_budget_mb, recover)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(allow_abbrev=False)
+    parser.add_argument("--device-type", type=str, default=None, help="Device whose table to read (e.g. a100, cpu)")
+    parser.add_argument("--model", type=str, default=None, help="Model as in a mix, e.g. bert or bert@int8w")
+    parser.add_argument("--execution", type=str, default="eager")
+    parser.add_argument("--slo-ms", type=float, default=None, help="Largest p99 latency allowed")
+    parser.add_argument("--mem-budget-mb", type=float, default=None, help="Largest peak memory allowed (MiB)")
+    parser.add_argument("--result-root", type=str, default=DEFAULT_RESULT_ROOT)
+    parser.add_argument("--show", action="store_true", help="Print the model's rows of the table too")
+    opt = parser.parse_args()
+
+    if opt.device_type is None or opt.model is None:
+        parser.error("--device-type and --model are required")
+
+    table = load_table(table_path(opt.device_type, opt.result_root))
+    if opt.show:
+        rows = table[(table["model"] == opt.model) & (table["execution"] == opt.execution)]
+        print(rows.to_string(index=False), file=sys.stderr)
+    batch_size = pick(table, opt.model, opt.execution, opt.slo_ms, opt.mem_budget_mb)
+    if batch_size is None:
+        print(f"No batch size of {opt.model} ({opt.execution}) on {opt.device_type} within the limits, "
+              f"run executor.py --autotune first", file=sys.stderr)
+        sys.exit(1)
+    # Only the batch size on stdout, for run.sh
+    print(batch_size)
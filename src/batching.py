@@ -0,0 +1,53 @@
+import collections
+import threading
+import time
+
+
+class Request:
+    __slots__ = ("payload", "arrival_time")
+
+    def __init__(self, payload, arrival_time):
+        self.payload = payload
+        self.arrival_time = arrival_time
+
+
+class DynamicBatcher:
+    # Holds individual requests for one model and releases them as a batch
+    # once max_batch_size requests are waiting, or once the oldest waiting
+    # request has been queued for max_wait seconds.
+    def __init__(self, max_batch_size=1, max_wait=0.0, request_factory=None):
+        assert max_batch_size >= 1
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._request_factory = request_factory
+        self._requests = collections.deque()
+        self._cond = threading.Condition()
+
+    def __len__(self):
+        with self._cond:
+            return len(self._requests)
+
+    def put(self, arrival_time, payload=None):
+        if payload is None and self._request_factory is not None:
+            payload = self._request_factory()
+        with self._cond:
+            self._requests.append(Request(payload, arrival_time))
+            if len(self._requests) == 1 or len(self._requests) >= self.max_batch_size:
+                self._cond.notify()
+
+    def next_batch(self, timeout=None):
+        # Returns an empty list if no request arrived within timeout
+        with self._cond:
+            if not self._cond.wait_for(lambda: len(self._requests) > 0, timeout):
+                return []
+
+            # Hold the batch open until it fills up or the deadline passes
+            deadline = self._requests[0].arrival_time + self.max_wait
+            while len(self._requests) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+
+            batch_size = min(self.max_batch_size, len(self._requests))
+            return [self._requests.popleft() for _ in range(batch_size)]
@@ -0,0 +1,180 @@
+import os
+import pickle
+import select
+import socket
+import struct
+import threading
+
+# Control plane messages exchanged between the orchestrator and executors:
+#   executor -> orchestrator: READY once the model is loaded and warmed up
+#   orchestrator -> executor: START / STOP the experiment
+#   executor -> orchestrator: PROGRESS snapshots while running (optional)
+#   executor -> orchestrator: RESULTS with the inference stats
+READY = "ready"
+START = "start"
+STOP = "stop"
+PROGRESS = "progress"
+RESULTS = "results"
+
+HEADER = struct.Struct("!I")
+
+
+def send_msg(sock, msg_type, payload=None):
+    data = pickle.dumps((msg_type, payload))
+    sock.sendall(HEADER.pack(len(data)) + data)
+
+
+def _recv_exact(sock, size):
+    buf = bytearray()
+    while len(buf) < size:
+        chunk = sock.recv(size - len(buf))
+        if not chunk:
+            raise ConnectionError("Control channel closed")
+        buf.extend(chunk)
+    return bytes(buf)
+
+
+def recv_msg(sock):
+    size, = HEADER.unpack(_recv_exact(sock, HEADER.size))
+    return pickle.loads(_recv_exact(sock, size))
+
+
+class ControlClient:
+    def __init__(self, socket_path, tid):
+        self.tid = tid
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.connect(socket_path)
+        self._send_lock = threading.Lock()
+
+    def _send(self, msg_type, payload=None):
+        with self._send_lock:
+            send_msg(self._sock, msg_type, payload)
+
+    def ready(self):
+        self._send(READY, {"tid": self.tid, "pid": os.getpid()})
+
+    def wait_for_start(self, on_stop):
+        # Blocks (without spinning) until the orchestrator starts the
+        # experiment, then listens for STOP in the background
+        msg_type, _ = recv_msg(self._sock)
+        if msg_type == STOP:
+            on_stop()
+            return
+        assert msg_type == START, f"Unexpected control message: {msg_type}"
+        threading.Thread(target=self._wait_for_stop, args=(on_stop,), daemon=True).start()
+
+    def _wait_for_stop(self, on_stop):
+        try:
+            while True:
+                msg_type, _ = recv_msg(self._sock)
+                if msg_type == STOP:
+                    break
+        except OSError:
+            # Also the socket send_results() closed when the executor ended
+            # on its own
+            pass
+        on_stop()
+
+    def progress(self, tid, snapshot):
+        # (secs since start, requests completed, latency histogram snapshot)
+        self._send(PROGRESS, (tid, snapshot))
+
+    def send_results(self, results):
+        self._send(RESULTS, results)
+        self._sock.close()
+
+
+class ControlServer:
+    def __init__(self, socket_path):
+        self.socket_path = socket_path
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.bind(socket_path)
+        self._sock.listen()
+        self._conns = []
+        self._results = {} # conn => results that came in while polling progress
+        self.failed = [] # tids whose connection broke, without results
+
+    def wait_for_ready(self, num_clients, is_alive, timeout=None):
+        # Accept connections until every client has reported READY. is_alive
+        # is polled so that an executor dying during load fails fast.
+        self._sock.settimeout(1)
+        waited = 0
+        while len(self._conns) < num_clients:
+            if not is_alive():
+                raise RuntimeError("An executor exited before it was ready")
+            if timeout is not None and waited >= timeout:
+                raise TimeoutError("Executors did not load in time")
+            try:
+                conn, _ = self._sock.accept()
+            except socket.timeout:
+                waited += 1
+                continue
+            conn.settimeout(None)
+            msg_type, info = recv_msg(conn)
+            assert msg_type == READY, f"Unexpected control message: {msg_type}"
+            self._conns.append((info, conn))
+        return [info for info, _ in self._conns]
+
+    def broadcast(self, msg_type):
+        for _, conn in self._conns:
+            try:
+                send_msg(conn, msg_type)
+            except OSError:
+                pass
+
+    def start(self):
+        self.broadcast(START)
+
+    def stop(self):
+        self.broadcast(STOP)
+
+    def receive_progress(self, timeout):
+        # PROGRESS messages that arrive within timeout secs. An executor that
+        # ends on its own may send its RESULTS in between, kept for later.
+        conns = [conn for _, conn in self._conns if conn not in self._results]
+        if not conns:
+            return []
+        readable, _, _ = select.select(conns, [], [], timeout)
+        progress = []
+        for conn in readable:
+            try:
+                msg_type, payload = recv_msg(conn)
+            except ConnectionError:
+                # The executor died, the others' results are still collected
+                info = next(info for info, c in self._conns if c is conn)
+                self._conns = [(i, c) for i, c in self._conns if c is not conn]
+                conn.close()
+                self.failed.append(info["tid"])
+                print(f"Executor {info['tid']} (pid {info['pid']}) disconnected")
+                continue
+            if msg_type == PROGRESS:
+                progress.append(payload)
+            else:
+                assert msg_type == RESULTS, f"Unexpected control message: {msg_type}"
+                self._results[conn] = payload
+        return progress
+
+    def collect_results(self):
+        results = []
+        for _, conn in self._conns:
+            if conn in self._results:
+                results.append(self._results.pop(conn))
+                conn.close()
+                continue
+            msg_type, payload = recv_msg(conn)
+            while msg_type == PROGRESS:
+                msg_type, payload = recv_msg(conn)
+            assert msg_type == RESULTS, f"Unexpected control message: {msg_type}"
+            results.append(payload)
+            conn.close()
+        self._conns = []
+        return results
+
+    def close(self):
+        for _, conn in self._conns:
+            conn.close()
+        self._sock.close()
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
@@ -0,0 +1,181 @@
+# Online steady state and convergence detection for adaptive run durations
+# (orchestrator.py --target-ci). Executors report a cumulative snapshot of
+# their completed requests and latency histogram every second. Each model's
+# run is cut into windows between snapshots, and the warm up transient is
+# the prefix of windows that MSER (marginal standard error rule) truncates
+# from the per-window throughput. Confidence intervals of the steady state
+# throughput and latency percentiles come from a bootstrap over whole
+# windows, which keeps the correlation between neighbouring requests. A run
+# has converged once the interval of every model is narrower than the
+# target, relative to its estimate. tests/test_convergence.py runs the
+# monitor on synthetic runs with a known transient.
+
+import math
+import numpy as np
+from histogram import LogHistogram # type: ignore
+
+CI_PERCENTILES = [50, 99]
+MIN_WINDOWS = 10 # steady state windows needed before trusting an interval
+NUM_RESAMPLES = 500
+
+
+def mser_truncation(values):
+    # Number of leading values to drop: the d <= n/2 minimizing the
+    # variance of the mean of the rest, sum((x - mean)^2) / (n - d)^2
+    values = np.asarray(values, dtype=float)
+    n = len(values)
+    best, best_d = math.inf, 0
+    for d in range(n // 2 + 1):
+        rest = values[d:]
+        score = ((rest - rest.mean()) ** 2).sum() / len(rest) ** 2
+        if score < best:
+            best, best_d = score, d
+    return best_d
+
+
+class ModelProgress:
+    # Windows between the snapshots of one model
+    def __init__(self):
+        self.times = [0.0]
+        self.completed = [0]
+        self.snapshots = [None]
+        self.window_hists = []
+        self.columns = {} # bucket value => column of the window counts
+
+    def add(self, elapsed, completed, hist_snapshot):
+        hist = LogHistogram.from_snapshot(hist_snapshot)
+        window = hist.copy()
+        if self.snapshots[-1] is not None:
+            window.subtract(LogHistogram.from_snapshot(self.snapshots[-1]))
+        buckets = {}
+        for value, count in window.buckets():
+            buckets[self.columns.setdefault(value, len(self.columns))] = count
+        self.window_hists.append(buckets)
+        self.times.append(elapsed)
+        self.completed.append(completed)
+        self.snapshots.append(hist_snapshot)
+
+    def __len__(self):
+        return len(self.window_hists)
+
+
+class ConvergenceMonitor:
+    def __init__(self, num_models, target=0.05, confidence=0.95, percentiles=CI_PERCENTILES,
+                 min_windows=MIN_WINDOWS, num_resamples=NUM_RESAMPLES, seed=0):
+        self.num_models = num_models
+        self.target = target
+        self.confidence = confidence
+        self.percentiles = percentiles
+        self.min_windows = min_windows
+        self.num_resamples = num_resamples
+        self.rng = np.random.default_rng(seed)
+        self.models = {}
+        self._estimates = {}
+
+    def add(self, tid, elapsed, completed, hist_snapshot):
+        self.models.setdefault(tid, ModelProgress()).add(elapsed, completed, hist_snapshot)
+        self._estimates.pop(tid, None)
+
+    def _interval(self, samples):
+        alpha = (1 - self.confidence) / 2
+        return tuple(float(x) for x in np.nanquantile(samples, [alpha, 1 - alpha]))
+
+    def estimate(self, tid):
+        # Steady state estimates of a model, None until it has enough windows:
+        # {"transient": secs, "start": index of the first steady snapshot,
+        #  "tput": (value, lo, hi), "total_p<q>": (value, lo, hi), ...}
+        if tid in self._estimates:
+            return self._estimates[tid]
+        progress = self.models.get(tid)
+        if progress is None or len(progress) < self.min_windows:
+            return None
+
+        times = np.array(progress.times)
+        completed = np.array(progress.completed, dtype=float)
+        durations = np.diff(times)
+        done = np.diff(completed)
+        start = mser_truncation(done / np.maximum(durations, 1e-9))
+        if len(progress) - start < self.min_windows:
+            return None
+
+        # Window weights of every resample, one multinomial draw per resample
+        num_windows = len(progress) - start
+        weights = self.rng.multinomial(num_windows, np.full(num_windows, 1 / num_windows),
+                                       size=self.num_resamples)
+        estimate = {"transient": float(times[start]), "start": int(start)}
+
+        tput = (completed[-1] - completed[start]) / (times[-1] - times[start])
+        with np.errstate(invalid="ignore", divide="ignore"):
+            tput_samples = (weights @ done[start:]) / (weights @ durations[start:])
+        estimate["tput"] = (float(tput),) + self._interval(tput_samples)
+
+        # Latency percentiles of the steady windows, and of every resample
+        values = np.zeros(len(progress.columns))
+        for value, column in progress.columns.items():
+            values[column] = value
+        order = np.argsort(values)
+        counts = np.zeros((num_windows, len(values)))
+        for row, buckets in enumerate(progress.window_hists[start:]):
+            for column, count in buckets.items():
+                counts[row, column] = count
+        counts = counts[:, order]
+        values = values[order]
+        sampled = np.vstack([counts.sum(axis=0), weights @ counts])
+        cumulative = np.cumsum(sampled, axis=1)
+        total = cumulative[:, -1]
+        for q in self.percentiles:
+            # Same rank convention as LogHistogram.percentile
+            rank = q / 100 * (total - 1)
+            index = np.minimum((cumulative <= rank[:, None]).sum(axis=1), len(values) - 1)
+            samples = np.where(total > 0, values[index], np.nan)
+            estimate[f"total_p{q}"] = (float(samples[0]),) + self._interval(samples[1:])
+
+        self._estimates[tid] = estimate
+        return estimate
+
+    def relative_widths(self, tid):
+        # Half width of every interval relative to its estimate
+        estimate = self.estimate(tid)
+        if estimate is None:
+            return None
+        widths = {}
+        for key, value in estimate.items():
+            if isinstance(value, tuple):
+                point, lo, hi = value
+                widths[key] = (hi - lo) / 2 / point if point > 0 else math.inf
+        return widths
+
+    def converged(self):
+        if len(self.models) < self.num_models:
+            return False
+        for tid in self.models:
+            widths = self.relative_widths(tid)
+            if widths is None or not all(width <= self.target for width in widths.values()):
+                return False
+        return True
+
+    def status(self):
+        parts = []
+        for tid in sorted(self.models):
+            widths = self.relative_widths(tid)
+            if widths is None:
+                parts.append(f"{tid}: {len(self.models[tid])} windows")
+            else:
+                parts.append(f"{tid}: " + ", ".join(f"{key} ±{width:.1%}" for key, width in widths.items()))
+        return "; ".join(parts)
+
+    def apply(self, tid, infer_stats):
+        # Replaces the whole-run throughput and latency histogram of a result
+        # (infer_stats of executor.py) by their steady state, and adds the
+        # intervals. Other breakdowns still cover the whole run.
+        estimate = self.estimate(tid)
+        if estimate is None:
+            return
+        progress = self.models[tid]
+        first = progress.snapshots[estimate["start"]]
+        infer_stats[1] = estimate["tput"][0]
+        if first is not None:
+            infer_stats[2] = infer_stats[2].copy().subtract(LogHistogram.from_snapshot(first))
+        infer_stats[3]["convergence"] = {
+            key: value[1:] if isinstance(value, tuple) else value for key, value in estimate.items()
+        }
@@ -0,0 +1,106 @@
+# Stand-in for executor.py that speaks the same control protocol but sleeps
+# instead of running a model, so the orchestration path can be exercised
+# without a GPU (python3 src/orchestrator.py --dry-run ...). Setting
+# DRY_RUN_FAIL_RATE=<p> makes it crash at start-up with probability p, to
+# exercise the retries of sweep.py.
+
+import argparse
+import os
+import random
+import sys
+import time
+from control import ControlClient # type: ignore
+from histogram import LogHistogram # type: ignore
+from timeline import TimelineRecorder, TIMELINE_FILE # type: ignore
+
+# Rough per-request latency (secs) of each model at batch size 1
+DRY_RUN_LATENCY = {
+    "diffusion": 2.5,
+    "gpt": 1.5,
+    "whisper": 0.25,
+    "bert": 0.005,
+}
+# Requests start this much slower and speed up over the first secs of a
+# run, a warm up transient for convergence.py to cut
+DRY_RUN_SLOWDOWN = 1.0
+DRY_RUN_WARMUP = 3.0
+
+
+class DryRunExecutor:
+    def __init__(self, model, batch_size, tid, control, snapshot_interval=None, timeline=None):
+        self.model = model
+        self.batch_size = batch_size
+        self.tid = tid
+        self.control = control
+        self.latency = DRY_RUN_LATENCY.get(model.split("@")[0], 0.01) * batch_size
+        self.job_completed = False
+        # Progress snapshots for the orchestrator, as executor.py --report-progress
+        self.snapshot_interval = snapshot_interval
+        self.timeline = timeline
+
+    def _catch_to_end(self):
+        self.job_completed = True
+
+    def run(self, num_reqs):
+        time.sleep(random.uniform(0.1, 0.5))
+        if random.random() < float(os.environ.get("DRY_RUN_FAIL_RATE", 0)):
+            raise RuntimeError("Dry run failure injected by DRY_RUN_FAIL_RATE")
+        self.control.ready()
+        self.control.wait_for_start(on_stop=self._catch_to_end)
+
+        completed = 0
+        total_hist = LogHistogram()
+        process_start_time = time.time()
+        next_snapshot = process_start_time + (self.snapshot_interval or 0)
+        for _ in range(num_reqs):
+            if self.job_completed:
+                break
+            start_time = time.time()
+            slowdown = 1 + DRY_RUN_SLOWDOWN * max(0, 1 - (start_time - process_start_time) / DRY_RUN_WARMUP)
+            time.sleep(self.latency * slowdown * random.uniform(0.9, 1.1))
+            completed += self.batch_size
+            end_time = time.time()
+            if self.timeline is not None:
+                # The timeline is on the clock of power.py
+                now = time.monotonic()
+                self.timeline.record(now - (end_time - start_time), now, self.batch_size)
+            total_hist.record(end_time - start_time)
+            if self.snapshot_interval and end_time >= next_snapshot and not self.job_completed:
+                self.control.progress(self.tid, (end_time - process_start_time, completed, total_hist.snapshot()))
+                next_snapshot = end_time + self.snapshot_interval
+        process_end_time = time.time()
+
+        infer_stats = [
+            f"{self.model}-{self.batch_size}",
+            completed / (process_end_time - process_start_time),
+            total_hist,
+            {}
+        ]
+        if self.timeline is not None:
+            self.timeline.close()
+            infer_stats[3]["timeline"] = self.timeline.path
+        self.control.send_results((self.tid, infer_stats))
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(allow_abbrev=False)
+    parser.add_argument("--model", type=str, default='diffusion')
+    parser.add_argument("--batch-size", type=int, default=1)
+    parser.add_argument("--num-infer", type=int, default=sys.maxsize)
+    parser.add_argument("--tid", type=int, default=0)
+    parser.add_argument("--control-socket", type=str, required=True)
+    parser.add_argument("--snapshot-interval", type=float, default=None)
+    parser.add_argument("--report-progress", action="store_true")
+    parser.add_argument("--timeline", type=str, default=None)
+    opt, unused_args = parser.parse_known_args()
+
+    executor = DryRunExecutor(
+        opt.model,
+        opt.batch_size,
+        opt.tid,
+        ControlClient(opt.control_socket, opt.tid),
+        snapshot_interval=opt.snapshot_interval if opt.report_progress else None,
+        timeline=TimelineRecorder(os.path.join(opt.timeline, TIMELINE_FILE.format(opt.tid))) if opt.timeline else None
+    )
+    executor.run(opt.num_infer)
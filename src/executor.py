@@ -1,35 +1,106 @@
 import argparse
+import resource
 import signal
 import time
 import sys
 import pickle
+import threading
 import torch
 import os
-from inference import get_inference_object # type: ignore
+from inference import get_inference_object, EXECUTIONS # type: ignore
+from arrivals import ArrivalThread, poisson_offsets, load_trace, trace_offsets # type: ignore
+from batching import DynamicBatcher # type: ignore
+from control import ControlClient # type: ignore
+from histogram import LogHistogram # type: ignore
+from postprocess import PostProcessor, get_sink # type: ignore
+from timeline import TimelineRecorder, TIMELINE_FILE # type: ignore
+from weight_share import SharedWeights # type: ignore
+from autotune import DEFAULT_BATCH_SIZES, DEFAULT_SECS, DEFAULT_RESULT_ROOT, autotune, is_oom, save_table, table_path # type: ignore
 
 
 WARMUP_REQS = 2
+CALIBRATION_REQS = 5
 LARGE_NUM_REQS = 100000
+SNAPSHOT_INTERVAL = 10 # secs
+LOAD_MODES = ["closed", "poisson", "trace"]
+BATCHING = ["static", "continuous"]
+
+
+def get_memory_stats():
+    # Peak GPU memory held by the caching allocator and peak host RSS, in bytes
+    gpu_mem = torch.cuda.max_memory_allocated() if torch.cuda.is_available() else 0
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return {"gpu_mem": gpu_mem, "rss": rss}
+
+
+def set_execution(model_obj, execution):
+    # Models without static-shape modules (GPT) stay eager
+    if execution != "eager" and not model_obj.COMPILABLE:
+        print(f"{model_obj.get_id()} has no static-shape modules to compile, running it eager")
+        return
+    model_obj.execution = execution
+
 
 class InferenceExecutor:
-    def __init__(self, model_obj, num_infer, tid):
+    def __init__(self, model_obj, num_infer, tid,
+                 load_mode="closed", load=1.0, rate=None, trace_file=None,
+                 max_batch_size=None, max_wait=0.0, control=None,
+                 snapshot_interval=SNAPSHOT_INTERVAL, continuous=False,
+                 postprocessor=None, progress=None, timeline=None):
         self.model_obj = model_obj
         self.num_infer = num_infer
         self.tid = tid
 
-        # Process synchronization mechanism
-        self.start = False
+        # Load generation
+        self.load_mode = load_mode
+        self.load = load
+        self.rate = rate
+        self.trace_file = trace_file
+
+        # Dynamic batching of individual requests (open loop only)
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+
+        # Requests join and leave the model's engine at every decode step
+        # (GPT only, see gpt_engine.py)
+        self.continuous = continuous
+
+        # Decoding and printing of outputs runs off the critical path, the
+        # timed region then only covers getting the outputs off the GPU
+        self.postprocessor = postprocessor
+        self.model_obj.postprocessor = postprocessor
+
+        # Periodic snapshots of the latency histogram during the run, also
+        # handed to progress(tid, snapshot) to detect convergence online
+        self.snapshot_interval = snapshot_interval
+        self.snapshots = []
+        self._next_snapshot = 0
+        self.progress = progress
+
+        # timeline.TimelineRecorder of the batches of the measured run, for
+        # the attribution of energy between co-located models
+        self.timeline = timeline
+
+        # Process synchronization mechanism: a ControlClient connected to
+        # the orchestrator, or else SIGUSR1/SIGUSR2 from run_job_mix.sh
+        self.control = control
+        self.start = threading.Event()
         self.finish = False
         self.job_completed = False
     
-    def _catch_to_start(self, signum, frame):
-        self.start = True
+    def _catch_to_start(self, signum=None, frame=None):
+        self.start.set()
 
-    def _catch_to_end(self, signum, frame):
+    def _catch_to_end(self, signum=None, frame=None):
         self.finish = True
         self.job_completed = True
     
     def _indicate_ready(self):
+        if self.control is not None:
+            self.control.ready()
+            self.control.wait_for_start(on_stop=self._catch_to_end)
+            return
+
         # Wait til user instructs to start via signal handler
         self.install_signal_handler()
         
@@ -37,13 +108,19 @@ class InferenceExecutor:
         # there by the user can signal when all procs are ready
         with open(f"/tmp/{os.getpid()}", "w") as ready_file:
             ready_file.write("")
-        while not self.start:
+
+        # Block instead of spinning so the pinned core stays idle. The
+        # timeout only bounds how late a signal can be noticed.
+        while not self.start.wait(1):
             pass
         return
 
     def _return_infer_stats(self, infer_stats):
         infer_stats.insert(0, f"{self.model_obj.get_id()}")
         result = (self.tid, infer_stats)
+        if self.control is not None:
+            self.control.send_results(result)
+            return
         with open(f"/tmp/{os.getpid()}.pkl", "wb") as h:
             pickle.dump(result, h)
 
@@ -51,37 +128,251 @@ class InferenceExecutor:
         signal.signal(signal.SIGUSR1, self._catch_to_start)
         signal.signal(signal.SIGUSR2, self._catch_to_end)
 
+    def _reset_snapshots(self, process_start_time):
+        self.snapshots = []
+        self._next_snapshot = process_start_time + self.snapshot_interval
+
+    def _maybe_snapshot(self, now, process_start_time, completed, total_hist):
+        if now < self._next_snapshot:
+            return
+        self.snapshots.append((now - process_start_time, completed, total_hist.snapshot()))
+        self._next_snapshot = now + self.snapshot_interval
+        if self.progress is not None and not self.job_completed:
+            self.progress(self.tid, self.snapshots[-1])
+
+    def _record(self, start_time, end_time, num_requests):
+        if self.timeline is not None:
+            self.timeline.record(start_time, end_time, num_requests)
+
+    def _mark_postprocess(self, reference_times):
+        if self.postprocessor is not None:
+            self.postprocessor.mark(reference_times)
+
+    def _reset_postprocess(self, extras=None):
+        # Waits for outstanding post-processing and hands back the end to
+        # end times (until outputs were post-processed) of the run
+        if self.postprocessor is not None:
+            end_to_end = self.postprocessor.reset()
+            if extras is not None:
+                extras["e2e_times"] = end_to_end
+        return extras
+
     def run_infer_executor(self, num_reqs):
         completed = 0
-        total_time_arr = []
+        total_hist = LogHistogram()
 
-        process_start_time = time.time()
+        self._reset_postprocess()
+        process_start_time = time.monotonic()
+        self._reset_snapshots(process_start_time)
         for _ in range(num_reqs):
             if self.job_completed:
                 break
             
-            start_time = time.time()
-            completed += self.model_obj.infer()
-            end_time = time.time()
+            start_time = time.monotonic()
+            self._mark_postprocess([start_time])
+            if self.model_obj.time_slice is not None:
+                # Waits for the device, counted in the request's latency
+                self.model_obj.time_slice.new_request()
+            with self.model_obj.phases.range("request"):
+                served = self.model_obj.infer()
+            end_time = time.monotonic()
+            completed += served
+            self._record(start_time, end_time, served)
             
             total_time = end_time - start_time
-            total_time_arr.append(total_time)
+            total_hist.record(total_time)
+            self._maybe_snapshot(end_time, process_start_time, completed, total_hist)
 
-        process_end_time = time.time()
+        process_end_time = time.monotonic()
 
         return [
             completed / (process_end_time - process_start_time),
-            total_time_arr
+            total_hist,
+            self._reset_postprocess({"snapshots": self.snapshots})
         ]
 
-    def run(self):
+    def _get_arrival_offsets(self):
+        if self.load_mode == "poisson":
+            return poisson_offsets(self.rate)
+        return trace_offsets(load_trace(self.trace_file), self.rate)
+
+    def _calibrate_rate(self):
+        # Offered load is a fraction of the closed loop capacity of the model.
+        # Without dynamic batching, every arrival is a whole batch.
+        if self.rate is None:
+            capacity = self.run_infer_executor(CALIBRATION_REQS)[0]
+            if self.max_batch_size is None and not self.continuous:
+                capacity /= self.model_obj._batch_size
+            self.rate = self.load * capacity
+        print(f"Offered load: {self.rate:.3f} reqs/sec ({self.load_mode})")
+
+    def _get_request_queue(self):
+        if self.max_batch_size is None:
+            return DynamicBatcher()
+        return DynamicBatcher(
+            self.max_batch_size,
+            self.max_wait,
+            request_factory=self.model_obj.sample_request
+        )
+
+    def _serve(self, batch):
+        if self.max_batch_size is None:
+            return self.model_obj.infer()
+        return self.model_obj.infer_batch([req.payload for req in batch])
+
+    def run_open_loop_executor(self, num_reqs):
+        completed = 0
+        total_hist = LogHistogram()
+        queue_hist = LogHistogram()
+        service_hist = LogHistogram()
+        batch_size_hist = LogHistogram()
+
+        requests = self._get_request_queue()
+        arrival_thread = ArrivalThread(self._get_arrival_offsets(), requests)
+
+        self._reset_postprocess()
+        process_start_time = time.monotonic()
+        self._reset_snapshots(process_start_time)
+        arrival_thread.start()
+        for _ in range(num_reqs):
+            batch = []
+            while not batch and not self.job_completed:
+                batch = requests.next_batch(timeout=0.1)
+            if self.job_completed:
+                break
+
+            start_time = time.monotonic()
+            self._mark_postprocess([req.arrival_time for req in batch])
+            with self.model_obj.phases.range("request"):
+                served = self._serve(batch)
+            end_time = time.monotonic()
+            completed += served
+            self._record(start_time, end_time, served)
+
+            batch_size_hist.record(len(batch))
+            service_hist.record(end_time - start_time, len(batch))
+            for req in batch:
+                queue_hist.record(start_time - req.arrival_time)
+                total_hist.record(end_time - req.arrival_time)
+            self._maybe_snapshot(end_time, process_start_time, completed, total_hist)
+
+        process_end_time = time.monotonic()
+        arrival_thread.stop()
+
+        return [
+            completed / (process_end_time - process_start_time),
+            total_hist,
+            self._reset_postprocess({
+                "load": self.load,
+                "offered_rate": self.rate,
+                "queue_times": queue_hist,
+                "service_times": service_hist,
+                "batch_sizes": batch_size_hist,
+                "snapshots": self.snapshots,
+            })
+        ]
+
+    def run_continuous_executor(self, num_reqs):
+        engine = self.model_obj.engine
+        completed = 0
+        total_hist = LogHistogram()
+        queue_hist = LogHistogram()
+        service_hist = LogHistogram()
+        batch_size_hist = LogHistogram()
+
+        requests = DynamicBatcher(engine.max_batch_size, request_factory=self.model_obj.sample_request)
+        arrival_thread = ArrivalThread(self._get_arrival_offsets(), requests)
+
+        self._reset_postprocess()
+        process_start_time = time.monotonic()
+        self._reset_snapshots(process_start_time)
+        arrival_thread.start()
+        while completed < num_reqs and not self.job_completed:
+            # Only block on arrivals while the engine has nothing to run
+            for req in requests.next_batch(timeout=0 if len(engine) else 0.1):
+                engine.submit(req.payload, payload=req.arrival_time)
+            if not len(engine):
+                continue
+
+            if engine.running:
+                batch_size_hist.record(len(engine.running))
+            step_start = time.monotonic()
+            with self.model_obj.phases.range("step"):
+                finished = engine.step()
+            self._record(step_start, time.monotonic(), len(finished))
+            for seq in finished:
+                queue_hist.record(seq.admit_time - seq.payload)
+                service_hist.record(seq.finish_time - seq.admit_time)
+                total_hist.record(seq.finish_time - seq.payload)
+            if finished:
+                self._mark_postprocess([seq.payload for seq in finished])
+                self.model_obj.postprocess_sequences(finished)
+            completed += len(finished)
+            self._maybe_snapshot(time.monotonic(), process_start_time, completed, total_hist)
+
+        process_end_time = time.monotonic()
+        arrival_thread.stop()
+
+        return [
+            completed / (process_end_time - process_start_time),
+            total_hist,
+            self._reset_postprocess({
+                "load": self.load,
+                "offered_rate": self.rate,
+                "queue_times": queue_hist,
+                "service_times": service_hist,
+                "batch_sizes": batch_size_hist,
+                "snapshots": self.snapshots,
+            })
+        ]
+
+    def prepare(self):
         # Load Model and transfer inputs
         self.model_obj.load_model()
         self.model_obj.load_data()
 
-        # Warm up the model
-        self.run_infer_executor(WARMUP_REQS)
-        reqs_completed = WARMUP_REQS
+        # Warm up the model, compiled models compile on their first requests
+        with self.model_obj._load_phase("warmup"):
+            self.run_infer_executor(WARMUP_REQS)
+        if self.load_mode != "closed":
+            self._calibrate_rate()
+
+    def execute(self):
+        # Leaves out the phase breakdown and timeline of warm up and calibration
+        self.model_obj.phases.clear()
+        if self.timeline is not None:
+            self.timeline.clear()
+        if self.load_mode == "closed":
+            infer_stats = self.run_infer_executor(
+                self.num_infer,
+            )
+        elif self.continuous:
+            infer_stats = self.run_continuous_executor(
+                self.num_infer,
+            )
+        else:
+            infer_stats = self.run_open_loop_executor(
+                self.num_infer,
+            )
+        infer_stats[2]["load_times"] = dict(self.model_obj.load_times)
+        infer_stats[2]["weight_mem"] = self.model_obj.weight_bytes
+        if self.timeline is not None:
+            self.timeline.close()
+            infer_stats[2]["timeline"] = self.timeline.path
+        # Waits for the phases of the last requests still on the device
+        self.model_obj.phases.flush()
+        infer_stats[2]["infer_times"] = dict(self.model_obj.infer_times)
+        return infer_stats
+
+    def run(self):
+        try:
+            self.prepare()
+        except Exception as exc:
+            # profiler.sh waits for either the ready or the OOM marker
+            if is_oom(exc) and self.control is None:
+                with open(f"/tmp/{os.getpid()}_oom", "w") as oom_file:
+                    oom_file.write("")
+            raise
 
         # Ready for experiment
         self._indicate_ready()
@@ -90,38 +381,131 @@ class InferenceExecutor:
         if torch.cuda.is_available():
             torch.cuda.cudart().cudaProfilerStart()
             torch.cuda.nvtx.range_push("start")
-        infer_stats = self.run_infer_executor(
-            self.num_infer,
-        )
+        infer_stats = self.execute()
         if torch.cuda.is_available():
             torch.cuda.nvtx.range_pop()
             torch.cuda.cudart().cudaProfilerStop()
+        infer_stats[2].update(get_memory_stats())
         
         # Give stats back to user
         self._return_infer_stats(infer_stats)
+        if self.postprocessor is not None:
+            self.postprocessor.close()
 
 
 if __name__=='__main__':
 
     parser = argparse.ArgumentParser(allow_abbrev=False)
     parser.add_argument("--device-id", type=int, default=0)
-    parser.add_argument("--model", type=str, default='diffusion')
+    parser.add_argument("--cpu", action="store_true", help="Run the model on the CPU instead of --device-id")
+    parser.add_argument("--model", type=str, default='diffusion',
+                        help="diffusion, bert, gpt, whisper or synthetic:<one of them>, "
+                             "optionally @fp32, @fp16, @bf16, @int8 or @int8w")
+    parser.add_argument("--synthetic-profiles", type=str, default=None,
+                        help="Device result dir synthetic models are calibrated from (default results/a100)")
+    parser.add_argument("--execution", type=str, default="eager", choices=EXECUTIONS,
+                        help="compile: torch.compile the static-shape modules, cudagraphs: also capture CUDA graphs")
     parser.add_argument("--batch-size", type=int, default=1)
     parser.add_argument("--num-infer", type=int, default=sys.maxsize)
     parser.add_argument("--tid", type=int, default=0)
+    parser.add_argument("--load-mode", type=str, default="closed", choices=LOAD_MODES)
+    parser.add_argument("--load", type=float, default=1.0,
+                        help="Offered load as a fraction of closed loop capacity")
+    parser.add_argument("--rate", type=float, default=None,
+                        help="Offered load in reqs/sec, overrides --load")
+    parser.add_argument("--trace-file", type=str, default=None,
+                        help="Arrival timestamps (secs) replayed in trace mode")
+    parser.add_argument("--max-batch-size", type=int, default=None,
+                        help="Dynamically batch individual open loop requests")
+    parser.add_argument("--max-wait-ms", type=float, default=0.0,
+                        help="Longest a request waits for its batch to fill up")
+    parser.add_argument("--control-socket", type=str, default=None,
+                        help="Orchestrator control socket (default: signals)")
+    parser.add_argument("--snapshot-interval", type=float, default=SNAPSHOT_INTERVAL,
+                        help="Secs between snapshots of the latency histogram")
+    parser.add_argument("--report-progress", action="store_true",
+                        help="Send every snapshot to the orchestrator (adaptive run duration)")
+    parser.add_argument("--weight-cache", type=str, default=None,
+                        help="Dir of pre-converted safetensors snapshots of the models")
+    parser.add_argument("--share-weights", action="store_true",
+                        help="Share read-only weights with the executors of the same model on the device")
+    parser.add_argument("--batching", type=str, default="static", choices=BATCHING,
+                        help="continuous: admit and retire requests at every decode step (gpt)")
+    parser.add_argument("--sink", type=str, default="print",
+                        help="Where post-processed outputs go: print, quiet or file:<path>")
+    parser.add_argument("--postprocess-workers", type=int, default=1)
+    parser.add_argument("--postprocess-queue-size", type=int, default=64,
+                        help="Outputs waiting for post-processing before inference blocks")
+    parser.add_argument("--prefix-cache-entries", type=int, default=64,
+                        help="Prompts whose KV is kept for reuse with continuous batching, 0 disables")
+    parser.add_argument("--timeline", type=str, default=None,
+                        help="Dir to record the interval of every batch in (timeline_<tid>.bin)")
+    parser.add_argument("--autotune", action="store_true",
+                        help="Sweep the batch sizes of the model instead, into the device's batch_sizes.csv")
+    parser.add_argument("--device-type", type=str, default=None,
+                        help="Device the autotuned table is for, e.g. a100 (cpu with --cpu)")
+    parser.add_argument("--batch-sizes", type=lambda x: [int(b) for b in x.split(",")], default=DEFAULT_BATCH_SIZES,
+                        help="Batch sizes to autotune, larger ones are skipped after an out of memory error")
+    parser.add_argument("--autotune-secs", type=float, default=DEFAULT_SECS,
+                        help="Secs the model is served at each batch size")
+    parser.add_argument("--mem-budget-mb", type=float, default=None,
+                        help="Memory an autotuned batch may use (MiB), larger batches count as out of memory")
+    parser.add_argument("--result-root", type=str, default=DEFAULT_RESULT_ROOT,
+                        help="Where the device dirs with batch_sizes.csv are")
     opt, unused_args = parser.parse_known_args()
 
+    if opt.load_mode == "trace" and opt.trace_file is None:
+        parser.error("--trace-file is required with --load-mode trace")
+    if opt.max_batch_size is not None and opt.load_mode == "closed" and opt.batching == "static":
+        parser.error("--max-batch-size requires an open loop --load-mode")
+
     # Create batched inference object
     model_obj = get_inference_object(
         opt.model,
-        opt.device_id,
-        opt.batch_size
+        "cpu" if opt.cpu else opt.device_id,
+        opt.batch_size,
+        weight_cache=opt.weight_cache,
+        synthetic_profiles=opt.synthetic_profiles
     )
+    set_execution(model_obj, opt.execution)
+    if opt.share_weights:
+        model_obj.weight_share = SharedWeights(model_obj._device)
+    if opt.batching == "continuous":
+        if not hasattr(model_obj, "enable_engine"):
+            parser.error(f"--batching continuous is not supported by {opt.model}")
+        model_obj.enable_engine(opt.max_batch_size or 8, opt.prefix_cache_entries)
+
+    if opt.autotune:
+        if opt.device_type is None:
+            parser.error("--autotune requires --device-type")
+        model_obj.postprocessor = PostProcessor(get_sink(opt.sink), opt.postprocess_workers,
+                                                opt.postprocess_queue_size)
+        rows = autotune(model_obj, opt.batch_sizes, opt.autotune_secs, opt.mem_budget_mb)
+        model_obj.postprocessor.close()
+        path = table_path(opt.device_type, opt.result_root)
+        save_table(path, opt.model, model_obj.execution, rows)
+        print(f"Batch sizes of {opt.model} ({model_obj.execution}) saved to {path}")
+        sys.exit(0)
 
+    control = ControlClient(opt.control_socket, opt.tid) if opt.control_socket else None
+    if opt.report_progress and control is None:
+        parser.error("--report-progress requires --control-socket")
     executor = InferenceExecutor(
         model_obj,
         opt.num_infer,
-        opt.tid
+        opt.tid,
+        load_mode=opt.load_mode,
+        load=opt.load,
+        rate=opt.rate,
+        trace_file=opt.trace_file,
+        max_batch_size=opt.max_batch_size,
+        max_wait=opt.max_wait_ms / 1000,
+        control=control,
+        snapshot_interval=opt.snapshot_interval,
+        continuous=opt.batching == "continuous",
+        postprocessor=PostProcessor(get_sink(opt.sink), opt.postprocess_workers, opt.postprocess_queue_size),
+        progress=control.progress if opt.report_progress else None,
+        timeline=TimelineRecorder(os.path.join(opt.timeline, TIMELINE_FILE.format(opt.tid))) if opt.timeline else None
     )
 
     executor.run()
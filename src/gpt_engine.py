@@ -0,0 +1,314 @@
+# Iteration-level (continuous) batching for causal LMs. Instead of running
+# one padded batch until its longest sequence is done, every decode step
+# runs the sequences in flight as one batch, retires the ones that hit EOS
+# or max_length and admits waiting ones into the freed slots. The KV of the
+# running batch lives in a buffer preallocated for max_batch_size slots,
+# one row per sequence, right-aligned on a shared column cursor and masked
+# before each sequence's start. A decode step passes views of it to the
+# model and writes the new column in place; rows are only moved when a
+# sequence retires (the last row fills the hole) and columns only when the
+# cursor reaches the end of the buffer. Waiting sequences are prefilled
+# together as one padded batch. Prompt KV is kept in a prefix cache, so a
+# prompt that shares a prefix with an earlier one only runs its remaining
+# tokens through the model. tests/test_gpt_engine.py runs a tiny, randomly
+# initialized GPT-J on the CPU against HF generate().
+
+import collections
+import time
+import torch
+import torch.nn.functional as F
+
+
+def to_cache(past):
+    # Per-layer (key, value) list => whatever past_key_values the model takes
+    from transformers import DynamicCache # type: ignore
+    if hasattr(DynamicCache, "from_legacy_cache"):
+        return DynamicCache.from_legacy_cache(tuple(past))
+    return DynamicCache(past)
+
+
+def from_cache(cache):
+    if isinstance(cache, (tuple, list)):
+        return [tuple(layer[:2]) for layer in cache]
+    if hasattr(cache, "to_legacy_cache"):
+        return list(cache.to_legacy_cache())
+    return [(layer.keys, layer.values) for layer in cache.layers]
+
+
+def sample_next(logits, do_sample=True, temperature=1.0, top_k=0, top_p=1.0):
+    # logits: [batch, vocab] => [batch] token ids
+    if not do_sample:
+        return torch.argmax(logits, dim=-1)
+    logits = logits / temperature
+    if top_k > 0:
+        kth = torch.topk(logits, min(top_k, logits.shape[-1]), dim=-1).values[:, -1:]
+        logits = logits.masked_fill(logits < kth, float("-inf"))
+    if top_p < 1.0:
+        sorted_logits, sorted_idx = torch.sort(logits, descending=True, dim=-1)
+        cum_probs = torch.cumsum(F.softmax(sorted_logits, dim=-1), dim=-1)
+        # Keep the smallest set of tokens whose probability reaches top_p
+        remove = cum_probs - F.softmax(sorted_logits, dim=-1) >= top_p
+        sorted_logits = sorted_logits.masked_fill(remove, float("-inf"))
+        logits = torch.full_like(logits, float("-inf")).scatter(-1, sorted_idx, sorted_logits)
+    return torch.multinomial(F.softmax(logits, dim=-1), 1).squeeze(-1)
+
+
+class Sequence:
+    def __init__(self, seq_id, prompt, prompt_ids, max_length, payload=None):
+        self.seq_id = seq_id
+        self.prompt = prompt
+        self.prompt_ids = prompt_ids
+        self.output_ids = []
+        self.max_length = max_length
+        self.payload = payload
+        self.cached_tokens = 0
+        self.admit_time = None
+        self.finish_time = None
+
+    def __len__(self):
+        return len(self.prompt_ids) + len(self.output_ids)
+
+    @property
+    def finished(self):
+        return self.finish_time is not None
+
+
+class PrefixCache:
+    # Prompt KV of recently seen prompts, least recently used evicted first.
+    # A lookup reuses the longest common prefix with any cached prompt.
+    def __init__(self, max_entries=64):
+        self.max_entries = max_entries
+        self._entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.reused_tokens = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def lookup(self, token_ids, max_tokens):
+        best_len, best_key = 0, None
+        for key in self._entries:
+            n = 0
+            limit = min(len(key), max_tokens)
+            while n < limit and key[n] == token_ids[n]:
+                n += 1
+            if n > best_len:
+                best_len, best_key = n, key
+        if best_key is None:
+            self.misses += 1
+            return 0, None
+        self.hits += 1
+        self.reused_tokens += best_len
+        self._entries.move_to_end(best_key)
+        past = [(k[:, :, :best_len], v[:, :, :best_len]) for k, v in self._entries[best_key]]
+        return best_len, past
+
+    def insert(self, token_ids, past):
+        key = tuple(token_ids)
+        self._entries[key] = past
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+
+class GPTEngine:
+    def __init__(self, model, tokenizer, device, max_batch_size=8, max_length=100,
+                 prefix_cache=None, do_sample=True, temperature=0.7, top_k=50, top_p=0.95):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.device = device
+        self.max_batch_size = max_batch_size
+        self.max_length = max_length
+        self.prefix_cache = prefix_cache
+        self.sampling = dict(do_sample=do_sample, temperature=temperature, top_k=top_k, top_p=top_p)
+        self.eos_token_id = tokenizer.eos_token_id
+        self.waiting = collections.deque()
+        self.running = []
+        self._next_id = 0
+        # Per-layer [max_batch_size, heads, 2 * max_length, head_dim] KV of
+        # the running batch, allocated on the first prefill. Row i belongs to
+        # running[i]; its KV ends right before column _cursor.
+        self._keys = None
+        self._values = None
+        self._cursor = 0
+
+    def __len__(self):
+        return len(self.waiting) + len(self.running)
+
+    def submit(self, prompt, payload=None):
+        seq = Sequence(self._next_id, prompt, self.tokenizer.encode(prompt), self.max_length, payload)
+        self._next_id += 1
+        self.waiting.append(seq)
+        return seq
+
+    def _append_token(self, seq, token_id):
+        seq.output_ids.append(token_id)
+        if token_id == self.eos_token_id or len(seq) >= seq.max_length:
+            seq.finish_time = time.monotonic()
+
+    def _shift(self, start, end, to):
+        # Moves columns [start, end) of the running rows to column to
+        n = len(self.running)
+        for buf in self._keys + self._values:
+            buf[:n, :, to:to + end - start] = buf[:n, :, start:end].clone()
+
+    @torch.no_grad()
+    def _prefill(self, seqs):
+        # Runs the uncached prompt tokens of seqs as one batch. Each row is
+        # [padding, cached prefix | padding, remaining prompt], with the
+        # prefix passed as past KV and the padding masked.
+        now = time.monotonic()
+        cached, pasts = [], []
+        for seq in seqs:
+            seq.admit_time = now
+            n, past = 0, None
+            if self.prefix_cache is not None:
+                # At least the last prompt token has to run to get its logits
+                n, past = self.prefix_cache.lookup(seq.prompt_ids, len(seq.prompt_ids) - 1)
+            seq.cached_tokens = n
+            cached.append(n)
+            pasts.append(past)
+        max_cached = max(cached)
+        max_new = max(len(seq.prompt_ids) - n for seq, n in zip(seqs, cached))
+
+        input_ids = torch.zeros(len(seqs), max_new, dtype=torch.long, device=self.device)
+        position_ids = torch.zeros(len(seqs), max_new, dtype=torch.long, device=self.device)
+        attention_mask = torch.zeros(len(seqs), max_cached + max_new, dtype=torch.long, device=self.device)
+        for i, (seq, n) in enumerate(zip(seqs, cached)):
+            new = len(seq.prompt_ids) - n
+            input_ids[i, max_new - new:] = torch.tensor(seq.prompt_ids[n:], device=self.device)
+            position_ids[i, max_new - new:] = torch.arange(n, len(seq.prompt_ids), device=self.device)
+            attention_mask[i, max_cached - n:max_cached] = 1
+            attention_mask[i, max_cached + max_new - new:] = 1
+
+        past = None
+        if max_cached:
+            ref = next(p for p in pasts if p is not None)
+            past = []
+            for layer, (k_ref, v_ref) in enumerate(ref):
+                keys = k_ref.new_zeros(len(seqs), k_ref.shape[1], max_cached, k_ref.shape[3])
+                values = v_ref.new_zeros(len(seqs), v_ref.shape[1], max_cached, v_ref.shape[3])
+                for i, (p, n) in enumerate(zip(pasts, cached)):
+                    if n:
+                        keys[i, :, max_cached - n:] = p[layer][0][0]
+                        values[i, :, max_cached - n:] = p[layer][1][0]
+                past.append((keys, values))
+
+        outputs = self.model(
+            input_ids=input_ids,
+            past_key_values=to_cache(past) if past is not None else None,
+            attention_mask=attention_mask,
+            position_ids=position_ids,
+            use_cache=True
+        )
+        next_tokens = sample_next(outputs.logits[:, -1], **self.sampling).tolist()
+        new_past = from_cache(outputs.past_key_values)
+        if self._keys is None:
+            width = 2 * self.max_length
+            self._keys = [k.new_empty(self.max_batch_size, k.shape[1], width, k.shape[3]) for k, _ in new_past]
+            self._values = [v.new_empty(self.max_batch_size, v.shape[1], width, v.shape[3]) for _, v in new_past]
+
+        finished, admitted = [], []
+        for i, (seq, n) in enumerate(zip(seqs, cached)):
+            new = len(seq.prompt_ids) - n
+            cols = torch.cat((torch.arange(max_cached - n, max_cached, device=self.device),
+                              torch.arange(max_cached + max_new - new, max_cached + max_new, device=self.device)))
+            seq_past = [(k[i:i + 1, :, cols], v[i:i + 1, :, cols]) for k, v in new_past]
+            if self.prefix_cache is not None:
+                self.prefix_cache.insert(seq.prompt_ids, seq_past)
+            self._append_token(seq, next_tokens[i])
+            if seq.finished:
+                finished.append(seq)
+            else:
+                admitted.append((seq, seq_past))
+        if not admitted:
+            return finished
+
+        # Make room left of the cursor for the longest admitted prompt
+        if not self.running:
+            self._cursor = 0
+        longest = max(len(seq.prompt_ids) for seq, _ in admitted)
+        if self._cursor < longest:
+            self._shift(0, self._cursor, longest - self._cursor)
+            self._cursor = longest
+        end = self._cursor
+        for seq, seq_past in admitted:
+            row, start = len(self.running), end - len(seq.prompt_ids)
+            for layer, (k, v) in enumerate(seq_past):
+                self._keys[layer][row, :, start:end] = k[0]
+                self._values[layer][row, :, start:end] = v[0]
+            self.running.append(seq)
+        return finished
+
+    @torch.no_grad()
+    def _decode(self):
+        # The KV of a sequence covers all but its last token, which is the
+        # input of this step
+        seqs = self.running
+        past_lens = [len(seq) - 1 for seq in seqs]
+        max_past = max(past_lens)
+        if self._cursor == self._keys[0].shape[2]:
+            self._shift(self._cursor - max_past, self._cursor, 0)
+            self._cursor = max_past
+        start, end = self._cursor - max_past, self._cursor
+
+        n = len(seqs)
+        past = [(k[:n, :, start:end], v[:n, :, start:end]) for k, v in zip(self._keys, self._values)]
+        attention_mask = torch.zeros(n, max_past + 1, dtype=torch.long, device=self.device)
+        for i, past_len in enumerate(past_lens):
+            attention_mask[i, max_past - past_len:] = 1
+
+        outputs = self.model(
+            input_ids=torch.tensor([[seq.output_ids[-1]] for seq in seqs], device=self.device),
+            past_key_values=to_cache(past),
+            attention_mask=attention_mask,
+            position_ids=torch.tensor([[past_len] for past_len in past_lens], device=self.device),
+            use_cache=True
+        )
+        next_tokens = sample_next(outputs.logits[:, -1], **self.sampling).tolist()
+        for (k, v), keys, values in zip(from_cache(outputs.past_key_values), self._keys, self._values):
+            keys[:n, :, end] = k[:, :, -1]
+            values[:n, :, end] = v[:, :, -1]
+        self._cursor += 1
+        for seq, token_id in zip(seqs, next_tokens):
+            self._append_token(seq, token_id)
+
+    def _retire(self):
+        # Drops the finished sequences, moving the last running rows into
+        # their slots so the running rows stay 0..n-1
+        seqs = self.running
+        alive = sum(not seq.finished for seq in seqs)
+        holes = [i for i in range(alive) if seqs[i].finished]
+        movers = [i for i in range(alive, len(seqs)) if not seqs[i].finished]
+        for dst, src in zip(holes, movers):
+            start = self._cursor - (len(seqs[src]) - 1)
+            for buf in self._keys + self._values:
+                buf[dst, :, start:self._cursor] = buf[src, :, start:self._cursor]
+            seqs[dst] = seqs[src]
+        self.running = seqs[:alive]
+
+    def step(self):
+        # One decode iteration over the running sequences, then refill the
+        # freed slots. Returns the sequences that finished in this step.
+        finished = []
+        if self.running:
+            self._decode()
+            finished = [seq for seq in self.running if seq.finished]
+            self._retire()
+
+        admit = []
+        while self.waiting and len(self.running) + len(admit) < self.max_batch_size:
+            admit.append(self.waiting.popleft())
+        if admit:
+            finished.extend(self._prefill(admit))
+        return finished
+
+    def generate(self, prompts):
+        seqs = [self.submit(prompt) for prompt in prompts]
+        while not all(seq.finished for seq in seqs):
+            self.step()
+        return seqs
+
+    def decode(self, seq):
+        return self.tokenizer.decode(seq.prompt_ids + seq.output_ids, skip_special_tokens=True)
@@ -0,0 +1,119 @@
+import math
+
+
+class LogHistogram:
+    # Log-bucketed latency recorder. Bucket i covers (gamma^(i-1), gamma^i],
+    # so any quantile is reported within `relative_error` of a recorded
+    # value while memory only grows with log(max / min_value). Histograms
+    # with the same relative error can be merged exactly.
+    def __init__(self, relative_error=0.01, min_value=1e-6):
+        self.relative_error = relative_error
+        self.min_value = min_value
+        self._gamma = (1 + relative_error) / (1 - relative_error)
+        self._log_gamma = math.log(self._gamma)
+        self.counts = {}
+        self.zero_count = 0
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def _index(self, value):
+        return math.ceil(math.log(value) / self._log_gamma)
+
+    def _value(self, index):
+        # Mid-point of the bucket in relative terms
+        return 2 * (self._gamma ** index) / (self._gamma + 1)
+
+    def record(self, value, count=1):
+        if value <= self.min_value:
+            self.zero_count += count
+        else:
+            index = self._index(value)
+            self.counts[index] = self.counts.get(index, 0) + count
+        self.count += count
+        self.sum += value * count
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def merge(self, other):
+        assert self.relative_error == other.relative_error, "Cannot merge histograms of different precision"
+        for index, count in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.sum += other.sum
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+
+    def subtract(self, other):
+        # Removes the values of an earlier snapshot of this histogram; min
+        # and max stay those of the whole histogram
+        assert self.relative_error == other.relative_error, "Cannot subtract histograms of different precision"
+        for index, count in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) - count
+            if self.counts[index] <= 0:
+                del self.counts[index]
+        self.zero_count -= other.zero_count
+        self.count -= other.count
+        self.sum -= other.sum
+        return self
+
+    def buckets(self):
+        # (value, count) of every non-empty bucket in increasing order
+        buckets = [(self.min_value, self.zero_count)] if self.zero_count else []
+        return buckets + [(self._value(index), self.counts[index]) for index in sorted(self.counts)]
+
+    def copy(self):
+        return LogHistogram(self.relative_error, self.min_value).merge(self)
+
+    def snapshot(self):
+        # Compact, plain-python copy that can be pickled and merged later
+        return {
+            "relative_error": self.relative_error,
+            "min_value": self.min_value,
+            "counts": dict(self.counts),
+            "zero_count": self.zero_count,
+            "count": self.count,
+            "sum": self.sum,
+            "min": self.min,
+            "max": self.max,
+        }
+
+    @classmethod
+    def from_snapshot(cls, snapshot):
+        hist = cls(snapshot["relative_error"], snapshot["min_value"])
+        hist.counts = dict(snapshot["counts"])
+        for key in ["zero_count", "count", "sum", "min", "max"]:
+            setattr(hist, key, snapshot[key])
+        return hist
+
+    def __len__(self):
+        return self.count
+
+    def mean(self):
+        return self.sum / self.count if self.count else math.nan
+
+    def percentile(self, percentile):
+        # Same convention as np.percentile: 0 is the min and 100 the max,
+        # which are tracked exactly
+        if self.count == 0:
+            return math.nan
+        if percentile <= 0:
+            return self.min
+        if percentile >= 100:
+            return self.max
+
+        rank = percentile / 100 * (self.count - 1)
+        seen = self.zero_count
+        if rank < seen:
+            return self.min
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if rank < seen:
+                return min(max(self._value(index), self.min), self.max)
+        return self.max
+
+    def percentiles(self, percentiles):
+        return [self.percentile(p) for p in percentiles]
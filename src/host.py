@@ -0,0 +1,284 @@
+# Sample command:
+# python3 src/host.py --device-id 0 --mix bert-1 whisper-1
+#
+# Loads every model of the mix into a single process and runs each one on
+# its own execution lane (a worker thread with its own CUDA stream). With
+# --time-slice, the lanes take turns on the device at step boundaries
+# instead of running concurrently (see timeslice.py).
+
+import argparse
+import contextlib
+import os
+import pickle
+import signal
+import sys
+import threading
+import torch
+from inference import get_inference_object, EXECUTIONS # type: ignore
+from executor import InferenceExecutor, get_memory_stats, set_execution, SNAPSHOT_INTERVAL # type: ignore
+from control import ControlClient # type: ignore
+from postprocess import PostProcessor, get_sink # type: ignore
+from timeslice import SliceScheduler, get_policy, POLICIES # type: ignore
+from timeline import TimelineRecorder, TIMELINE_FILE # type: ignore
+from weight_share import SharedWeights # type: ignore
+from mix import parse_mix # type: ignore
+
+
+class ExecutionLane(threading.Thread):
+    def __init__(self, executor, scheduler):
+        super().__init__(daemon=True)
+        self.executor = executor
+        self.scheduler = scheduler
+        self.infer_stats = None
+        self.gpu_mem = 0
+        if torch.cuda.is_available():
+            self.stream = torch.cuda.Stream()
+        else:
+            self.stream = None
+
+    def _stream_context(self):
+        if self.stream is None:
+            return contextlib.nullcontext()
+        return torch.cuda.stream(self.stream)
+
+    def prepare(self):
+        # Loads run one lane at a time, so the peak above what the lanes
+        # before it hold is this lane's model and the activations of its
+        # warm up batches, like the peak of a per-process executor
+        if self.stream is not None:
+            torch.cuda.reset_peak_memory_stats()
+            before = torch.cuda.memory_allocated()
+        with self._stream_context():
+            self.executor.prepare()
+        if self.stream is not None:
+            self.stream.synchronize()
+            self.gpu_mem = torch.cuda.max_memory_allocated() - before
+
+    def run(self):
+        self.scheduler.wait_to_start()
+        time_slice = self.executor.model_obj.time_slice
+        if time_slice is not None:
+            time_slice.join()
+        try:
+            with self._stream_context():
+                self.infer_stats = self.executor.execute()
+            if self.stream is not None:
+                self.stream.synchronize()
+        finally:
+            # A lane that failed still lets the others finish
+            if time_slice is not None:
+                time_slice.leave()
+            self.scheduler.lane_finished()
+
+
+class LaneScheduler:
+    def __init__(self):
+        self.lanes = []
+        self._start_event = threading.Event()
+        self._stop_event = threading.Event()
+        self._lock = threading.Lock()
+        self._num_finished = 0
+
+    def add_lane(self, executor):
+        self.lanes.append(ExecutionLane(executor, self))
+
+    def prepare(self):
+        for lane in self.lanes:
+            lane.prepare()
+        for lane in self.lanes:
+            lane.start()
+
+    def wait_to_start(self):
+        self._start_event.wait()
+
+    def start(self):
+        self._start_event.set()
+
+    def stop(self):
+        self._stop_event.set()
+        for lane in self.lanes:
+            lane.executor.job_completed = True
+
+    def lane_finished(self):
+        # A lane running a bounded number of requests ends on its own
+        with self._lock:
+            self._num_finished += 1
+            if self._num_finished == len(self.lanes):
+                self._stop_event.set()
+
+    def wait_to_stop(self):
+        # Wake up periodically so that the stop signal handler gets to run
+        while not self._stop_event.wait(1):
+            pass
+        for lane in self.lanes:
+            lane.join()
+
+    def collect_stats(self):
+        # One (tid, infer_stats) entry per lane that completed its run. GPU
+        # memory is attributed per lane while the process RSS is shared and
+        # reported once.
+        results = []
+        memory_stats = get_memory_stats()
+        for lane in self.lanes:
+            infer_stats = lane.infer_stats
+            if infer_stats is None:
+                print(f"Lane {lane.executor.tid} ({lane.executor.model_obj.get_id()}) failed, "
+                      f"leaving it out of the results")
+                continue
+            infer_stats[2]["gpu_mem"] = lane.gpu_mem
+            infer_stats[2]["rss"] = memory_stats["rss"] if not results else None
+            infer_stats.insert(0, f"{lane.executor.model_obj.get_id()}")
+            results.append((lane.executor.tid, infer_stats))
+        return results
+
+
+class MultiModelHost:
+    def __init__(self, jobs, device_id, num_infer, control=None, weight_cache=None,
+                 sink=None, postprocess_workers=1, postprocess_queue_size=64,
+                 time_slice=None, slice_weights=None, slice_slos=None,
+                 snapshot_interval=SNAPSHOT_INTERVAL, report_progress=False,
+                 synthetic_profiles=None, execution="eager", timeline=None, share_weights=False):
+        self.control = control
+        self.scheduler = LaneScheduler()
+        # Step-granular sharing of the device between the lanes
+        self.slice_scheduler = SliceScheduler(get_policy(time_slice)) if time_slice else None
+        # Lanes post-process their outputs on their own workers, into one sink
+        self.sink = sink
+        for tid, (model, batch_size) in enumerate(jobs):
+            model_obj = get_inference_object(model, device_id, batch_size, weight_cache=weight_cache,
+                                             synthetic_profiles=synthetic_profiles)
+            set_execution(model_obj, execution)
+            if share_weights:
+                # Lanes of the same model share one copy, and the copies of
+                # executors of other processes
+                model_obj.weight_share = SharedWeights(model_obj._device)
+            if self.slice_scheduler is not None:
+                model_obj.time_slice = self.slice_scheduler.add_lane(
+                    slice_weights[tid] if slice_weights else 1.0,
+                    slice_slos[tid] if slice_slos else None
+                )
+            postprocessor = None
+            if sink is not None:
+                postprocessor = PostProcessor(sink, postprocess_workers, postprocess_queue_size)
+            # Lanes report progress under their own tid over the shared channel
+            progress = control.progress if report_progress else None
+            recorder = TimelineRecorder(os.path.join(timeline, TIMELINE_FILE.format(tid))) if timeline else None
+            self.scheduler.add_lane(InferenceExecutor(model_obj, num_infer, tid, postprocessor=postprocessor,
+                                                      snapshot_interval=snapshot_interval, progress=progress,
+                                                      timeline=recorder))
+
+    def _catch_to_start(self, signum, frame):
+        self.scheduler.start()
+
+    def _catch_to_end(self, signum, frame):
+        self.scheduler.stop()
+
+    def _indicate_ready(self):
+        if self.control is not None:
+            self.control.ready()
+            self.control.wait_for_start(on_stop=self.scheduler.stop)
+            self.scheduler.start()
+            return
+
+        signal.signal(signal.SIGUSR1, self._catch_to_start)
+        signal.signal(signal.SIGUSR2, self._catch_to_end)
+        with open(f"/tmp/{os.getpid()}", "w") as ready_file:
+            ready_file.write("")
+
+    def run(self):
+        self.scheduler.prepare()
+        self._indicate_ready()
+
+        if torch.cuda.is_available():
+            torch.cuda.cudart().cudaProfilerStart()
+            torch.cuda.nvtx.range_push("start")
+        self.scheduler.wait_to_stop()
+        if torch.cuda.is_available():
+            torch.cuda.nvtx.range_pop()
+            torch.cuda.cudart().cudaProfilerStop()
+
+        # Single combined stats output for all lanes
+        results = self.scheduler.collect_stats()
+        if self.control is not None:
+            self.control.send_results(results)
+        else:
+            with open(f"/tmp/{os.getpid()}.pkl", "wb") as h:
+                pickle.dump(results, h)
+        if self.sink is not None:
+            # Every lane's workers are done before the shared sink closes
+            for lane in self.scheduler.lanes:
+                lane.executor.postprocessor.stop()
+            self.sink.close()
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(allow_abbrev=False)
+    parser.add_argument("--device-id", type=int, default=0)
+    parser.add_argument("--cpu", action="store_true", help="Run the models on the CPU instead of --device-id")
+    parser.add_argument("--synthetic-profiles", type=str, default=None,
+                        help="Device result dir synthetic models are calibrated from (default results/a100)")
+    parser.add_argument("--mix", type=str, nargs="+", required=True,
+                        help="Models to co-locate, as <model>-<batch_size>")
+    parser.add_argument("--num-infer", type=int, default=sys.maxsize)
+    parser.add_argument("--tid", type=int, default=0)
+    parser.add_argument("--control-socket", type=str, default=None,
+                        help="Orchestrator control socket (default: signals)")
+    parser.add_argument("--weight-cache", type=str, default=None,
+                        help="Dir of pre-converted safetensors snapshots of the models")
+    parser.add_argument("--share-weights", action="store_true",
+                        help="Share read-only weights between the lanes and executors of the same model")
+    parser.add_argument("--sink", type=str, default="print",
+                        help="Where post-processed outputs go: print, quiet or file:<path>")
+    parser.add_argument("--postprocess-workers", type=int, default=1)
+    parser.add_argument("--postprocess-queue-size", type=int, default=64,
+                        help="Outputs waiting for post-processing before inference blocks")
+    parser.add_argument("--time-slice", type=str, default=None, choices=list(POLICIES),
+                        help="Take turns on the device at step boundaries under this policy")
+    parser.add_argument("--slice-weights", type=float, nargs="+", default=None,
+                        help="Share of device time of each model of the mix (weighted)")
+    parser.add_argument("--slice-slos-ms", type=float, nargs="+", default=None,
+                        help="Latency SLO of each model of the mix (edf)")
+    parser.add_argument("--execution", type=str, default="eager", choices=EXECUTIONS,
+                        help="compile: torch.compile the static-shape modules, cudagraphs: also capture CUDA graphs")
+    parser.add_argument("--snapshot-interval", type=float, default=SNAPSHOT_INTERVAL,
+                        help="Secs between snapshots of the latency histogram")
+    parser.add_argument("--report-progress", action="store_true",
+                        help="Send every snapshot to the orchestrator (adaptive run duration)")
+    parser.add_argument("--timeline", type=str, default=None,
+                        help="Dir to record the interval of every batch of each lane in (timeline_<tid>.bin)")
+    opt, unused_args = parser.parse_known_args()
+
+    for values in [opt.slice_weights, opt.slice_slos_ms]:
+        if values is not None and len(values) != len(opt.mix):
+            parser.error("--slice-weights and --slice-slos-ms need one value per model of the mix")
+    if opt.report_progress and opt.control_socket is None:
+        parser.error("--report-progress requires --control-socket")
+    if opt.time_slice and opt.execution != "eager":
+        parser.error("--time-slice needs --execution eager, compiled models cannot yield at step boundaries")
+
+    try:
+        jobs = parse_mix(opt.mix)
+    except ValueError as exc:
+        parser.error(str(exc))
+
+    host = MultiModelHost(
+        jobs,
+        "cpu" if opt.cpu else opt.device_id,
+        opt.num_infer,
+        control=ControlClient(opt.control_socket, opt.tid) if opt.control_socket else None,
+        weight_cache=opt.weight_cache,
+        sink=get_sink(opt.sink),
+        postprocess_workers=opt.postprocess_workers,
+        postprocess_queue_size=opt.postprocess_queue_size,
+        time_slice=opt.time_slice,
+        slice_weights=opt.slice_weights,
+        slice_slos=[slo / 1000 for slo in opt.slice_slos_ms] if opt.slice_slos_ms else None,
+        snapshot_interval=opt.snapshot_interval,
+        report_progress=opt.report_progress,
+        synthetic_profiles=opt.synthetic_profiles,
+        execution=opt.execution,
+        timeline=opt.timeline,
+        share_weights=opt.share_weights
+    )
+    host.run()
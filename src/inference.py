@@ -1,26 +1,211 @@
 import random
 import os
 import pathlib
+import time
+import contextlib
 from abc import ABC, abstractmethod
 import torch
-import torchaudio                       # type: ignore
-from datasets import load_dataset       # type: ignore
-from diffusers import DiffusionPipeline # type: ignore
-from transformers import (              # type: ignore
-    BertTokenizer,
-    BertForMaskedLM,
-    GPTJForCausalLM,
-    AutoTokenizer,
-    pipeline
-)
+from weight_cache import WeightCache # type: ignore
+from quantize import DTYPES, split_model, quantize, footprint # type: ignore
+from phases import PhaseTimer # type: ignore
+from phase_names import LOAD_PHASES # type: ignore
+
+# Model libraries (transformers, diffusers, torchaudio) are imported in the
+# load methods of the models that need them, so an executor only pays for
+# the imports of the model it runs.
+
+EXECUTIONS = ["eager", "compile", "cudagraphs"]
+# Compiled BERT pads its inputs up to one of these lengths, so that only a
+# few shapes get compiled
+SEQ_BUCKETS = [16, 32, 64, 128, 256, 512]
+COMPILE_CACHE_SIZE = 64 # compiled shapes kept per module
 
 class Inference(ABC):
-    def __init__(self, model_name, device_id, batch_size):
-        self._device = torch.device(f"cuda:{device_id}")
+    # Whether the model has static-shape modules for _compile()
+    COMPILABLE = False
+    # Precision without an @<precision> in the mix
+    DEFAULT_PRECISION = "fp16"
+
+    def __init__(self, model_name, device_id, batch_size, weight_cache=None):
+        # device_id "cpu" runs the model on the CPU (executor.py --cpu)
+        self._device = torch.device("cpu" if device_id == "cpu" else f"cuda:{device_id}")
         self._model_name = model_name
         self._model = None
         self._batch_size = batch_size
-    
+        self._weight_cache = WeightCache(weight_cache) if weight_cache else None
+        self.load_times = {phase: 0.0 for phase in LOAD_PHASES}
+
+        # Per request breakdown of infer() into INFER_PHASES,
+        # phase => LogHistogram
+        self.phases = PhaseTimer(self._device)
+        self.infer_times = self.phases.hists
+
+        # postprocess.PostProcessor the CPU work on outputs is handed to
+        self.postprocessor = None
+
+        # timeslice.SliceLane when co-located models take turns on the
+        # device at step boundaries (slice mode of host.py), set before
+        # load_model() so the step hooks get installed
+        self.time_slice = None
+
+        # eager, compile or cudagraphs (see _compile), set before
+        # load_model() too
+        self.execution = "eager"
+
+        # fp32, fp16, bf16, int8 or int8w (see quantize.py), set by
+        # get_inference_object() from the model name
+        self.precision = self.DEFAULT_PRECISION
+        self.weight_bytes = None
+
+        # weight_share.SharedWeights of the device when co-located executors
+        # share read-only weights (--share-weights), set before load_model()
+        self.weight_share = None
+
+    def _yield_step(self, *args):
+        # Step boundary: let the kernels of this step finish, then give
+        # the device to whichever co-located model the scheduler picks
+        if self.time_slice is None:
+            return
+        if self._device.type == "cuda":
+            torch.cuda.current_stream(self._device).synchronize()
+        self.time_slice.yield_step()
+
+    def _install_layer_hooks(self, layers):
+        # Yield after every encoder layer
+        if self.time_slice is not None:
+            for layer in layers:
+                layer.register_forward_hook(self._yield_step)
+
+    def _decode_step_kwargs(self):
+        # generate() kwargs that yield after every decode step, through a
+        # stopping criterion that never stops
+        if self.time_slice is None:
+            return {}
+        from transformers import StoppingCriteria, StoppingCriteriaList # type: ignore
+
+        yield_step = self._yield_step
+        class StepBoundary(StoppingCriteria):
+            def __call__(self, input_ids, scores, **kwargs):
+                yield_step()
+                return torch.zeros(input_ids.shape[0], dtype=torch.bool, device=input_ids.device)
+
+        return {"stopping_criteria": StoppingCriteriaList([StepBoundary()])}
+
+    def _postprocess(self, fn, *args):
+        # fn(*args) decodes/formats outputs that are already on the host
+        # and returns lines to print. Without a post-processor it runs
+        # inline, on the critical path.
+        if self.postprocessor is None:
+            for line in fn(*args):
+                print(line)
+        else:
+            self.postprocessor.submit(fn, *args)
+
+    @contextlib.contextmanager
+    def _load_phase(self, phase):
+        # Accumulates the time (secs) spent in each phase of load_model()
+        start_time = time.perf_counter()
+        yield
+        if phase == "transfer" and self._device.type == "cuda":
+            torch.cuda.synchronize(self._device)
+        self.load_times[phase] += time.perf_counter() - start_time
+
+    def _infer_phase(self, phase, num_requests, on_device=False):
+        # Records the time (secs) a batch spent in a phase of inference once
+        # for each of its requests, with CUDA events on the current stream
+        # for phases that run on the device (see phases.py)
+        return self.phases.phase(phase, num_requests, on_device)
+
+    def _compile(self, module):
+        # torch.compile of a static-shape module, cudagraphs also captures
+        # its kernels into CUDA graphs (Inductor's reduce-overhead mode).
+        # Compiled graphs are cached on disk, next to the weight cache if
+        # there is one, so later start-ups skip most of the compilation.
+        if self.execution == "eager":
+            return module
+        if self.time_slice is not None:
+            raise ValueError("Compiled models cannot yield at step boundaries, run them eager with time slicing")
+        if self._weight_cache is not None:
+            cache_dir = os.path.join(self._weight_cache.cache_dir, "compile")
+            os.environ.setdefault("TORCHINDUCTOR_CACHE_DIR", cache_dir)
+            os.environ.setdefault("TRITON_CACHE_DIR", os.path.join(cache_dir, "triton"))
+        import torch._dynamo
+        import torch._inductor.config
+        torch._inductor.config.fx_graph_cache = True
+        torch._dynamo.config.cache_size_limit = max(torch._dynamo.config.cache_size_limit, COMPILE_CACHE_SIZE)
+
+        mode = "default"
+        if self.execution == "cudagraphs":
+            if self._device.type == "cuda":
+                mode = "reduce-overhead"
+            else:
+                print("CUDA graphs need a GPU, compiling without them")
+        return torch.compile(module, mode=mode, dynamic=False)
+
+    def _load_dtype(self):
+        # (torch dtype the weights are loaded in, weight cache key). The int8
+        # variants are quantized from a full precision load: dynamic int8
+        # needs fp32, weight-only int8 keeps the default compute dtype (fp32
+        # on the CPU, which has no fast half precision matmuls).
+        precision = self.precision
+        if precision == "int8" or (precision == "int8w" and self._device.type == "cpu"):
+            precision = "fp32"
+        elif precision == "int8w":
+            precision = self.DEFAULT_PRECISION
+        return DTYPES[precision], precision
+
+    def _quantize(self, *modules):
+        # Runs on the CPU before the transfer, so the full precision
+        # weights never take up device memory
+        with self._load_phase("quantize"):
+            return [quantize(module, self.precision) for module in modules]
+
+    def _weights_source(self, dtype):
+        # Cached snapshot of the model if there is one, else the hub path
+        if self._weight_cache is not None:
+            cached = self._weight_cache.lookup(self.model_path, dtype)
+            if cached is not None:
+                return cached, True
+        return self.model_path, False
+
+    def _cache_weights(self, dtype, cached, model, *others):
+        if self._weight_cache is not None and not cached:
+            self._weight_cache.store(self.model_path, dtype, model, *others)
+
+    def _build_meta(self, model_class, source):
+        # The model without weights, on the meta device, for the views of
+        # shared weights to be bound to
+        from transformers import AutoConfig, GenerationConfig # type: ignore
+        config = AutoConfig.from_pretrained(source)
+        with torch.device("meta"):
+            model = model_class(config)
+        if model.can_generate():
+            model.generation_config = GenerationConfig.from_pretrained(source)
+        return quantize(model, self.precision).eval()
+
+    def _load_shared(self, load, model_class, source):
+        # load() => the model on the CPU, quantized, which gets transferred
+        # to the device. With weight sharing, the first executor of a model
+        # exports its weights in the transfer and later ones attach to them.
+        if self.weight_share is not None and self.precision == "int8":
+            print(f"{self.get_id()}: dynamic int8 weights are packed and cannot be shared, loading a copy")
+        if self.weight_share is None or self.precision == "int8":
+            model = load()
+            with self._load_phase("transfer"):
+                return model.to(self._device)
+        key = f"{self.model_path.replace('/', '--')}-{self.precision}"
+        with self.weight_share.lock(key):
+            with self._load_phase("deserialize"):
+                model = self.weight_share.attach(key, lambda: self._build_meta(model_class, source))
+            if model is not None:
+                print(f"{self.get_id()}: attached to the shared weights of {key}")
+                return model
+            model = load()
+            with self._load_phase("transfer"):
+                self.weight_share.export(key, model)
+            print(f"{self.get_id()}: exported the weights of {key}")
+            return model
+
     @abstractmethod
     def get_id(self):
         pass
@@ -37,9 +222,19 @@ class Inference(ABC):
     def infer(self):
         pass
 
+    @abstractmethod
+    def sample_request(self):
+        pass
+
+    @abstractmethod
+    def infer_batch(self, requests):
+        pass
+
 class StableDiffusion(Inference):
-    def __init__(self, model_name, device_id, batch_size):
-        super().__init__(model_name, device_id, batch_size)
+    COMPILABLE = True
+
+    def __init__(self, model_name, device_id, batch_size, weight_cache=None):
+        super().__init__(model_name, device_id, batch_size, weight_cache)
         self._input_prompts = []
         self._prompts = [
             # "An astronaut riding a green horse",
@@ -53,12 +248,30 @@ class StableDiffusion(Inference):
         return f"{self._model_name}-{self._batch_size}"
 
     def load_model(self):
-        self._model = DiffusionPipeline.from_pretrained(
-            self.model_path,
-            torch_dtype=torch.float16,
-            use_safetensors=True, 
-            variant="fp16"
-        ).to(self._device)
+        with self._load_phase("import"):
+            from diffusers import DiffusionPipeline # type: ignore
+        if self.weight_share is not None:
+            print(f"{self.get_id()}: pipelines of several models do not share weights, loading a copy")
+        dtype, key = self._load_dtype()
+        source, cached = self._weights_source(key)
+        with self._load_phase("deserialize"):
+            # The cached snapshot is already in its dtype, without a variant
+            # suffix. fp32 comes from the hub's full precision weights.
+            self._model = DiffusionPipeline.from_pretrained(
+                source,
+                torch_dtype=dtype,
+                use_safetensors=True, 
+                variant=None if cached or key == "fp32" else "fp16"
+            )
+        self._cache_weights(key, cached, self._model)
+        # The VAE is mostly convolutions, there is nothing to quantize there
+        self._model.unet, self._model.text_encoder, self._model.text_encoder_2 = self._quantize(
+            self._model.unet, self._model.text_encoder, self._model.text_encoder_2)
+        with self._load_phase("transfer"):
+            self._model = self._model.to(self._device)
+        self.weight_bytes = footprint(*[c for c in self._model.components.values() if isinstance(c, torch.nn.Module)])
+        # The UNet runs every denoising step at a fixed resolution
+        self._model.unet = self._compile(self._model.unet)
     
     def load_data(self):
         # Prepare batch size number of prompts
@@ -66,13 +279,40 @@ class StableDiffusion(Inference):
             self._input_prompts.append(random.choice((self._prompts)))
     
     def infer(self):
-        images = self._model(prompt=self._input_prompts).images
-        print('finished an inference!')
+        return self.infer_batch(self._input_prompts)
+
+    def sample_request(self):
+        return random.choice(self._prompts)
+
+    def infer_batch(self, requests):
+        # Conversion to PIL images is left to the post-processing stage
+        with self._infer_phase("denoise", len(requests), on_device=True):
+            images = self._model(prompt=requests, output_type="pt", **self._denoise_step_kwargs()).images
+        with self._infer_phase("d2h", len(requests), on_device=True):
+            images = images.cpu()
+        self._postprocess(self._format_images, images)
         return len(images)
 
+    def _denoise_step_kwargs(self):
+        if self.time_slice is None:
+            return {}
+        return {"callback_on_step_end": self._on_step_end}
+
+    def _on_step_end(self, pipe, step, timestep, callback_kwargs):
+        self._yield_step()
+        return callback_kwargs
+
+    def _format_images(self, images):
+        image_processor = self._model.image_processor
+        pil_images = image_processor.numpy_to_pil(image_processor.pt_to_numpy(images))
+        return [f"finished an inference! ({len(pil_images)} images)"]
+
 class BertLarge(Inference):
-    def __init__(self, model_name, device_id, batch_size):
-        super().__init__(model_name, device_id, batch_size)
+    COMPILABLE = True
+    DEFAULT_PRECISION = "fp32"
+
+    def __init__(self, model_name, device_id, batch_size, weight_cache=None):
+        super().__init__(model_name, device_id, batch_size, weight_cache)
         self._input_prompts = []
         self._prompts = [
             "Lebron James was drafted to [MASK] in 2003",
@@ -86,44 +326,82 @@ class BertLarge(Inference):
         return f"{self._model_name}-{self._batch_size}"
 
     def load_model(self):
-        self._tokenizer = BertTokenizer.from_pretrained(self.model_path)
-        self._model = BertForMaskedLM.from_pretrained(
-            self.model_path
-        ).to(self._device)
+        with self._load_phase("import"):
+            from transformers import BertTokenizer, BertForMaskedLM # type: ignore
+        dtype, key = self._load_dtype()
+        source, cached = self._weights_source(key)
+        with self._load_phase("deserialize"):
+            self._tokenizer = BertTokenizer.from_pretrained(source)
+
+        def load():
+            with self._load_phase("deserialize"):
+                model = BertForMaskedLM.from_pretrained(source, torch_dtype=dtype)
+            self._cache_weights(key, cached, model, self._tokenizer)
+            return self._quantize(model)[0]
+
+        self._model = self._load_shared(load, BertForMaskedLM, source)
+        self.weight_bytes = footprint(self._model)
+        self._install_layer_hooks(self._model.bert.encoder.layer)
+        self._forward_model = self._compile(self._model)
     
     def load_data(self):
         # Prepare batch size number of prompts
         for _ in range(self._batch_size):
             self._input_prompts.append(random.choice(self._prompts))
-        
-        # Tokenize
-        tokenized_prompts = [self._tokenizer.tokenize(prompt) for prompt in self._input_prompts]
 
-        # Pad
-        max_length = max(len(tokens) for tokens in tokenized_prompts)
-        padded_tokenized_prompts = [tokens + ["[PAD]"] * (max_length - len(tokens)) for tokens in tokenized_prompts]
+        self._input_ids_tensor, self._attention_masks_tensors = self._prepare_inputs(self._input_prompts)
+
+    def _prepare_inputs(self, prompts):
+        with self._infer_phase("tokenize", len(prompts)):
+            # Tokenize
+            tokenized_prompts = [self._tokenizer.tokenize(prompt) for prompt in prompts]
+
+            # Pad, up to a length bucket when compiled
+            max_length = max(len(tokens) for tokens in tokenized_prompts)
+            if self.execution != "eager":
+                max_length = next((b for b in SEQ_BUCKETS if b >= max_length), max_length)
+            padded_tokenized_prompts = [tokens + ["[PAD]"] * (max_length - len(tokens)) for tokens in tokenized_prompts]
 
-        # Convert tokens to input IDs
-        input_ids = [self._tokenizer.convert_tokens_to_ids(tokens) for tokens in padded_tokenized_prompts]
-        attention_masks = [[1] * len(tokens) + [0] * (max_length - len(tokens)) for tokens in tokenized_prompts]
+            # Convert tokens to input IDs
+            input_ids = [self._tokenizer.convert_tokens_to_ids(tokens) for tokens in padded_tokenized_prompts]
+            attention_masks = [[1] * len(tokens) + [0] * (max_length - len(tokens)) for tokens in tokenized_prompts]
 
         # Convert to PyTorch tensor and move to GPU
-        self._input_ids_tensor = torch.tensor(input_ids).to(self._device)
-        self._attention_masks_tensors = torch.tensor(attention_masks).to(self._device)
+        with self._infer_phase("h2d", len(prompts), on_device=True):
+            input_ids_tensor = torch.tensor(input_ids).to(self._device)
+            attention_masks_tensors = torch.tensor(attention_masks).to(self._device)
+        return input_ids_tensor, attention_masks_tensors
 
     def infer(self):
-        outputs = self._model(self._input_ids_tensor, attention_mask=self._attention_masks_tensors)
-        predicted_token_ids = torch.argmax(outputs.logits, dim=-1)
+        return self._forward(self._input_prompts, self._input_ids_tensor, self._attention_masks_tensors)
+
+    def sample_request(self):
+        return random.choice(self._prompts)
+
+    def infer_batch(self, requests):
+        return self._forward(requests, *self._prepare_inputs(requests))
+
+    def _forward(self, prompts, input_ids_tensor, attention_masks_tensors):
+        with self._infer_phase("forward", len(prompts), on_device=True), torch.no_grad():
+            outputs = self._forward_model(input_ids_tensor, attention_mask=attention_masks_tensors)
+            predicted_token_ids = torch.argmax(outputs.logits, dim=-1)
+        with self._infer_phase("d2h", len(prompts), on_device=True):
+            predicted_token_ids = predicted_token_ids.cpu()
+        self._postprocess(self._format_predictions, prompts, predicted_token_ids)
+        return len(predicted_token_ids)
+
+    def _format_predictions(self, prompts, predicted_token_ids):
+        lines = []
         predicted_tokens = [self._tokenizer.convert_ids_to_tokens(ids) for ids in predicted_token_ids]
-        for prompt, pred_tokens in zip(self._input_prompts, predicted_tokens):
-            print(f"Prompt: {prompt}")
-            print("Predicted tokens:", pred_tokens)
-            print()
-        return len(predicted_tokens)
+        for prompt, pred_tokens in zip(prompts, predicted_tokens):
+            lines.append(f"Prompt: {prompt}")
+            lines.append(f"Predicted tokens: {pred_tokens}")
+            lines.append("")
+        return lines
 
 class GPT(Inference):
-    def __init__(self, model_name, device_id, batch_size):
-        super().__init__(model_name, device_id, batch_size)
+    def __init__(self, model_name, device_id, batch_size, weight_cache=None):
+        super().__init__(model_name, device_id, batch_size, weight_cache)
         self._input_prompts = []
         self._prompts = [
             "The NBA season is heating up with intense matchups and standout performances. Predictions for the NBA Finals?",
@@ -132,78 +410,291 @@ class GPT(Inference):
             "Exploring the debate: Is LeBron James still the most dominant player in the NBA, or are there rising stars challenging his throne?"
         ]
         self.model_path = "EleutherAI/gpt-j-6B"
+        self.engine = None
+        self._engine_config = None
+
+    def enable_engine(self, max_batch_size=8, prefix_cache_entries=64):
+        # Serve through gpt_engine.GPTEngine (continuous batching and
+        # prefix KV caching) instead of generate() on a static batch
+        self._engine_config = (max_batch_size, prefix_cache_entries)
     
     def get_id(self):
         return f"{self._model_name}-{self._batch_size}"
 
     def load_model(self):
-        self._tokenizer = AutoTokenizer.from_pretrained(self.model_path)
-        self._tokenizer.add_special_tokens({'pad_token': '[PAD]'})
-        self._model = GPTJForCausalLM.from_pretrained(
-            self.model_path,
-            revision="float16",
-            torch_dtype=torch.float16
-        ).to(self._device)
+        with self._load_phase("import"):
+            from transformers import GPTJForCausalLM, AutoTokenizer # type: ignore
+        dtype, key = self._load_dtype()
+        source, cached = self._weights_source(key)
+        with self._load_phase("deserialize"):
+            self._tokenizer = AutoTokenizer.from_pretrained(source)
+            self._tokenizer.add_special_tokens({'pad_token': '[PAD]'})
+
+        def load():
+            with self._load_phase("deserialize"):
+                # The hub's main branch has the fp32 weights
+                model = GPTJForCausalLM.from_pretrained(
+                    source,
+                    revision=None if cached or key == "fp32" else "float16",
+                    torch_dtype=dtype
+                )
+            self._cache_weights(key, cached, model, self._tokenizer)
+            return self._quantize(model)[0]
+
+        self._model = self._load_shared(load, GPTJForCausalLM, source)
+        self.weight_bytes = footprint(self._model)
+
+        if self._engine_config is not None:
+            from gpt_engine import GPTEngine, PrefixCache # type: ignore
+            max_batch_size, prefix_cache_entries = self._engine_config
+            self.engine = GPTEngine(
+                self._model,
+                self._tokenizer,
+                self._device,
+                max_batch_size=max_batch_size,
+                max_length=100,
+                prefix_cache=PrefixCache(prefix_cache_entries) if prefix_cache_entries else None
+            )
 
     def load_data(self):
         # Prepare batch size number of prompts
         for _ in range(self._batch_size):
             self._input_prompts.append(random.choice(self._prompts))
         
-        self._tokenized_prompts = self._tokenizer(self._input_prompts, return_tensors="pt", padding=True, truncation=True)
+        self._tokenized_prompts = self._prepare_inputs(self._input_prompts)
+
+    def _prepare_inputs(self, prompts):
+        with self._infer_phase("tokenize", len(prompts)):
+            tokenized_prompts = self._tokenizer(prompts, return_tensors="pt", padding=True, truncation=True)
 
         # Move inputs to GPU if available
-        self._tokenized_prompts.to(self._device)
+        with self._infer_phase("h2d", len(prompts), on_device=True):
+            tokenized_prompts.to(self._device)
+        return tokenized_prompts
 
     def infer(self):
-        outputs = self._model.generate(
-            **self._tokenized_prompts,
-            max_length=100,  
-            num_return_sequences=len(self._input_prompts), 
-            do_sample=True, 
-            temperature=0.7,
-            top_k=50,  
-            top_p=0.95, 
-            pad_token_id=self._tokenizer.eos_token_id  
-        )
-        # Decode generated responses
-        generated_responses = [self._tokenizer.decode(output, skip_special_tokens=True) for output in outputs]
-
-        # Print generated responses
-        for i, response in enumerate(generated_responses):
-            print(f"Prompt {i+1}: {self._input_prompts[i]}")
-            print(f"Generated Response: {response}\n")
-        return len(generated_responses)
+        if self.engine is not None:
+            return self._engine_forward(self._input_prompts)
+        return self._forward(self._input_prompts, self._tokenized_prompts)
+
+    def sample_request(self):
+        return random.choice(self._prompts)
+
+    def infer_batch(self, requests):
+        if self.engine is not None:
+            return self._engine_forward(requests)
+        return self._forward(requests, self._prepare_inputs(requests))
+
+    def _engine_forward(self, prompts):
+        with self._infer_phase("generate", len(prompts), on_device=True):
+            seqs = self.engine.generate(prompts)
+        self.postprocess_sequences(seqs)
+        return len(seqs)
+
+    def postprocess_sequences(self, seqs):
+        self._postprocess(self._format_sequences, seqs)
+
+    def _format_sequences(self, seqs):
+        lines = []
+        for i, seq in enumerate(seqs):
+            lines.append(f"Prompt {i+1}: {seq.prompt}")
+            lines.append(f"Generated Response: {self.engine.decode(seq)}\n")
+        return lines
+
+    def _forward(self, prompts, tokenized_prompts):
+        with self._infer_phase("generate", len(prompts), on_device=True):
+            outputs = self._model.generate(
+                **tokenized_prompts,
+                max_length=100,  
+                num_return_sequences=len(prompts), 
+                do_sample=True, 
+                temperature=0.7,
+                top_k=50,  
+                top_p=0.95, 
+                pad_token_id=self._tokenizer.eos_token_id,
+                **self._decode_step_kwargs()
+            )
+        with self._infer_phase("d2h", len(prompts), on_device=True):
+            outputs = outputs.cpu()
+        self._postprocess(self._format_responses, prompts, outputs)
+        return len(outputs)
+
+    def _format_responses(self, prompts, outputs):
+        # Decode generated responses, generate() returns
+        # num_return_sequences of them per prompt
+        lines = []
+        num_return_sequences = len(outputs) // len(prompts)
+        for i, output in enumerate(outputs):
+            response = self._tokenizer.decode(output, skip_special_tokens=True)
+            lines.append(f"Prompt {i+1}: {prompts[i // num_return_sequences]}")
+            lines.append(f"Generated Response: {response}\n")
+        return lines
 
 class Whisper(Inference):
-    def __init__(self, model_name, device_id, batch_size):
-        super().__init__(model_name, device_id, batch_size)
+    COMPILABLE = True
+    DEFAULT_PRECISION = "fp32"
+
+    def __init__(self, model_name, device_id, batch_size, weight_cache=None):
+        super().__init__(model_name, device_id, batch_size, weight_cache)
         curr_path = pathlib.Path(__file__).parent.resolve()
         self.input_path = os.path.join(curr_path, "data/speech.wav")
         self.model_path = "openai/whisper-small"
+        self.frontend = None
 
     def get_id(self):
         return f"{self._model_name}-{self._batch_size}"
 
     def load_model(self):
-        self._model = pipeline("automatic-speech-recognition", self.model_path, device=self._device)
+        with self._load_phase("import"):
+            from transformers import WhisperForConditionalGeneration, WhisperProcessor # type: ignore
+            from whisper_frontend import WhisperFrontend # type: ignore
+        dtype, key = self._load_dtype()
+        source, cached = self._weights_source(key)
+        with self._load_phase("deserialize"):
+            self._processor = WhisperProcessor.from_pretrained(source)
+
+        def load():
+            with self._load_phase("deserialize"):
+                model = WhisperForConditionalGeneration.from_pretrained(source, torch_dtype=dtype)
+            self._cache_weights(key, cached, model, self._processor)
+            return self._quantize(model)[0]
+
+        self._model = self._load_shared(load, WhisperForConditionalGeneration, source)
+        self.weight_bytes = footprint(self._model)
+        self._input_dtype = dtype
+        self._install_layer_hooks(self._model.model.encoder.layers)
+        # The encoder always sees 30 sec windows of log-mel features, the
+        # decoder's shapes change every step and it stays eager
+        self._model.model.encoder = self._compile(self._model.model.encoder)
+
+        # Log-mel features are computed in batches on the GPU (CPU without
+        # one) and cached, instead of by the pipeline on every request
+        self.frontend = WhisperFrontend(self._processor.feature_extractor, self._device)
     
     def load_data(self):
-        self._speeches = []
-        for _ in range(self._batch_size):
-            audio, _ = torchaudio.load(self.input_path)
-            self._speeches.append(audio[0].numpy())
+        # The file is read once and shared by every element of the batch
+        import torchaudio # type: ignore
+        audio, sampling_rate = torchaudio.load(self.input_path)
+        speech = self.frontend.resample(audio[0].numpy(), sampling_rate)
+        self._speeches = [speech] * self._batch_size
 
     def infer(self):
-        transcriptions = self._model(self._speeches)
-        return len(transcriptions)
-
-def get_inference_object(model, device_id, batch_size):
-    if model == "diffusion":
-        return StableDiffusion(model, device_id, batch_size)
-    elif model == "bert":
-        return BertLarge(model, device_id, batch_size)
-    elif model == "gpt":
-        return GPT(model, device_id, batch_size)
-    elif model == 'whisper':
-        return Whisper(model, device_id, batch_size)
+        return self.infer_batch(self._speeches)
+
+    def sample_request(self):
+        return self._speeches[0]
+
+    def infer_batch(self, requests):
+        # Audio longer than 30 secs is decoded window by window, and the
+        # text of its windows joined back together in post-processing.
+        # generate() never sees more windows than the batch has requests,
+        # so long audio takes more decoder calls instead of a larger batch.
+        with self._infer_phase("frontend", len(requests), on_device=True):
+            features, spans = self.frontend.features(requests)
+        max_windows = max(self._batch_size, len(requests))
+        with self._infer_phase("decoder", len(requests), on_device=True):
+            # The frontend computes fp32 features
+            token_ids = [self._model.generate(features[i:i + max_windows].to(self._input_dtype),
+                                              **self._decode_step_kwargs())
+                         for i in range(0, len(features), max_windows)]
+        with self._infer_phase("d2h", len(requests), on_device=True):
+            token_ids = [chunk.cpu() for chunk in token_ids]
+        self._postprocess(self._format_transcriptions, token_ids, spans)
+        return len(spans)
+
+    def _format_transcriptions(self, token_ids, spans):
+        # token_ids: one tensor per decoder call, of different lengths
+        texts = [text for chunk in token_ids for text in self._processor.batch_decode(chunk, skip_special_tokens=True)]
+        return [f"Transcription: {''.join(texts[start:end])}" for start, end in spans]
+
+class Synthetic(Inference):
+    # Stand-in for a real model, "synthetic:<model>": every request spins
+    # the CPU and keeps the device busy step by step, as calibrated from the
+    # single-model runs of <model> (see synthetic.py)
+    def __init__(self, model_name, device_id, batch_size, weight_cache=None, profile_dir=None):
+        super().__init__(model_name, device_id, batch_size, weight_cache)
+        self._target = model_name.split(":", 1)[1]
+        self._profile_dir = profile_dir
+        self._rng = None
+        self._sleep_cycles = 0 # GPU clock cycles per sec of torch.cuda._sleep
+
+    def get_id(self):
+        return f"{self._model_name}-{self._batch_size}"
+
+    def load_model(self):
+        with self._load_phase("import"):
+            import numpy as np
+            import synthetic # type: ignore
+        with self._load_phase("deserialize"):
+            self._profiles = synthetic.load_profiles(self._profile_dir or synthetic.DEFAULT_PROFILES)
+            self._profile = synthetic.get_profile(self._profiles, self._target, self._batch_size)
+            self._get_profile = synthetic.get_profile
+            self._rng = np.random.default_rng()
+        with self._load_phase("transfer"):
+            # Stands in for the weights and activations of the model. On the
+            # CPU the memory is only reserved, so a laptop can run SDXL's
+            if self._device.type == "cuda":
+                self._model = torch.zeros(self._profile.gpu_mem, dtype=torch.uint8, device=self._device)
+                self._sleep_cycles = self._calibrate_sleep()
+            else:
+                self._model = torch.empty(self._profile.gpu_mem, dtype=torch.uint8)
+
+    def _calibrate_sleep(self, cycles=10**7):
+        start, end = torch.cuda.Event(enable_timing=True), torch.cuda.Event(enable_timing=True)
+        torch.cuda._sleep(cycles)
+        start.record()
+        torch.cuda._sleep(cycles)
+        end.record()
+        end.synchronize()
+        return cycles / (start.elapsed_time(end) / 1000)
+
+    def load_data(self):
+        self._requests = list(range(self._batch_size))
+
+    def infer(self):
+        return self.infer_batch(self._requests)
+
+    def sample_request(self):
+        return 0
+
+    def infer_batch(self, requests):
+        profile = self._profile
+        if len(requests) != profile.batch_size:
+            profile = self._get_profile(self._profiles, self._target, len(requests))
+        for step, (cpu_time, device_time) in enumerate(profile.sample_steps(self._rng)):
+            if step > 0:
+                self._yield_step()
+            end = time.perf_counter() + cpu_time
+            while time.perf_counter() < end:
+                pass
+            if self._device.type == "cuda":
+                torch.cuda._sleep(int(device_time * self._sleep_cycles))
+                torch.cuda.current_stream(self._device).synchronize()
+            else:
+                time.sleep(device_time)
+        self._postprocess(self._format_outputs, len(requests))
+        return len(requests)
+
+    def _format_outputs(self, num_requests):
+        return [f"finished a synthetic {self._target} inference! ({num_requests} requests)"]
+
+def get_inference_object(model, device_id, batch_size, weight_cache=None, synthetic_profiles=None):
+    # model is <name>[@<precision>], e.g. bert@int8w. Synthetic models take
+    # the precision as part of the model they stand in for.
+    if model.startswith("synthetic:"):
+        return Synthetic(model, device_id, batch_size, weight_cache, synthetic_profiles)
+    name, precision = split_model(model)
+    if name == "diffusion":
+        model_obj = StableDiffusion(model, device_id, batch_size, weight_cache)
+    elif name == "bert":
+        model_obj = BertLarge(model, device_id, batch_size, weight_cache)
+    elif name == "gpt":
+        model_obj = GPT(model, device_id, batch_size, weight_cache)
+    elif name == 'whisper':
+        model_obj = Whisper(model, device_id, batch_size, weight_cache)
+    else:
+        raise ValueError(f"Unknown model: {model}")
+    if precision == "int8" and model_obj._device.type != "cpu":
+        raise ValueError(f"{model}: dynamic int8 quantization only runs on the CPU, use int8w on a GPU")
+    model_obj.precision = precision or model_obj.DEFAULT_PRECISION
+    return model_obj
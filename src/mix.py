@@ -0,0 +1,13 @@
+# Job mixes as given on the command line, shared by the orchestrator, the
+# sweep and the multi-model host without importing one another
+
+
+def parse_mix(mix):
+    # "<model>-<batch_size>" => (model, batch_size)
+    jobs = []
+    for job in mix:
+        parts = job.split("-")
+        if len(parts) != 2 or not parts[1].isdigit():
+            raise ValueError(f"Expected: Model-BatchSize, got: {job}")
+        jobs.append((parts[0], int(parts[1])))
+    return jobs
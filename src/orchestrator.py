@@ -0,0 +1,325 @@
+# Sample command:
+# python3 src/orchestrator.py \
+#    --device-type a100 --device-id 0 --modes tm --duration 20 \
+#    diffusion-1 whisper-1
+#
+# Runs a job mix like run.sh/run_job_mix.sh, but drives the executors over a
+# Unix domain socket (see control.py) instead of /tmp files, a FIFO and
+# SIGUSR1/SIGUSR2. Stats come back over the same channel. With --dry-run
+# the models are replaced by dry_run.py, so no GPU is needed; --cpu runs the
+# real executors on the CPU, e.g. with synthetic:<model> models. With
+# --target-ci, --duration is only an upper bound: the run stops as soon as
+# the confidence intervals of every model are narrow enough (see
+# convergence.py), and the warm up transient is left out of the stats.
+
+import argparse
+import fcntl
+import os
+import subprocess
+import sys
+import time
+import uuid
+from control import ControlServer # type: ignore
+from mix import parse_mix # type: ignore
+from convergence import ConvergenceMonitor # type: ignore
+from power import PowerSampler, NVMLBackend, ReplayBackend, POWER_FILE # type: ignore
+from timeslice import POLICIES # type: ignore
+from stats import compute_stats, flatten_results, acquire_lock, release_lock, mode_label # type: ignore
+from weight_share import cleanup as cleanup_shared_weights # type: ignore
+
+DEVICE_TYPES = ["4090", "a100", "a6000"]
+MODES = ["mps-uncap", "tm", "inproc", "slice"]
+EXECUTIONS = ["eager", "compile", "cudagraphs"] # same as inference.py, which needs torch
+LOAD_TIMEOUT = 2500 # secs, same as the 10000 x 0.25s polls of run_job_mix.sh
+EXIT_TIMEOUT = 60
+PROGRESS_INTERVAL = 1 # secs between the snapshots of executors with --target-ci
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+GIT_DIR = os.path.dirname(SRC_DIR)
+
+
+def get_result_dir(result_root, jobs, device_type):
+    # Same layout as get_result_dir in helper.sh
+    result_base = "-".join(model for model, _ in jobs)
+    result_id = "_".join(f"{model}-{batch_size}" for model, batch_size in jobs)
+    return os.path.join(result_root, device_type, result_base, result_id)
+
+
+def run_helper(function, *args):
+    cmd = f"source {GIT_DIR}/helper.sh && {function} {' '.join(map(str, args))}"
+    subprocess.run(["bash", "-c", cmd], check=True)
+
+
+class GPULock:
+    # Shares /tmp/gpu_<id>.lock with lock_gpu in helper.sh
+    def __init__(self, device_id):
+        self.path = f"/tmp/gpu_{device_id}.lock"
+        self.fd = None
+
+    def __enter__(self):
+        print(f"Attempting to acquire exclusive lock for GPU: {self.path}")
+        self.fd = open(self.path, "w")
+        fcntl.flock(self.fd, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *args):
+        fcntl.flock(self.fd, fcntl.LOCK_UN)
+        self.fd.close()
+
+
+class Orchestrator:
+    def __init__(self, opt):
+        self.opt = opt
+        self.jobs = parse_mix(opt.mix)
+        result_root = opt.result_root
+        if result_root is None:
+            result_root = "/tmp/dry-run-results" if opt.dry_run else os.path.join(GIT_DIR, "results")
+        self.result_dir = get_result_dir(result_root, self.jobs, opt.device_type)
+        self.log = open(opt.log_file, "a") if opt.log_file else subprocess.DEVNULL
+
+    def _load_args(self, load):
+        args = ["--load-mode", self.opt.load_mode, "--load", str(load)]
+        if self.opt.trace_file:
+            args += ["--trace-file", os.path.abspath(self.opt.trace_file)]
+        if self.opt.max_batch_size:
+            args += ["--max-batch-size", str(self.opt.max_batch_size),
+                     "--max-wait-ms", str(self.opt.max_wait_ms)]
+        return args
+
+    def _batching_args(self, model):
+        # Only the GPT model has a continuous batching engine
+        if self.opt.batching == "continuous" and model == "gpt":
+            return ["--batching", "continuous"]
+        return []
+
+    def _slice_args(self, mode):
+        if mode != "slice":
+            return []
+        args = ["--time-slice", self.opt.slice_policy]
+        if self.opt.slice_weights:
+            args += ["--slice-weights"] + [str(weight) for weight in self.opt.slice_weights]
+        if self.opt.slice_slos_ms:
+            args += ["--slice-slos-ms"] + [str(slo) for slo in self.opt.slice_slos_ms]
+        return args
+
+    def _env(self, mode):
+        env = dict(os.environ)
+        if self.opt.cpu:
+            env["CUDA_VISIBLE_DEVICES"] = ""
+        elif mode == "mps-uncap":
+            env["CUDA_MPS_ENABLE_PER_CTX_DEVICE_MULTIPROCESSOR_PARTITIONING"] = "0"
+            env["CUDA_MPS_PIPE_DIRECTORY"] = f"/tmp/mps_{self.opt.device_id}"
+            env["CUDA_VISIBLE_DEVICES"] = "0"
+        else:
+            env["CUDA_VISIBLE_DEVICES"] = str(self.opt.device_id)
+        return env
+
+    def _commands(self, mode, load, execution, socket_path):
+        # Assumes: we can run 7 models in parallel in a device
+        first_cpu = (self.opt.device_id * 7) + 1
+        common = ["--device-id", "0", "--control-socket", socket_path, "--sink", self.opt.sink,
+                  "--execution", execution]
+        if self.opt.weight_cache:
+            common += ["--weight-cache", self.opt.weight_cache]
+        if self.opt.target_ci:
+            common += ["--report-progress", "--snapshot-interval", str(PROGRESS_INTERVAL)]
+        if self.opt.cpu:
+            common += ["--cpu"]
+        if self.opt.synthetic_profiles:
+            common += ["--synthetic-profiles", os.path.abspath(self.opt.synthetic_profiles)]
+        if self.opt.timeline:
+            common += ["--timeline", self.result_dir]
+        if self.opt.share_weights:
+            common += ["--share-weights"]
+
+        if self.opt.dry_run:
+            return [
+                [sys.executable, f"{SRC_DIR}/dry_run.py", "--model", model,
+                 "--batch-size", str(batch_size), "--tid", str(tid)] + common
+                for tid, (model, batch_size) in enumerate(self.jobs)
+            ]
+
+        if mode in ["inproc", "slice"]:
+            mix = [f"{model}-{batch_size}" for model, batch_size in self.jobs]
+            cpus = f"{first_cpu}-{first_cpu + len(self.jobs) - 1}"
+            return [["taskset", "-c", cpus, sys.executable, f"{SRC_DIR}/host.py",
+                     "--mix"] + mix + ["--tid", "0"] + common + self._slice_args(mode)]
+
+        return [
+            ["taskset", "-c", str(first_cpu + tid), sys.executable, f"{SRC_DIR}/executor.py",
+             "--model", model, "--batch-size", str(batch_size), "--tid", str(tid)]
+            + common + self._load_args(load) + self._batching_args(model)
+            for tid, (model, batch_size) in enumerate(self.jobs)
+        ]
+
+    def _power_backend(self):
+        if self.opt.power_replay:
+            return ReplayBackend(self.opt.power_replay)
+        if self.opt.dry_run or self.opt.cpu:
+            return None
+        return NVMLBackend(self.opt.device_id)
+
+    def _wait_for_duration(self, procs, server, monitor):
+        start = time.monotonic()
+        deadline = start + self.opt.duration
+        while time.monotonic() < deadline:
+            timeout = min(1, max(0, deadline - time.monotonic()))
+            if monitor is None:
+                time.sleep(timeout)
+            else:
+                for tid, snapshot in server.receive_progress(timeout):
+                    monitor.add(tid, *snapshot)
+            if any(proc.poll() is not None for proc in procs):
+                failed = f" (tids {server.failed})" if server.failed else ""
+                raise RuntimeError(f"An executor exited during the experiment{failed}")
+            if monitor is not None and time.monotonic() - start >= self.opt.min_duration and monitor.converged():
+                print(f"Converged after {time.monotonic() - start:.0f}s: {monitor.status()}")
+                return
+        if monitor is not None:
+            print(f"Not converged after {self.opt.duration}s: {monitor.status()}")
+
+    def run_expr(self, mode, load, execution="eager"):
+        socket_path = f"/tmp/{uuid.uuid4()}.sock"
+        server = ControlServer(socket_path)
+        procs = []
+        sampler = None
+        monitor = None
+        if self.opt.target_ci:
+            monitor = ConvergenceMonitor(len(self.jobs), self.opt.target_ci, self.opt.confidence)
+        try:
+            os.makedirs(self.result_dir, exist_ok=True)
+            backend = self._power_backend()
+            if backend is not None:
+                sampler = PowerSampler(backend, os.path.join(self.result_dir, POWER_FILE),
+                                       self.opt.power_interval_ms / 1000)
+                sampler.start()
+
+            for cmd in self._commands(mode, load, execution, socket_path):
+                print(f"Running: {' '.join(cmd)}")
+                procs.append(subprocess.Popen(cmd, env=self._env(mode),
+                                              stdout=self.log, stderr=self.log))
+
+            # Wait till all executors have loaded their models
+            server.wait_for_ready(
+                len(procs),
+                is_alive=lambda: all(proc.poll() is None for proc in procs),
+                timeout=LOAD_TIMEOUT
+            )
+            print(f"Starting inference on {[proc.pid for proc in procs]}")
+            server.start()
+            self._wait_for_duration(procs, server, monitor)
+            server.stop()
+            results = server.collect_results()
+            for proc in procs:
+                proc.wait(timeout=EXIT_TIMEOUT)
+        finally:
+            for proc in procs:
+                if proc.poll() is None:
+                    proc.kill()
+                    proc.wait()
+            if self.opt.share_weights:
+                # Shared weights of executors that were killed
+                cleanup_shared_weights()
+            if sampler is not None:
+                sampler.stop()
+            server.close()
+
+        stats = []
+        for result in results:
+            stats.extend(flatten_results(result))
+        if monitor is not None:
+            for tid, infer_stats in stats:
+                monitor.apply(tid, infer_stats)
+        acquire_lock()
+        try:
+            compute_stats(stats, mode_label(mode, execution), self.result_dir)
+        finally:
+            release_lock()
+        print(f"Results stored in: {self.result_dir}")
+
+    def run(self):
+        loads = [1.0] if self.opt.load_mode == "closed" else self.opt.loads
+        for load in loads:
+            for mode in self.opt.modes:
+                for execution in self.opt.executions:
+                    print(f"Running {self.opt.load_mode} loop experiment at load {load} for {mode} ({execution})")
+                    if self.opt.dry_run or self.opt.cpu:
+                        self.run_expr(mode, load, execution)
+                        continue
+                    with GPULock(self.opt.device_id):
+                        run_helper("enable_mps_if_needed", mode, self.opt.device_id)
+                        try:
+                            self.run_expr(mode, load, execution)
+                        finally:
+                            run_helper("disable_mps_if_needed", mode, self.opt.device_id)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(allow_abbrev=False)
+    parser.add_argument("--device-type", type=str, required=True, choices=DEVICE_TYPES)
+    parser.add_argument("--device-id", type=int, required=True)
+    parser.add_argument("--modes", type=lambda x: x.split(","), default=["mps-uncap", "tm"])
+    parser.add_argument("--executions", type=lambda x: x.split(","), default=["eager"],
+                        help="Run every mode with each of eager, compile and cudagraphs")
+    parser.add_argument("--duration", type=int, default=120,
+                        help="Secs to run for, at most that with --target-ci")
+    parser.add_argument("--target-ci", type=float, default=None,
+                        help="Stop once every interval is narrower than this, relative to its estimate (e.g. 0.05)")
+    parser.add_argument("--confidence", type=float, default=0.95,
+                        help="Confidence level of the intervals of --target-ci")
+    parser.add_argument("--min-duration", type=int, default=10,
+                        help="Secs to run for at least with --target-ci")
+    parser.add_argument("--load-mode", type=str, default="closed", choices=["closed", "poisson", "trace"])
+    parser.add_argument("--loads", type=lambda x: [float(l) for l in x.split(",")], default=[1.0])
+    parser.add_argument("--trace-file", type=str, default=None)
+    parser.add_argument("--max-batch-size", type=int, default=None)
+    parser.add_argument("--max-wait-ms", type=float, default=0.0)
+    parser.add_argument("--batching", type=str, default="static", choices=["static", "continuous"])
+    parser.add_argument("--result-root", type=str, default=None)
+    parser.add_argument("--log-file", type=str, default=None)
+    parser.add_argument("--power-interval-ms", type=float, default=100)
+    parser.add_argument("--power-replay", type=str, default=None,
+                        help="Replay an nvidia-smi pwr.csv instead of sampling NVML")
+    parser.add_argument("--timeline", action="store_true",
+                        help="Record every batch and attribute the GPU's energy to the models (energy*.csv)")
+    parser.add_argument("--sink", type=str, default="print",
+                        help="Where executors put post-processed outputs: print, quiet or file:<path>")
+    parser.add_argument("--weight-cache", type=str, default=None,
+                        help="Dir of pre-converted safetensors snapshots of the models")
+    parser.add_argument("--share-weights", action="store_true",
+                        help="Executors of the same model share one read-only copy of its weights")
+    parser.add_argument("--slice-policy", type=str, default="round-robin",
+                        help="How slice mode picks the next model: round-robin, edf or weighted")
+    parser.add_argument("--slice-weights", type=lambda x: [float(w) for w in x.split(",")], default=None,
+                        help="Share of device time of each model in slice mode (weighted)")
+    parser.add_argument("--slice-slos-ms", type=lambda x: [float(s) for s in x.split(",")], default=None,
+                        help="Latency SLO of each model in slice mode (edf)")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="Replace the models with dry_run.py, no GPU needed")
+    parser.add_argument("--cpu", action="store_true",
+                        help="Run the models on the CPU (e.g. synthetic:<model>), no GPU needed")
+    parser.add_argument("--synthetic-profiles", type=str, default=None,
+                        help="Device result dir synthetic models are calibrated from (default results/a100)")
+    parser.add_argument("mix", nargs="+", help="Models as <model>-<batch_size>")
+    opt = parser.parse_args()
+
+    for mode in opt.modes:
+        if mode not in MODES:
+            parser.error(f"Invalid mode: {mode}. Must be one of: {', '.join(MODES)}")
+    for execution in opt.executions:
+        if execution not in EXECUTIONS:
+            parser.error(f"Invalid execution: {execution}. Must be one of: {', '.join(EXECUTIONS)}")
+    if "slice" in opt.modes and opt.executions != ["eager"]:
+        parser.error("slice mode needs eager execution, compiled models cannot yield at step boundaries")
+    if opt.load_mode == "trace" and opt.trace_file is None:
+        parser.error("--trace-file is required with --load-mode trace")
+    if opt.load_mode != "closed" and ("inproc" in opt.modes or "slice" in opt.modes):
+        parser.error("inproc and slice modes only support closed loop")
+    if opt.slice_policy not in POLICIES:
+        parser.error(f"Invalid slice policy: {opt.slice_policy}. Must be one of: {', '.join(POLICIES)}")
+    for values in [opt.slice_weights, opt.slice_slos_ms]:
+        if values is not None and len(values) != len(opt.mix):
+            parser.error("--slice-weights and --slice-slos-ms need one value per model of the mix")
+
+    Orchestrator(opt).run()
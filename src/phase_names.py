@@ -0,0 +1,10 @@
+# Names of the phases of model start-up and of a request, shared by the
+# models (inference.py) and the CSVs they end up in (stats.py), which
+# doesn't import torch.
+
+# quantize: int8 variants (see quantize.py), warmup: the warm up requests,
+# which is when compiled models compile
+LOAD_PHASES = ["import", "deserialize", "quantize", "transfer", "warmup"]
+# Phases of a request (see phases.py): host-side input preparation,
+# copies each way and the model itself, named after what it runs
+INFER_PHASES = ["tokenize", "h2d", "forward", "generate", "denoise", "frontend", "decoder", "d2h"]
@@ -0,0 +1,90 @@
+# Per-request timing of the phases of inference (tokenize, h2d, forward,
+# d2h, ...) that the models of inference.py share. Phases that run on the
+# device are timed with CUDA events on the current stream, so nothing is
+# synchronized: the events of a phase are read once the device has passed
+# them, at the start of a later phase or at the end of the run. Host-only
+# phases and every phase on the CPU are timed with perf_counter_ns. Each
+# phase is also an NVTX range, under the "request" range of the executor,
+# for the timelines of profiler.sh. The cost is a few microseconds per
+# phase, so timing stays on in every run (tests/test_phases.py measures
+# it).
+
+import collections
+import contextlib
+import time
+import torch
+from histogram import LogHistogram # type: ignore
+
+MAX_PENDING = 1024 # phases waiting on the device before they are waited for
+
+
+class PhaseTimer:
+    def __init__(self, device):
+        # phase => LogHistogram of secs, recorded once per request
+        self.hists = {}
+        self._cuda = device.type == "cuda"
+        self._nvtx = torch.cuda.is_available()
+        self._pending = collections.deque() # (phase, start event, end event, num requests)
+        self._free_events = []
+
+    def _event(self):
+        if self._free_events:
+            return self._free_events.pop()
+        return torch.cuda.Event(enable_timing=True)
+
+    def _record(self, phase, secs, num_requests):
+        hist = self.hists.get(phase)
+        if hist is None:
+            hist = self.hists[phase] = LogHistogram()
+        hist.record(secs, num_requests)
+
+    def _resolve(self, wait=False):
+        # Records the phases the device is done with, oldest first
+        while self._pending:
+            phase, start, end, num_requests = self._pending[0]
+            if wait:
+                end.synchronize()
+            elif not end.query():
+                break
+            self._pending.popleft()
+            self._record(phase, start.elapsed_time(end) / 1000, num_requests)
+            self._free_events += [start, end]
+
+    @contextlib.contextmanager
+    def range(self, name):
+        # NVTX range only, e.g. around a whole request
+        if self._nvtx:
+            torch.cuda.nvtx.range_push(name)
+        try:
+            yield
+        finally:
+            if self._nvtx:
+                torch.cuda.nvtx.range_pop()
+
+    @contextlib.contextmanager
+    def phase(self, name, num_requests, on_device=False):
+        # on_device: the phase launches work on the device (kernels and
+        # copies), timed by events on a GPU
+        with self.range(name):
+            if on_device and self._cuda:
+                self._resolve()
+                start = self._event()
+                start.record()
+                yield
+                end = self._event()
+                end.record()
+                self._pending.append((name, start, end, num_requests))
+                if len(self._pending) > MAX_PENDING:
+                    self._resolve(wait=True)
+            else:
+                start_ns = time.perf_counter_ns()
+                yield
+                self._record(name, (time.perf_counter_ns() - start_ns) / 1e9, num_requests)
+
+    def flush(self):
+        # Waits for the phases still on the device
+        self._resolve(wait=True)
+
+    def clear(self):
+        self.flush()
+        self.hists.clear()
@@ -0,0 +1,130 @@
+# CPU-side work on model outputs (decoding tokens, converting images,
+# printing) runs on a pool of worker threads fed through a bounded queue,
+# so the executor can launch the next forward pass as soon as the outputs
+# are off the GPU. A full queue blocks the submitter, so a post-processing
+# backlog still shows up in the measured latencies instead of growing
+# without bound.
+
+import queue
+import sys
+import threading
+import time
+import traceback
+from histogram import LogHistogram # type: ignore
+
+SINKS = ["print", "quiet", "file:<path>"]
+
+
+class QuietSink:
+    def write(self, lines):
+        pass
+
+    def close(self):
+        pass
+
+
+class PrintSink:
+    def __init__(self, stream=sys.stdout):
+        self._stream = stream
+        self._lock = threading.Lock()
+
+    def write(self, lines):
+        with self._lock:
+            for line in lines:
+                print(line, file=self._stream)
+
+    def close(self):
+        self._stream.flush()
+
+
+class FileSink(PrintSink):
+    def __init__(self, path):
+        super().__init__(open(path, "a"))
+
+    def close(self):
+        self._stream.close()
+
+
+def get_sink(spec):
+    # "print", "quiet" or "file:<path>"
+    if spec == "print":
+        return PrintSink()
+    if spec == "quiet":
+        return QuietSink()
+    if spec.startswith("file:"):
+        return FileSink(spec[len("file:"):])
+    raise ValueError(f"Invalid sink: {spec}. Must be one of: {', '.join(SINKS)}")
+
+
+class PostProcessor:
+    # Also measures end-to-end time: from the reference times given to
+    # mark() (when serving started, or when the requests arrived) until the
+    # outputs of the call have been post-processed
+    def __init__(self, sink, num_workers=1, max_queue=64):
+        self.sink = sink
+        self._queue = queue.Queue(max_queue)
+        self._lock = threading.Lock()
+        self._reference_times = []
+        self.end_to_end = LogHistogram()
+        # First exception of fn or the sink, raised by reset() so that the
+        # run fails instead of silently dropping outputs
+        self.error = None
+        self._workers = [threading.Thread(target=self._work, daemon=True) for _ in range(num_workers)]
+        for worker in self._workers:
+            worker.start()
+
+    def mark(self, reference_times):
+        self._reference_times = reference_times
+
+    def submit(self, fn, *args):
+        # fn(*args) returns the lines to hand to the sink
+        self._queue.put((fn, args, self._reference_times))
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                self._queue.task_done()
+                return
+            fn, args, reference_times = item
+            try:
+                self.sink.write(fn(*args))
+            except Exception as exc:
+                # The worker keeps consuming the queue, a dead one would
+                # leave submit() blocked on a full queue
+                traceback.print_exc(file=sys.stderr)
+                with self._lock:
+                    if self.error is None:
+                        self.error = exc
+            finally:
+                end_time = time.monotonic()
+                with self._lock:
+                    for reference_time in reference_times:
+                        self.end_to_end.record(end_time - reference_time)
+                self._queue.task_done()
+
+    def drain(self):
+        self._queue.join()
+
+    def reset(self):
+        # Waits for outstanding work and starts a new end-to-end histogram
+        self.drain()
+        with self._lock:
+            error, self.error = self.error, None
+            end_to_end, self.end_to_end = self.end_to_end, LogHistogram()
+        if error is not None:
+            raise RuntimeError("Post-processing of outputs failed") from error
+        return end_to_end
+
+    def stop(self):
+        # Finishes the outstanding work and stops the workers, the sink
+        # stays open for the other post-processors writing to it
+        self.drain()
+        for _ in self._workers:
+            self._queue.put(None)
+        for worker in self._workers:
+            worker.join()
+
+    def close(self):
+        self.stop()
+        self.sink.close()
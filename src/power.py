@@ -0,0 +1,156 @@
+# Sample command:
+# python3 src/power.py --device-id 0 --interval-ms 50 --output dir1/pwr.bin
+#
+# Samples GPU power at a fixed interval and writes fixed-size binary
+# records (see POWER_DTYPE) with CLOCK_MONOTONIC timestamps, which is the
+# same clock executors use, so energy can be integrated straight from the
+# file. --replay feeds an existing nvidia-smi pwr.csv instead of NVML.
+
+import argparse
+import signal
+import struct
+import threading
+import time
+import numpy as np
+
+POWER_FILE = "pwr.bin"
+POWER_DTYPE = np.dtype([
+    ("t", "<i8"),         # time.monotonic_ns()
+    ("power", "<f4"),     # W
+    ("util", "<f4"),      # GPU utilization %
+    ("mem_used", "<f4"),  # MiB
+])
+POWER_RECORD = struct.Struct("<qfff")
+FLUSH_INTERVAL = 1 # secs
+
+
+class NVMLBackend:
+    def __init__(self, device_id):
+        import pynvml # type: ignore
+        self._nvml = pynvml
+        pynvml.nvmlInit()
+        self._handle = pynvml.nvmlDeviceGetHandleByIndex(device_id)
+
+    def read(self):
+        power = self._nvml.nvmlDeviceGetPowerUsage(self._handle) / 1000
+        util = self._nvml.nvmlDeviceGetUtilizationRates(self._handle).gpu
+        mem_used = self._nvml.nvmlDeviceGetMemoryInfo(self._handle).used / 2**20
+        return power, util, mem_used
+
+    def close(self):
+        self._nvml.nvmlShutdown()
+
+
+class ReplayBackend:
+    # Replays a pwr.csv written by `nvidia-smi --query-gpu=... --format=csv`.
+    # nvidia-smi interleaves one row per GPU, so only every num_devices-th
+    # row starting at device_index belongs to the device.
+    def __init__(self, pwr_csv, device_index=0, num_devices=1):
+        self._samples = []
+        with open(pwr_csv) as f:
+            header = [col.strip() for col in f.readline().split(",")]
+            power_col = header.index("power.draw [W]")
+            util_col = header.index("utilization.gpu [%]")
+            mem_col = header.index("memory.used [MiB]")
+            for i, line in enumerate(f):
+                if i % num_devices != device_index:
+                    continue
+                cols = line.split(",")
+                try:
+                    self._samples.append((
+                        float(cols[power_col].strip().split()[0]),
+                        float(cols[util_col].strip().split()[0]),
+                        float(cols[mem_col].strip().split()[0]),
+                    ))
+                except (ValueError, IndexError):
+                    continue
+        self._next = 0
+
+    def __len__(self):
+        return len(self._samples)
+
+    def read(self):
+        # Loops around once the recording runs out
+        sample = self._samples[self._next % len(self._samples)]
+        self._next += 1
+        return sample
+
+    def close(self):
+        pass
+
+
+class PowerSampler(threading.Thread):
+    def __init__(self, backend, output, interval=0.1):
+        super().__init__(daemon=True)
+        self.backend = backend
+        self.output = output
+        self.interval = interval
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+    def run(self):
+        # Sample on an absolute schedule so that slow reads do not drift
+        next_sample = time.monotonic()
+        next_flush = next_sample + FLUSH_INTERVAL
+        with open(self.output, "wb") as f:
+            while not self._stop_event.is_set():
+                power, util, mem_used = self.backend.read()
+                f.write(POWER_RECORD.pack(time.monotonic_ns(), power, util, mem_used))
+
+                now = time.monotonic()
+                if now >= next_flush:
+                    f.flush()
+                    next_flush = now + FLUSH_INTERVAL
+                next_sample += self.interval
+                if next_sample < now:
+                    next_sample = now
+                self._stop_event.wait(next_sample - now)
+        self.backend.close()
+
+
+def load_power(path):
+    return np.fromfile(path, dtype=POWER_DTYPE)
+
+
+def energy(samples, start_ns=None, end_ns=None):
+    # Trapezoidal integration of power over time, in joules
+    if start_ns is not None:
+        samples = samples[samples["t"] >= start_ns]
+    if end_ns is not None:
+        samples = samples[samples["t"] <= end_ns]
+    if len(samples) < 2:
+        return 0.0
+    t = (samples["t"] - samples["t"][0]) / 1e9
+    power = samples["power"].astype(np.float64)
+    return float(np.sum(np.diff(t) * (power[1:] + power[:-1]) / 2))
+
+
+def get_backend(opt):
+    if opt.replay:
+        return ReplayBackend(opt.replay, opt.replay_device_index, opt.replay_num_devices)
+    return NVMLBackend(opt.device_id)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(allow_abbrev=False)
+    parser.add_argument("--device-id", type=int, default=0)
+    parser.add_argument("--interval-ms", type=float, default=100)
+    parser.add_argument("--output", type=str, required=True)
+    parser.add_argument("--replay", type=str, default=None,
+                        help="Replay an nvidia-smi pwr.csv instead of reading NVML")
+    parser.add_argument("--replay-device-index", type=int, default=0)
+    parser.add_argument("--replay-num-devices", type=int, default=1)
+    opt = parser.parse_args()
+
+    sampler = PowerSampler(get_backend(opt), opt.output, opt.interval_ms / 1000)
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+    signal.signal(signal.SIGINT, lambda signum, frame: stop.set())
+    sampler.start()
+    while not stop.wait(1):
+        pass
+    sampler.stop()
@@ -0,0 +1,84 @@
+# Precision variants of the models. A model in a mix can carry a precision,
+# <model>@<precision>-<batch_size> (e.g. bert@int8w-8), and runs in its
+# default precision without one. fp32, fp16 and bf16 load the weights in
+# that dtype. The int8 variants only quantize Linear layers, which hold the
+# bulk of the weights of all four models; convolutions, embeddings and
+# norms keep the compute dtype:
+#   int8   dynamic quantization (torch.ao): int8 weights, activations
+#          quantized on the fly. PyTorch only has CPU kernels for it.
+#   int8w  weight-only: int8 weights with a scale per output channel,
+#          dequantized to the compute dtype at every matmul, on any device.
+# tests/test_quantize.py compares every variant with fp32 on a small model
+# on the CPU.
+
+import itertools
+import torch
+
+PRECISIONS = ["fp32", "fp16", "bf16", "int8", "int8w"]
+DTYPES = {"fp32": torch.float32, "fp16": torch.float16, "bf16": torch.bfloat16}
+
+
+def split_model(model):
+    # "bert@int8" => ("bert", "int8"), ("bert", None) without a precision
+    model, _, precision = model.partition("@")
+    if precision and precision not in PRECISIONS:
+        raise ValueError(f"Unknown precision: {precision}. Must be one of: {', '.join(PRECISIONS)}")
+    return model, precision or None
+
+
+class Int8Linear(torch.nn.Module):
+    # Weight-only int8 replacement of a torch.nn.Linear
+    def __init__(self, linear):
+        super().__init__()
+        self.in_features = linear.in_features
+        self.out_features = linear.out_features
+        weight = linear.weight.detach().float()
+        scale = weight.abs().amax(dim=1, keepdim=True).clamp(min=1e-8) / 127
+        self.register_buffer("weight", torch.round(weight / scale).to(torch.int8))
+        self.register_buffer("scale", scale.to(linear.weight.dtype))
+        self.bias = linear.bias
+
+    def forward(self, x):
+        weight = self.weight.to(x.dtype) * self.scale.to(x.dtype)
+        return torch.nn.functional.linear(x, weight, self.bias)
+
+
+def _quantize_weights(module):
+    # Replaces Linear layers in place. Layers whose weight is tied to
+    # another module (BERT's and Whisper's output projections share the
+    # token embeddings) are left alone, quantizing them would add a copy.
+    tied = {id(param) for submodule in module.modules() if not isinstance(submodule, torch.nn.Linear)
+            for param in submodule.parameters(recurse=False)}
+    for parent in list(module.modules()):
+        for name, child in parent.named_children():
+            if isinstance(child, torch.nn.Linear) and id(child.weight) not in tied:
+                setattr(parent, name, Int8Linear(child))
+    return module
+
+
+def quantize(module, precision):
+    # The module is expected on the CPU, in fp32 for int8
+    if precision == "int8":
+        return torch.ao.quantization.quantize_dynamic(module, {torch.nn.Linear}, dtype=torch.qint8)
+    if precision == "int8w":
+        return _quantize_weights(module)
+    return module
+
+
+def footprint(*modules):
+    # Bytes of weights: parameters, buffers and the packed weights of
+    # dynamically quantized layers, shared tensors counted once
+    seen = set()
+    total = 0
+    for module in modules:
+        tensors = itertools.chain(module.parameters(), module.buffers())
+        for submodule in module.modules():
+            if hasattr(submodule, "_packed_params"):
+                tensors = itertools.chain(tensors, [submodule.weight()])
+                if submodule.bias() is not None:
+                    tensors = itertools.chain(tensors, [submodule.bias()])
+        for tensor in tensors:
+            if tensor.data_ptr() not in seen:
+                seen.add(tensor.data_ptr())
+                total += tensor.numel() * tensor.element_size()
+    return total
@@ -2,7 +2,11 @@
 # python3 new_stats.py \
 #    --mode mps-uncap \
 #    --result_dir dir1 \
+#    --quantiles 99.9,99.99 \
 #    /tmp/111003.pkl /tmp/111004.pkl /tmp/111005.pkl
+#
+# Pickles that share a tid (e.g. repeated runs of a mix) are merged: their
+# latency histograms are added up and their throughputs averaged.
 
 import argparse
 import os
@@ -12,22 +16,68 @@ import atexit
 import fcntl
 import numpy as np
 import pandas as pd
+from histogram import LogHistogram # type: ignore
+from convergence import CI_PERCENTILES # type: ignore
+from power import POWER_FILE, load_power # type: ignore
+from timeline import attribute, load_timeline # type: ignore
+from phase_names import LOAD_PHASES, INFER_PHASES # type: ignore
 
 
 TPUT = "tput"
+MEM_GPU = "mem_gpu"
+MEM_RSS = "mem_rss"
+MEM_WEIGHTS = "mem_weights"
+MEM_DEVICE = "mem_device"
 TOTAL_PREFIX = "total"
+QUEUE_PREFIX = "queue"
+SERVICE_PREFIX = "service"
+BATCH_PREFIX = "batch"
+E2E_PREFIX = "e2e"
+LOAD_PREFIX = "load"
 PERCENTILES = [0, 50, 90, 99, 100]
 
-METRIC_NAMES = [TPUT]
-for prefix in [TOTAL_PREFIX]:
-    for percentile in PERCENTILES:
-        METRIC_NAMES.append(f"{prefix}_p{percentile}")
+LATENCY_PREFIXES = [TOTAL_PREFIX, QUEUE_PREFIX, SERVICE_PREFIX, BATCH_PREFIX, E2E_PREFIX] + INFER_PHASES
+# Adaptive duration runs (orchestrator.py --target-ci): the secs of warm up
+# left out, and the bounds of the confidence intervals of these metrics
+TRANSIENT = "transient"
+CI_METRICS = [TPUT] + [f"{TOTAL_PREFIX}_p{q}" for q in CI_PERCENTILES]
+CI_BOUNDS = ["lo", "hi"]
+# Runs with timelines (--timeline): joules of the GPU attributed to each
+# model over the run, and per request
+ENERGY = "energy"
+ENERGY_PREFIX = "energy_req"
+
+
+def get_metric_names(percentiles):
+    metric_names = [TPUT, MEM_GPU, MEM_RSS, MEM_WEIGHTS, MEM_DEVICE]
+    for phase in LOAD_PHASES:
+        metric_names.append(f"{LOAD_PREFIX}_{phase}")
+    for prefix in LATENCY_PREFIXES:
+        for percentile in percentiles:
+            metric_names.append(f"{prefix}_p{percentile}")
+    metric_names.append(ENERGY)
+    metric_names.append(ENERGY_PREFIX)
+    for percentile in percentiles:
+        metric_names.append(f"{ENERGY_PREFIX}_p{percentile}")
+    metric_names.append(TRANSIENT)
+    for metric in CI_METRICS:
+        for bound in CI_BOUNDS:
+            metric_names.append(f"{metric}_{bound}")
+    return metric_names
+
+
+METRIC_NAMES = get_metric_names(PERCENTILES)
+
+
+def mode_label(mode, execution="eager"):
+    # Compiled runs get their own rows, next to the eager ones of the mode
+    return mode if execution == "eager" else f"{mode}+{execution}"
 
 
 def acquire_lock():
     print("Attempting to acquire stat lock")
     global lock_fd
-    lock_fd = open(sys.argv[0], 'r+')
+    lock_fd = open(__file__, 'r+')
     fcntl.flock(lock_fd, fcntl.LOCK_EX)  # Acquire an exclusive lock
     print("Acquired stat lock")
 
@@ -37,16 +87,44 @@ def release_lock():
     lock_fd.close()
 
 
+def flatten_results(results):
+    # An executor returns a single (tid, infer_stats) result, the multi-model
+    # host returns a list with one result per lane
+    if isinstance(results, tuple):
+        results = [results]
+    return results
+
+
 def load_pickle_file(file_path):
     with open(file_path, 'rb') as f:
-        return pickle.load(f)
+        return flatten_results(pickle.load(f))
 
 
-def populate_stats(id, array, tid, metrics):
+def to_histogram(array):
+    # Older executors return raw latency lists
+    if isinstance(array, LogHistogram):
+        return array
+    hist = LogHistogram()
+    for value in array:
+        hist.record(value)
+    return hist
+
+
+def merge_histograms(arrays):
+    merged = LogHistogram()
+    for array in arrays:
+        merged.merge(to_histogram(array))
+    return merged
+
+
+def populate_stats(id, array, tid, metrics, scale=1000, percentiles=PERCENTILES):
     # Calculate percentiles
-    percentile_metrics = np.percentile(array, PERCENTILES)
-    for i, percentile in enumerate(PERCENTILES):
-        metrics[f"{id}_p{percentile}"][tid] = percentile_metrics[i] * 1000
+    if isinstance(array, LogHistogram):
+        percentile_metrics = array.percentiles(percentiles)
+    else:
+        percentile_metrics = np.percentile(array, percentiles)
+    for i, percentile in enumerate(percentiles):
+        metrics[f"{id}_p{percentile}"][tid] = percentile_metrics[i] * scale
 
 
 def create_dir(directory):
@@ -56,6 +134,153 @@ def create_dir(directory):
         pass
 
 
+def group_results(results):
+    # tid => [infer_stats, ...] with the optional extras filled in
+    grouped = {}
+    for tid, infer_stats in results:
+        model, tput, total_times, *extra = infer_stats
+        extra = extra[0] if extra else {}
+        grouped.setdefault(tid, []).append((model, tput, total_times, extra))
+    return grouped
+
+
+def mean_of(values):
+    values = [value for value in values if value is not None]
+    return sum(values) / len(values) if values else None
+
+
+def attribute_energy(grouped, result_dir):
+    # tid => energy attribution (timeline.attribute) of a run in which every
+    # model recorded a timeline and pwr.bin was sampled
+    timelines = {tid: runs[0][3].get("timeline") for tid, runs in grouped.items() if len(runs) == 1}
+    power_file = os.path.join(result_dir, POWER_FILE)
+    if len(timelines) != len(grouped) or None in timelines.values() or not os.path.exists(power_file):
+        return {}
+    attribution, _ = attribute(load_power(power_file),
+                               {tid: load_timeline(path) for tid, path in timelines.items()})
+    return attribution
+
+
+def peak_device_memory(result_dir):
+    # Peak memory used on the device over the run, as NVML sees it in
+    # pwr.bin (MiB). Unlike the allocator peaks of mem_gpu, it includes the
+    # CUDA context of every process and the MPS server.
+    power_file = os.path.join(result_dir, POWER_FILE)
+    if not os.path.exists(power_file):
+        return None
+    samples = load_power(power_file)
+    return float(samples["mem_used"].max()) if len(samples) else None
+
+
+def compute_stats(results, mode, result_dir, extra_quantiles=[]):
+    create_dir(result_dir)
+    percentiles = PERCENTILES + [q for q in extra_quantiles if q not in PERCENTILES]
+
+    grouped = group_results(results)
+    energy = attribute_energy(grouped, result_dir)
+    device_mem = peak_device_memory(result_dir)
+    num_models = max(grouped) + 1
+    models = [None] * num_models
+    load = 1.0
+    metrics = {}
+    for metric_name in get_metric_names(percentiles):
+        metrics[metric_name] = [None] * num_models
+
+    for tid, runs in grouped.items():
+        model = runs[0][0]
+        for run in runs:
+            assert run[0] == model, f"tid {tid} ran both {model} and {run[0]}"
+        models[tid] = f"{tid}_{model}"
+        extras = [extra for _, _, _, extra in runs]
+
+        total_hist = merge_histograms(total_times for _, _, total_times, _ in runs)
+        populate_stats(TOTAL_PREFIX, total_hist, tid, metrics, percentiles=percentiles)
+        metrics[TPUT][tid] = mean_of(tput for _, tput, _, _ in runs)
+
+        # Memory footprint in MiB
+        gpu_mem = mean_of(extra.get("gpu_mem") for extra in extras)
+        if gpu_mem is not None:
+            metrics[MEM_GPU][tid] = gpu_mem / 2**20
+        rss = mean_of(extra.get("rss") for extra in extras)
+        if rss is not None:
+            metrics[MEM_RSS][tid] = rss / 2**20
+        # The whole device, reported once for the mix like the RSS in inproc
+        if device_mem is not None and tid == min(grouped):
+            metrics[MEM_DEVICE][tid] = device_mem
+        # Weights alone, in the precision they run in
+        weight_mem = mean_of(extra.get("weight_mem") for extra in extras)
+        if weight_mem is not None:
+            metrics[MEM_WEIGHTS][tid] = weight_mem / 2**20
+
+        # Model load time (secs) broken down by phase
+        for phase in LOAD_PHASES:
+            metrics[f"{LOAD_PREFIX}_{phase}"][tid] = mean_of(
+                extra.get("load_times", {}).get(phase) for extra in extras)
+
+        # Open loop runs break latency down into queueing and service time
+        if all("queue_times" in extra for extra in extras):
+            for prefix, key in [(QUEUE_PREFIX, "queue_times"), (SERVICE_PREFIX, "service_times")]:
+                hist = merge_histograms(extra[key] for extra in extras)
+                populate_stats(prefix, hist, tid, metrics, percentiles=percentiles)
+            load = extras[0]["load"]
+
+        # Latency until the outputs were post-processed, total_p* only
+        # covers the critical path up to getting them off the GPU
+        if all("e2e_times" in extra for extra in extras):
+            hist = merge_histograms(extra["e2e_times"] for extra in extras)
+            populate_stats(E2E_PREFIX, hist, tid, metrics, percentiles=percentiles)
+
+        # Time each request spent in the phases of inference (tokenize, h2d,
+        # forward, d2h, ...) of its model
+        for phase in INFER_PHASES:
+            phase_times = [extra.get("infer_times", {}).get(phase) for extra in extras]
+            if all(times is not None for times in phase_times):
+                hist = merge_histograms(phase_times)
+                populate_stats(phase, hist, tid, metrics, percentiles=percentiles)
+
+        # Steady state confidence intervals, latencies in ms like total_p*
+        convergence = extras[0].get("convergence") if len(extras) == 1 else None
+        if convergence is not None:
+            metrics[TRANSIENT][tid] = convergence["transient"]
+            for metric in CI_METRICS:
+                scale = 1 if metric == TPUT else 1000
+                for bound, value in zip(CI_BOUNDS, convergence[metric]):
+                    metrics[f"{metric}_{bound}"][tid] = value * scale
+
+        # Energy attributed to the model by its active intervals, in joules
+        if energy.get(tid, {}).get("requests"):
+            metrics[ENERGY][tid] = energy[tid]["energy"]
+            metrics[ENERGY_PREFIX][tid] = energy[tid]["energy"] / energy[tid]["requests"]
+            populate_stats(ENERGY_PREFIX, energy[tid]["per_request"], tid, metrics, scale=1,
+                           percentiles=percentiles)
+
+        # Distribution of the batch sizes formed by the dynamic batcher
+        batch_sizes = merge_histograms(extra.get("batch_sizes", []) for extra in extras)
+        if len(batch_sizes):
+            populate_stats(BATCH_PREFIX, batch_sizes, tid, metrics, scale=1, percentiles=percentiles)
+
+    # Create a DataFrame for each metric type, with a column per tid that
+    # returned results (an executor that failed leaves a gap)
+    for metric_type, metrics_list in metrics.items():
+        if all(metric is None for metric in metrics_list):
+            continue
+        df_data = {
+            models[tid]: metrics_list[tid] for tid in sorted(grouped)
+        }
+        df_data["mode"] = mode
+        df_data["load"] = load
+        df = pd.DataFrame(df_data, index=[metric_type])
+        cols = (["mode", "load"] +
+                [col for col in df.columns if col != "mode" and col != "load"])
+        df = df[cols]
+
+        csv_file = os.path.join(result_dir, f"{metric_type}.csv")
+        if os.path.exists(csv_file):
+            df.to_csv(csv_file, mode='a', header=False, index=False)
+        else:
+            df.to_csv(csv_file, index=False)
+
+
 if __name__ == "__main__":
     acquire_lock()
     atexit.register(release_lock)
@@ -63,6 +288,8 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--mode", type=str, required=True)
     parser.add_argument("--result_dir", type=str, required=True)
+    parser.add_argument("--quantiles", type=lambda x: [float(q) for q in x.split(",")], default=[],
+                        help="Percentiles to report on top of p0, p50, p90, p99 and p100")
     parser.add_argument(
         "pickle_files",
         metavar="<pkl_file>",
@@ -72,44 +299,15 @@ if __name__ == "__main__":
     )
     opt = parser.parse_args()
 
-    create_dir(opt.result_dir)
-
-    models = [None] * len(opt.pickle_files)
-    metrics = {}
-    for metric_name in METRIC_NAMES:
-        metrics[metric_name] = [None] * len(opt.pickle_files)
-
+    # Validate file paths
     for pickle_file in opt.pickle_files:
-        # Validate file paths
         if not os.path.isfile(pickle_file):
             print(f"File '{pickle_file}' does not exist.")
             sys.exit(1)
 
-        # Load arrays from pickle files
-        tid, infer_stats = load_pickle_file(pickle_file)
-        model, tput, total_times = infer_stats
-        populate_stats(TOTAL_PREFIX, total_times, tid, metrics)
-        metrics[TPUT][tid] = tput
-        if models[tid] is None:
-            models[tid] = f"{tid}_{model}"
-        else:
-            assert models[tid] == f"{tid}_{model}"
-
-    # Create a DataFrame for each metric type
-    models = [x for x in models if x is not None]
-    for metric_type, metrics_list in metrics.items():
-        df_data = {
-            model_name: metrics_list[i] for i, model_name in enumerate(models)
-        }
-        df_data["mode"] = opt.mode
-        df_data["load"] = 1.0
-        df = pd.DataFrame(df_data, index=[metric_type])
-        cols = (["mode", "load"] +
-                [col for col in df.columns if col != "mode" and col != "load"])
-        df = df[cols]
+    # Load arrays from pickle files
+    results = []
+    for pickle_file in opt.pickle_files:
+        results.extend(load_pickle_file(pickle_file))
 
-        csv_file = os.path.join(opt.result_dir, f"{metric_type}.csv")
-        if os.path.exists(csv_file):
-            df.to_csv(csv_file, mode='a', header=False, index=False)
-        else:
-            df.to_csv(csv_file, index=False)
\ No newline at end of file
+    compute_stats(results, opt.mode, opt.result_dir, opt.quantiles)
@@ -0,0 +1,230 @@
+# Sample commands:
+# python3 src/sweep.py sweep.json
+# python3 src/sweep.py --dry-run --devices 0,1,2,3 sweep.json
+#
+# Runs a sweep of job mixes on all GPUs of a machine at once, one
+# orchestrator.py per GPU. A sweep spec is a JSON file:
+# {
+#     "device-type": "a100",
+#     "devices": [0, 1, 2, 3],           (default: every GPU nvidia-smi lists)
+#     "modes": ["tm", "mps-uncap"],
+#     "duration": 300,
+#     "load-mode": "closed",             (optional, with "loads" for open loop)
+#     "executions": ["eager", "compile"], (optional, default eager)
+#     "retries": 2,                      (optional, default 2)
+#     "args": ["--sink", "quiet"],       (optional, passed to orchestrator.py)
+#     "mixes": ["bert-1 whisper-1", {"mix": "gpt-1 diffusion-1", "duration": 600}]
+# }
+# Every (mix, mode, execution, load) is a job. A job whose rows are already in the
+# stats CSVs of its result dir is skipped, so a sweep that was stopped
+# resumes where it left off. Failed jobs go back to the end of the queue up
+# to "retries" times. Jobs of the same mix share a result dir (and pwr.bin),
+# so they never run at the same time. A GPU that somebody else has locked
+# (lock_gpu in helper.sh) gets no jobs until the lock is released.
+# tests/test_sweep.py runs a small sweep end to end on dry_run.py.
+
+import argparse
+import fcntl
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+from mix import parse_mix # type: ignore
+from orchestrator import DEVICE_TYPES, MODES, GIT_DIR, SRC_DIR, get_result_dir # type: ignore
+from stats import TPUT, TOTAL_PREFIX, mode_label # type: ignore
+
+DEFAULT_RETRIES = 2
+POLL_INTERVAL = 1 # secs
+# CSVs every run writes a row to, whatever the mode and load
+COMPLETE_METRICS = [TPUT, f"{TOTAL_PREFIX}_p50", f"{TOTAL_PREFIX}_p99"]
+
+
+class SweepJob:
+    def __init__(self, mix, mode, load, duration, result_dir, execution="eager"):
+        self.mix = mix
+        self.mode = mode
+        self.execution = execution
+        self.load = load
+        self.duration = duration
+        self.result_dir = result_dir
+        self.attempts = 0
+
+    @property
+    def name(self):
+        return f"{'_'.join(self.mix)}/{mode_label(self.mode, self.execution)}/{self.load}"
+
+
+def expand_spec(spec, result_root):
+    # Sweep spec => [SweepJob], without duplicates
+    load_mode = spec.get("load-mode", "closed")
+    loads = [1.0] if load_mode == "closed" else [float(load) for load in spec["loads"]]
+    for mode in spec["modes"]:
+        if mode not in MODES:
+            raise ValueError(f"Invalid mode: {mode}. Must be one of: {', '.join(MODES)}")
+        if load_mode != "closed" and mode in ["inproc", "slice"]:
+            raise ValueError("inproc and slice modes only support closed loop")
+
+    jobs = {}
+    for entry in spec["mixes"]:
+        if isinstance(entry, str):
+            entry = {"mix": entry}
+        mix = entry["mix"].split()
+        result_dir = get_result_dir(result_root, parse_mix(mix), spec["device-type"])
+        for load in loads:
+            for mode in spec["modes"]:
+                for execution in spec.get("executions", ["eager"]):
+                    job = SweepJob(mix, mode, load, entry.get("duration", spec["duration"]), result_dir, execution)
+                    jobs.setdefault(job.name, job)
+    return list(jobs.values())
+
+
+def is_complete(job):
+    # The result dir has a row for the job's mode and load, with a value for
+    # every model of the mix, in all of COMPLETE_METRICS
+    for metric in COMPLETE_METRICS:
+        csv_file = os.path.join(job.result_dir, f"{metric}.csv")
+        if not os.path.exists(csv_file):
+            return False
+        df = pd.read_csv(csv_file)
+        rows = df[(df["mode"] == mode_label(job.mode, job.execution)) & np.isclose(df["load"], job.load)]
+        model_columns = [col for col in df.columns if col not in ["mode", "load"]]
+        if len(model_columns) != len(job.mix) or rows[model_columns].notna().all(axis=1).sum() == 0:
+            return False
+    return True
+
+
+def list_devices():
+    output = subprocess.run(["nvidia-smi", "--query-gpu=index", "--format=csv,noheader"],
+                            check=True, capture_output=True, text=True).stdout
+    return [int(line) for line in output.split()]
+
+
+def is_device_free(device_id):
+    # Probes the lock of lock_gpu in helper.sh (and GPULock in
+    # orchestrator.py) without keeping it, the orchestrator takes it itself
+    with open(f"/tmp/gpu_{device_id}.lock", "w") as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return False
+        fcntl.flock(f, fcntl.LOCK_UN)
+    return True
+
+
+class Sweep:
+    def __init__(self, spec, devices, result_root, log_dir, dry_run=False):
+        self.spec = spec
+        self.devices = devices
+        self.log_dir = log_dir
+        self.dry_run = dry_run
+        self.retries = spec.get("retries", DEFAULT_RETRIES)
+        self.jobs = expand_spec(spec, result_root)
+        self.result_root = result_root
+        self.running = {} # device id => (job, proc, log)
+        self.failed = []
+        self.num_done = 0
+
+    def _command(self, job, device_id):
+        cmd = [sys.executable, f"{SRC_DIR}/orchestrator.py",
+               "--device-type", self.spec["device-type"], "--device-id", str(device_id),
+               "--modes", job.mode, "--executions", job.execution, "--duration", str(job.duration),
+               "--load-mode", self.spec.get("load-mode", "closed"), "--loads", str(job.load),
+               "--result-root", self.result_root,
+               "--log-file", os.path.join(self.log_dir, f"{job.name.replace('/', '_')}.executors.log")]
+        if self.dry_run:
+            cmd.append("--dry-run")
+        return cmd + self.spec.get("args", []) + job.mix
+
+    def _free_devices(self):
+        busy = set(self.running)
+        return [device_id for device_id in self.devices
+                if device_id not in busy and (self.dry_run or is_device_free(device_id))]
+
+    def _next_job(self, pending):
+        # First pending job whose result dir no running job writes to
+        busy_dirs = {job.result_dir for job, _, _ in self.running.values()}
+        for i, job in enumerate(pending):
+            if job.result_dir not in busy_dirs:
+                return pending.pop(i)
+        return None
+
+    def _start(self, job, device_id):
+        job.attempts += 1
+        log = open(os.path.join(self.log_dir, f"{job.name.replace('/', '_')}.log"), "a")
+        proc = subprocess.Popen(self._command(job, device_id), stdout=log, stderr=subprocess.STDOUT,
+                                cwd=GIT_DIR)
+        self.running[device_id] = (job, proc, log)
+        print(f"GPU {device_id}: started {job.name} (attempt {job.attempts})")
+
+    def _reap(self, pending):
+        for device_id, (job, proc, log) in list(self.running.items()):
+            if proc.poll() is None:
+                continue
+            log.close()
+            del self.running[device_id]
+            if proc.returncode == 0 and is_complete(job):
+                self.num_done += 1
+                print(f"GPU {device_id}: finished {job.name}")
+            elif job.attempts <= self.retries:
+                print(f"GPU {device_id}: {job.name} failed with {proc.returncode}, retrying later")
+                pending.append(job)
+            else:
+                print(f"GPU {device_id}: {job.name} failed with {proc.returncode}, giving up")
+                self.failed.append(job)
+
+    def run(self):
+        os.makedirs(self.log_dir, exist_ok=True)
+        pending = [job for job in self.jobs if not is_complete(job)]
+        print(f"{len(self.jobs)} jobs, {len(self.jobs) - len(pending)} already complete, "
+              f"on GPUs {self.devices}, logs in {self.log_dir}")
+        try:
+            while pending or self.running:
+                for device_id in self._free_devices():
+                    job = self._next_job(pending)
+                    if job is None:
+                        break
+                    self._start(job, device_id)
+                time.sleep(POLL_INTERVAL)
+                self._reap(pending)
+        finally:
+            for job, proc, log in self.running.values():
+                proc.kill()
+                proc.wait()
+                log.close()
+        print(f"{self.num_done} jobs finished, {len(self.failed)} failed")
+        for job in self.failed:
+            print(f"  failed: {job.name}")
+        return not self.failed
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(allow_abbrev=False)
+    parser.add_argument("--devices", type=lambda x: [int(d) for d in x.split(",")], default=None,
+                        help="GPUs to run on, overrides the spec's devices")
+    parser.add_argument("--result-root", type=str, default=None)
+    parser.add_argument("--log-dir", type=str, default=None)
+    parser.add_argument("--dry-run", action="store_true",
+                        help="Replace the models with dry_run.py, no GPU needed")
+    parser.add_argument("spec", help="Sweep spec (JSON)")
+    opt = parser.parse_args()
+
+    with open(opt.spec) as f:
+        spec = json.load(f)
+    if spec.get("device-type") not in DEVICE_TYPES:
+        parser.error(f"Invalid device-type: {spec.get('device-type')}. Must be one of: {', '.join(DEVICE_TYPES)}")
+
+    devices = opt.devices or spec.get("devices")
+    if devices is None:
+        devices = [0] if opt.dry_run else list_devices()
+    result_root = opt.result_root
+    if result_root is None:
+        result_root = "/tmp/dry-run-results" if opt.dry_run else os.path.join(GIT_DIR, "results")
+    log_dir = opt.log_dir or os.path.join(tempfile.gettempdir(), f"sweep-{os.getpid()}")
+
+    if not Sweep(spec, devices, result_root, log_dir, opt.dry_run).run():
+        sys.exit(1)
@@ -0,0 +1,140 @@
+# Sample commands:
+# python3 src/synthetic.py --profiles results/a100 bert-1 gpt-4
+#
+# Profiles of the synthetic stand-ins for the real models. A model named
+# "synthetic:<model>" in a mix (e.g. synthetic:bert-8) runs no network: each
+# request spins the CPU and keeps the device busy in the same pattern as
+# <model> did running alone, so executors, stats and orchestration can be
+# load tested without the weights, or a GPU with --cpu. Profiles come from
+# the single-model result dirs of a device (<profiles>/<model>/<model>-<bs>):
+#   total_p0/50/90/99/100.csv  latency distribution, sampled between the
+#                              percentiles (log-linear)
+#   pwr.csv                    GPU utilization while running (the GPU share
+#                              of a request) and memory used over idle
+# Batch sizes between two profiled ones are interpolated; outside of them
+# the GPU time grows linearly with the batch (as in results/simulator.py).
+# tests/test_synthetic.py compares sampled latencies with the profiles.
+
+import argparse
+import os
+import numpy as np
+import pandas as pd
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_PROFILES = os.path.join(os.path.dirname(SRC_DIR), "results", "a100")
+
+QUANTILES = np.array([0, 0.5, 0.9, 0.99, 1.0])
+LATENCY_FILES = ["total_p0", "total_p50", "total_p90", "total_p99", "total_p100"]
+# Host synchronization points per request, same as NUM_BURSTS of
+# results/simulator.py: a forward pass, decode steps or denoising steps
+NUM_STEPS = {"bert": 1, "whisper": 32, "gpt": 80, "diffusion": 50}
+BUSY_UTIL = 50 # GPU utilization (%) of pwr.csv samples taken while running
+
+
+class SyntheticProfile:
+    def __init__(self, model, batch_size, latencies, gpu_frac, gpu_mem, num_steps=None):
+        self.model = model
+        self.batch_size = batch_size
+        self.latencies = np.asarray(latencies, dtype=float) # secs at QUANTILES
+        self.gpu_frac = gpu_frac # share of a request the device is busy
+        self.gpu_mem = gpu_mem # bytes
+        # Precision variants (bert@int8) take as many steps as the model
+        self.num_steps = num_steps or NUM_STEPS.get(model.split("@")[0], 1)
+
+    @property
+    def name(self):
+        return f"{self.model}-{self.batch_size}"
+
+    def scaled(self, batch_size):
+        # GPU time grows linearly with the batch, CPU time stays the same
+        factor = 1 + self.gpu_frac * (batch_size / self.batch_size - 1)
+        return SyntheticProfile(self.model, batch_size, self.latencies * factor,
+                                self.gpu_frac * batch_size / self.batch_size / factor,
+                                self.gpu_mem, self.num_steps)
+
+    def sample_latency(self, rng, size=None):
+        # Inverse CDF through the measured percentiles, linear in log latency
+        u = rng.random(size)
+        return np.exp(np.interp(u, QUANTILES, np.log(self.latencies)))
+
+    def sample_steps(self, rng):
+        # (cpu secs, device secs) of each step of one request
+        latency = self.sample_latency(rng)
+        step = latency / self.num_steps
+        return [(step * (1 - self.gpu_frac), step * self.gpu_frac)] * self.num_steps
+
+
+def _read_metric(run_dir, metric):
+    # Mean over the rows (modes, repeated runs) of a single-model CSV
+    df = pd.read_csv(os.path.join(run_dir, f"{metric}.csv"))
+    return float(df.drop(columns=[c for c in ["mode", "load"] if c in df.columns]).iloc[:, 0].mean())
+
+
+def _read_power(run_dir):
+    # (GPU utilization while running, memory used over idle in bytes)
+    path = os.path.join(run_dir, "pwr.csv")
+    if not os.path.exists(path):
+        return None, 0
+    df = pd.read_csv(path, skipinitialspace=True)
+    util = pd.to_numeric(df["utilization.gpu [%]"].str.rstrip(" %"), errors="coerce")
+    memory = pd.to_numeric(df["memory.used [MiB]"].str.rstrip(" MiB"), errors="coerce")
+    busy = util[util >= BUSY_UTIL]
+    gpu_frac = min(1.0, busy.mean() / 100) if len(busy) else None
+    return gpu_frac, int((memory.max() - memory.min()) * 2**20)
+
+
+def load_profiles(profile_dir=DEFAULT_PROFILES):
+    # name ("bert-1") => SyntheticProfile of every single-model run
+    profiles = {}
+    for model in sorted(os.listdir(profile_dir)):
+        model_dir = os.path.join(profile_dir, model)
+        if not os.path.isdir(model_dir) or "-" in model:
+            continue
+        for run in sorted(os.listdir(model_dir)):
+            run_dir = os.path.join(model_dir, run)
+            if not all(os.path.exists(os.path.join(run_dir, f"{f}.csv")) for f in LATENCY_FILES):
+                continue
+            batch_size = int(run.rsplit("-", 1)[1])
+            latencies = np.maximum.accumulate([_read_metric(run_dir, f) / 1000 for f in LATENCY_FILES])
+            gpu_frac, gpu_mem = _read_power(run_dir)
+            profiles[run] = SyntheticProfile(model, batch_size, latencies,
+                                             gpu_frac if gpu_frac is not None else 0.9, gpu_mem)
+    return profiles
+
+
+def get_profile(profiles, model, batch_size):
+    name = f"{model}-{batch_size}"
+    if name in profiles:
+        return profiles[name]
+    measured = sorted((p for p in profiles.values() if p.model == model), key=lambda p: p.batch_size)
+    if not measured:
+        raise KeyError(f"No single-model run of {model} to calibrate synthetic:{model} from")
+
+    # Between two profiled batch sizes: interpolate the scaling curve
+    for lower, upper in zip(measured, measured[1:]):
+        if lower.batch_size < batch_size < upper.batch_size:
+            w = (batch_size - lower.batch_size) / (upper.batch_size - lower.batch_size)
+            return SyntheticProfile(
+                model, batch_size, (1 - w) * lower.latencies + w * upper.latencies,
+                (1 - w) * lower.gpu_frac + w * upper.gpu_frac,
+                int((1 - w) * lower.gpu_mem + w * upper.gpu_mem), lower.num_steps
+            )
+    nearest = min(measured, key=lambda p: abs(p.batch_size - batch_size))
+    return nearest.scaled(batch_size)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(allow_abbrev=False)
+    parser.add_argument("--profiles", type=str, default=DEFAULT_PROFILES,
+                        help="Device result dir with the single-model runs")
+    parser.add_argument("models", nargs="*", help="Models to print the profile of, as <model>-<batch_size>")
+    opt = parser.parse_args()
+
+    profiles = load_profiles(opt.profiles)
+    for name in opt.models or sorted(profiles):
+        model, batch_size = name.rsplit("-", 1)
+        profile = get_profile(profiles, model, int(batch_size))
+        print(f"synthetic:{profile.name}: latency {np.round(profile.latencies * 1000, 2)} ms at "
+              f"p{[int(q * 100) for q in QUANTILES]}, GPU {profile.gpu_frac:.0%} over {profile.num_steps} steps, "
+              f"{profile.gpu_mem / 2**20:.0f} MiB")
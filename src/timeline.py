@@ -0,0 +1,160 @@
+# Sample commands:
+# python3 src/timeline.py results/a100/bert-whisper/bert-1_whisper-1
+#
+# Per-request timelines of the executors and the attribution of the GPU's
+# energy to the models of a mix. With --timeline <dir> every executor
+# appends the interval of each batch it serves (start and end in
+# time.monotonic_ns(), the clock of power.py, and the number of requests
+# in it) to <dir>/timeline_<tid>.bin, a memory-mapped ring buffer: a fixed
+# header and TIMELINE_CAPACITY records, the oldest overwritten first.
+#
+# Attribution: between two power samples the energy of the GPU (trapezoid,
+# as power.energy) is split evenly between the models active at the time,
+# in proportion to how much of the interval each was active for. Time no
+# model was active is idle energy. Every active second of a sample interval
+# then costs the same to each active model, so the energy of a batch is
+# the integral of that cost over its interval, which np.interp evaluates
+# for all batches of a run at once. tests/test_timeline.py attributes a
+# synthetic run with known per-model energy.
+
+import argparse
+import glob
+import os
+import re
+import numpy as np
+from power import POWER_FILE, load_power # type: ignore
+
+TIMELINE_FILE = "timeline_{}.bin"
+TIMELINE_CAPACITY = 2**16 # batches kept per executor
+HEADER_DTYPE = np.dtype([
+    ("capacity", "<i8"),
+    ("count", "<i8"),     # records ever written
+])
+RECORD_DTYPE = np.dtype([
+    ("start", "<i8"),     # time.monotonic_ns()
+    ("end", "<i8"),
+    ("requests", "<i8"),
+])
+
+
+class TimelineRecorder:
+    def __init__(self, path, capacity=TIMELINE_CAPACITY):
+        self.path = path
+        size = HEADER_DTYPE.itemsize + capacity * RECORD_DTYPE.itemsize
+        with open(path, "wb") as f:
+            f.truncate(size)
+        self._header = np.memmap(path, dtype=HEADER_DTYPE, mode="r+", shape=(1,))
+        self._records = np.memmap(path, dtype=RECORD_DTYPE, mode="r+", offset=HEADER_DTYPE.itemsize,
+                                  shape=(capacity,))
+        self._header["capacity"] = capacity
+        self.capacity = capacity
+        self.clear()
+
+    def clear(self):
+        # Drops warm up and calibration batches before the measured run
+        self._count = 0
+        self._header["count"] = 0
+
+    def record(self, start, end, requests):
+        # start and end in secs of time.monotonic()
+        self._records[self._count % self.capacity] = (int(start * 1e9), int(end * 1e9), requests)
+        self._count += 1
+        self._header["count"] = self._count
+
+    def close(self):
+        self._records.flush()
+        self._header.flush()
+
+
+def load_timeline(path):
+    # Records of a ring buffer, oldest first
+    header = np.fromfile(path, dtype=HEADER_DTYPE, count=1)[0]
+    records = np.fromfile(path, dtype=RECORD_DTYPE, offset=HEADER_DTYPE.itemsize,
+                          count=int(header["capacity"]))
+    count = int(header["count"])
+    if count <= len(records):
+        return records[:count]
+    return np.roll(records, -(count % len(records)))
+
+
+def load_timelines(result_dir):
+    # tid => records of every timeline in a result dir
+    timelines = {}
+    for path in glob.glob(os.path.join(result_dir, TIMELINE_FILE.format("*"))):
+        match = re.match(r"timeline_(\d+)\.bin$", os.path.basename(path))
+        if match:
+            timelines[int(match.group(1))] = load_timeline(path)
+    return timelines
+
+
+def _active_time(records, times):
+    # Secs each model was active up to each of times, from its batches
+    # (which never overlap, an executor serves one batch at a time)
+    starts = records["start"]
+    durations = records["end"] - starts
+    done = np.concatenate([[0], np.cumsum(durations)])
+    index = np.searchsorted(starts, times, side="right")
+    current = np.clip(times - starts[np.maximum(index - 1, 0)], 0, durations[np.maximum(index - 1, 0)])
+    return (done[np.maximum(index - 1, 0)] + np.where(index > 0, current, 0)) / 1e9
+
+
+def attribute(samples, timelines):
+    # => (tid => {"energy": J, "requests": n, "per_request": J of each
+    #     batch's requests, one value per batch}, idle J), over the power
+    # samples that the timelines overlap
+    tids = sorted(tid for tid, records in timelines.items() if len(records))
+    if len(samples) < 2 or not tids:
+        return {tid: {"energy": 0.0, "requests": 0, "per_request": np.zeros(0)} for tid in timelines}, 0.0
+    first = min(int(timelines[tid]["start"][0]) for tid in tids)
+    last = max(int(timelines[tid]["end"][-1]) for tid in tids)
+    samples = samples[(samples["t"] >= first - 1e9) & (samples["t"] <= last + 1e9)]
+    t = samples["t"].astype(np.int64)
+    dt = np.diff(t) / 1e9
+    power = samples["power"].astype(np.float64)
+    energy = dt * (power[1:] + power[:-1]) / 2
+
+    # Share of every sample interval each model was active for
+    active = np.vstack([np.diff(_active_time(timelines[tid], t)) for tid in tids])
+    coverage = np.divide(active, dt, out=np.zeros_like(active), where=dt > 0)
+    concurrency = np.maximum(coverage.sum(axis=0), 1)
+    idle = float((energy * (1 - np.minimum(coverage.sum(axis=0), 1))).sum())
+
+    # Energy per active sec of each interval, and its integral over time
+    cost = np.divide(energy, dt * concurrency, out=np.zeros_like(energy), where=dt > 0)
+    integral = np.concatenate([[0], np.cumsum(cost * dt)])
+    results = {}
+    for tid in timelines:
+        records = timelines[tid]
+        if tid not in tids:
+            results[tid] = {"energy": 0.0, "requests": 0, "per_request": np.zeros(0)}
+            continue
+        batch_energy = np.interp(records["end"], t, integral) - np.interp(records["start"], t, integral)
+        requests = records["requests"]
+        results[tid] = {
+            "energy": float(batch_energy.sum()),
+            "requests": int(requests.sum()),
+            "per_request": batch_energy[requests > 0] / requests[requests > 0],
+        }
+    return results, idle
+
+
+def attribute_dir(result_dir):
+    return attribute(load_power(os.path.join(result_dir, POWER_FILE)), load_timelines(result_dir))
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(allow_abbrev=False)
+    parser.add_argument("result_dir", help=f"Result dir with {POWER_FILE} and the timelines")
+    opt = parser.parse_args()
+
+    results, idle = attribute_dir(opt.result_dir)
+    for tid, result in sorted(results.items()):
+        per_request = result["per_request"]
+        if not len(per_request):
+            print(f"tid {tid}: no requests")
+            continue
+        print(f"tid {tid}: {result['energy']:.1f} J over {result['requests']} requests, "
+              f"{result['energy'] / result['requests']:.3f} J/request "
+              f"(p50 {np.percentile(per_request, 50):.3f}, p99 {np.percentile(per_request, 99):.3f})")
+    print(f"idle: {idle:.1f} J")
@@ -0,0 +1,146 @@
+# Cooperative time-slicing of co-located models in one process (the slice
+# mode of host.py). A model holds the device for one step at a time, a
+# diffusion denoising step, a decode step or an encoder layer, and yields
+# at the step boundary. The scheduler then hands the device to the lane
+# its policy picks among the lanes waiting for it. Every lane stays in the
+# scheduler from the start to the end of its run, so which lane runs next
+# only depends on the policy and not on thread timing. tests/test_timeslice.py
+# runs the policies on stub models against a virtual clock.
+
+import math
+import threading
+import time
+
+
+class SliceLane:
+    # A lane's handle on the scheduler, yield_step() at every step boundary
+    def __init__(self, scheduler, index, weight=1.0, slo=None):
+        self.scheduler = scheduler
+        self.index = index
+        self.weight = weight
+        self.slo = slo # secs
+
+        # Policy state
+        self.used = 0.0
+        self.request_start = 0.0
+        self.deadline = math.inf
+        self.num_slices = 0
+
+    def _start_request(self):
+        self.request_start = self.scheduler.clock()
+        self.deadline = self.request_start + self.slo if self.slo is not None else math.inf
+
+    def join(self):
+        # A lane joins with its first request about to start
+        self._start_request()
+        self.scheduler.join(self)
+
+    def leave(self):
+        self.scheduler.leave(self)
+
+    def new_request(self):
+        # Request boundaries are step boundaries too
+        self._start_request()
+        self.scheduler.yield_step(self)
+
+    def yield_step(self):
+        self.scheduler.yield_step(self)
+
+
+class RoundRobinPolicy:
+    # Lanes take turns, one step each
+    def pick(self, lanes, previous):
+        if previous is not None:
+            for lane in lanes:
+                if lane.index > previous.index:
+                    return lane
+        return lanes[0]
+
+
+class EarliestDeadlinePolicy:
+    # The lane whose current request has the earliest SLO deadline. Lanes
+    # without an SLO only run when no lane with one is waiting.
+    def pick(self, lanes, previous):
+        return min(lanes, key=lambda lane: (lane.deadline, lane.request_start, lane.index))
+
+
+class WeightedSharePolicy:
+    # The lane with the least device time for its weight, so that over a run
+    # the device time of the lanes is in proportion to their weights
+    def pick(self, lanes, previous):
+        return min(lanes, key=lambda lane: (lane.used / lane.weight, lane.index))
+
+
+POLICIES = {
+    "round-robin": RoundRobinPolicy,
+    "edf": EarliestDeadlinePolicy,
+    "weighted": WeightedSharePolicy,
+}
+
+
+def get_policy(name):
+    if name not in POLICIES:
+        raise ValueError(f"Unknown time slicing policy: {name}, expected one of {', '.join(POLICIES)}")
+    return POLICIES[name]()
+
+
+class SliceScheduler:
+    def __init__(self, policy, clock=time.monotonic):
+        self.policy = policy
+        self.clock = clock
+        self.lanes = []
+        self._cond = threading.Condition()
+        self._active = []
+        self._num_joined = 0
+        self._holder = None
+        self._held_since = 0.0
+
+    def add_lane(self, weight=1.0, slo=None):
+        lane = SliceLane(self, len(self.lanes), weight, slo)
+        self.lanes.append(lane)
+        return lane
+
+    def _grant(self, previous):
+        # Called with the lock held and nobody holding the device
+        if self._active:
+            self._holder = self.policy.pick(self._active, previous)
+            self._holder.num_slices += 1
+            self._held_since = self.clock()
+        self._cond.notify_all()
+
+    def _charge(self, lane):
+        lane.used += self.clock() - self._held_since
+        self._holder = None
+
+    def _wait_for_turn(self, lane):
+        while self._holder is not lane:
+            self._cond.wait()
+
+    def join(self, lane):
+        # Nothing runs before every lane has joined, so the first grant
+        # sees all of them
+        with self._cond:
+            self._active.append(lane)
+            self._active.sort(key=lambda lane: lane.index)
+            self._num_joined += 1
+            if self._num_joined == len(self.lanes):
+                self._grant(None)
+            self._wait_for_turn(lane)
+
+    def leave(self, lane):
+        with self._cond:
+            if self._holder is lane:
+                self._charge(lane)
+            self._active.remove(lane)
+            if self._holder is None:
+                self._grant(lane)
+
+    def yield_step(self, lane):
+        with self._cond:
+            if lane not in self._active:
+                # Warm up before the run, nothing to share with yet
+                return
+            assert self._holder is lane, f"lane {lane.index} yielded without holding the device"
+            self._charge(lane)
+            self._grant(lane)
+            self._wait_for_turn(lane)
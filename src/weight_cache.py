@@ -0,0 +1,48 @@
+# Local cache of pre-converted model snapshots. The first load of a model
+# saves it (already cast to the dtype it runs in) as safetensors under
+# <cache_dir>/<model_path>/<dtype>/, later loads point from_pretrained at
+# that directory, which memory-maps the weights instead of reading and
+# converting the original checkpoint.
+
+import os
+import shutil
+import uuid
+
+COMPLETE_MARKER = ".complete"
+
+
+class WeightCache:
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+
+    def path(self, model_path, dtype):
+        return os.path.join(self.cache_dir, model_path.replace("/", "--"), dtype)
+
+    def lookup(self, model_path, dtype):
+        path = self.path(model_path, dtype)
+        if os.path.exists(os.path.join(path, COMPLETE_MARKER)):
+            return path
+        return None
+
+    def store(self, model_path, dtype, model, *others):
+        # Save to a private directory and rename it into place, so executors
+        # loading the same model concurrently never see a partial snapshot.
+        # `others` are tokenizers/processors saved next to the weights.
+        path = self.path(model_path, dtype)
+        if os.path.exists(path) and self.lookup(model_path, dtype) is None:
+            shutil.rmtree(path, ignore_errors=True)
+        tmp_path = f"{path}.{uuid.uuid4()}.tmp"
+        os.makedirs(tmp_path)
+        try:
+            model.save_pretrained(tmp_path, safe_serialization=True)
+            for obj in others:
+                obj.save_pretrained(tmp_path)
+            open(os.path.join(tmp_path, COMPLETE_MARKER), "w").close()
+            os.rename(tmp_path, path)
+        except OSError:
+            # Another executor got there first
+            if self.lookup(model_path, dtype) is None:
+                raise
+        finally:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+        return path
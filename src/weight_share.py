@@ -0,0 +1,295 @@
+# Sample commands:
+# python3 src/weight_share.py --list
+# python3 src/weight_share.py --cleanup
+#
+# Read-only sharing of model weights between the executors of a device
+# (--share-weights). The first executor to load a model packs its
+# parameters and buffers into one flat buffer, points the model at views of
+# it and exports it: a CUDA IPC handle on a GPU, a shared mmap'd file on the
+# CPU. Executors loading the same model (same weights, precision and
+# device) later build it without weights on the meta device and attach
+# views of the exported buffer instead of loading their own copy. Models of
+# one process (host.py) share the buffer directly.
+#
+# Under SHARE_ROOT/<device>/, every exported model has an index
+# (<key>.json: owner pid, size and the offset of every tensor), the handle
+# or data (<key>.handle, <key>.bin) and the pids attached to it
+# (<key>.refs). An exporter waits at exit until the processes attached to
+# its weights are gone. Processes that were killed leave their files
+# behind, --cleanup removes those whose owner is dead (run_job_mix.sh does
+# it on exit). tests/test_weight_share.py shares a small model between
+# processes on the CPU.
+
+import argparse
+import atexit
+import contextlib
+import fcntl
+import json
+import os
+import pickle
+import tempfile
+import time
+
+SHARE_ROOT = os.path.join("/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir(), "weight_share")
+ALIGN = 256 # bytes, offsets of the tensors in the flat buffer
+EXIT_TIMEOUT = 60 # secs an exporter waits for attached processes at exit
+POLL_INTERVAL = 0.5 # secs
+
+# (device dir, key) => (SharedWeights, flat buffer) of the models this
+# process exported, kept alive until exit and released from their own dir
+_exported = {}
+# (SharedWeights, key) of the models this process attached to
+_attached = []
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def device_key(device):
+    # Directory of a device. A GPU is known by its UUID, the same under any
+    # CUDA_VISIBLE_DEVICES.
+    import torch
+    if device.type != "cuda":
+        return "cpu"
+    uuid = getattr(torch.cuda.get_device_properties(device), "uuid", None)
+    if uuid is not None:
+        return f"cuda-{uuid}"
+    return f"cuda-{os.environ.get('CUDA_VISIBLE_DEVICES', '')}-{device.index or 0}"
+
+
+def _tensors(module):
+    # (name, kind, tensor) of every parameter and buffer, including tied and
+    # non-persistent ones, which a state dict would leave out
+    for name, param in module.named_parameters(remove_duplicate=False):
+        yield name, "param", param
+    for name, buffer in module.named_buffers(remove_duplicate=False):
+        if buffer is not None:
+            yield name, "buffer", buffer
+
+
+def _bind(module, entries, flat):
+    # Points the module's parameters and buffers at views of flat. Tensors
+    # at the same offset (tied weights) get the same Parameter object.
+    import torch
+    params = {}
+    for name, kind, dtype, shape, offset in entries:
+        dtype = getattr(torch, dtype)
+        numel = 1
+        for dim in shape:
+            numel *= dim
+        size = numel * torch.empty(0, dtype=dtype).element_size()
+        view = flat[offset:offset + size].view(dtype).view(shape)
+        parent_name, _, leaf = name.rpartition(".")
+        parent = module.get_submodule(parent_name)
+        if kind == "param":
+            if offset not in params:
+                params[offset] = torch.nn.Parameter(view, requires_grad=False)
+            parent._parameters[leaf] = params[offset]
+        else:
+            parent._buffers[leaf] = view
+
+
+class SharedWeights:
+    def __init__(self, device, root=SHARE_ROOT):
+        self.device = device
+        self.dir = os.path.join(root, device_key(device))
+        os.makedirs(self.dir, exist_ok=True)
+
+    def _path(self, key, suffix):
+        return os.path.join(self.dir, f"{key}{suffix}")
+
+    @contextlib.contextmanager
+    def lock(self, key):
+        # Held while a model is looked up and loaded or attached, so that
+        # concurrent executors of the same model load it only once
+        with open(self._path(key, ".lock"), "w") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _read_index(self, key):
+        try:
+            with open(self._path(key, ".json")) as f:
+                index = json.load(f)
+        except FileNotFoundError:
+            return None
+        return index if _alive(index["owner"]) else None
+
+    def _update_refs(self, key, add=None, remove=None):
+        # Pids attached to a model, without the dead ones
+        path = self._path(key, ".refs")
+        try:
+            with open(path) as f:
+                refs = json.load(f)
+        except FileNotFoundError:
+            refs = []
+        refs = [pid for pid in refs if pid != remove and _alive(pid)]
+        if add is not None:
+            refs.append(add)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(refs, f)
+        os.replace(tmp_path, path)
+        return refs
+
+    def attach(self, key, build):
+        # The model from the exported weights, None if nobody exports them.
+        # build() returns the model's modules on the meta device.
+        import torch
+        index = self._read_index(key)
+        if index is None:
+            return None
+        if index["owner"] == os.getpid():
+            flat = _exported[(self.dir, key)][1]
+        elif self.device.type == "cuda":
+            with open(self._path(key, ".handle"), "rb") as f:
+                rebuild, args = pickle.load(f)
+            flat = rebuild(*args)
+        else:
+            flat = torch.from_file(self._path(key, ".bin"), shared=True, size=index["size"], dtype=torch.uint8)
+
+        module = build()
+        _bind(module, index["entries"], flat)
+        missing = [name for name, _, tensor in _tensors(module) if tensor.is_meta]
+        if missing:
+            raise RuntimeError(f"Shared weights of {key} lack {', '.join(missing[:5])}")
+        if index["owner"] != os.getpid():
+            self._update_refs(key, add=os.getpid())
+            if not _attached:
+                atexit.register(_detach_all)
+            _attached.append((self, key))
+        return module
+
+    def export(self, key, module):
+        # Moves the module's weights into one flat buffer and publishes it
+        import torch
+        offsets = {}
+        entries = []
+        size = 0
+        for name, kind, tensor in _tensors(module):
+            if id(tensor) not in offsets:
+                offsets[id(tensor)] = size
+                # Empty tensors get a slot too, views are told apart by offset
+                size += max(-(-tensor.numel() * tensor.element_size() // ALIGN), 1) * ALIGN
+            entries.append([name, kind, str(tensor.dtype).split(".")[1], list(tensor.shape), offsets[id(tensor)]])
+
+        if self.device.type == "cuda":
+            flat = torch.empty(size, dtype=torch.uint8, device=self.device)
+        else:
+            with open(self._path(key, ".bin"), "wb") as f:
+                f.truncate(size)
+            flat = torch.from_file(self._path(key, ".bin"), shared=True, size=size, dtype=torch.uint8)
+        copied = set()
+        for name, kind, tensor in _tensors(module):
+            if id(tensor) not in copied:
+                copied.add(id(tensor))
+                offset = offsets[id(tensor)]
+                nbytes = tensor.numel() * tensor.element_size()
+                flat[offset:offset + nbytes].view(tensor.dtype).view(tensor.shape).copy_(tensor.detach())
+        _bind(module, entries, flat)
+        if self.device.type == "cuda":
+            torch.cuda.synchronize(self.device)
+            torch.cuda.empty_cache()
+            from torch.multiprocessing.reductions import reduce_tensor
+            tmp_path = self._path(key, f".handle.{os.getpid()}.tmp")
+            with open(tmp_path, "wb") as f:
+                pickle.dump(reduce_tensor(flat), f)
+            os.replace(tmp_path, self._path(key, ".handle"))
+
+        # The index goes last, attaching processes look for it
+        self._update_refs(key)
+        tmp_path = self._path(key, f".json.{os.getpid()}.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump({"owner": os.getpid(), "size": size, "entries": entries}, f)
+        os.replace(tmp_path, self._path(key, ".json"))
+        if not _exported:
+            atexit.register(_release_all)
+        _exported[(self.dir, key)] = (self, flat)
+
+    def _remove(self, key):
+        for suffix in [".json", ".handle", ".bin", ".refs"]:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(self._path(key, suffix))
+
+    def release(self, key):
+        # Exporter: waits for the attached processes, then unpublishes
+        deadline = time.monotonic() + EXIT_TIMEOUT
+        while time.monotonic() < deadline:
+            with self.lock(key):
+                if not self._update_refs(key):
+                    break
+            time.sleep(POLL_INTERVAL)
+        with self.lock(key):
+            self._remove(key)
+
+    def detach(self, key):
+        with self.lock(key):
+            self._update_refs(key, remove=os.getpid())
+
+
+def _detach_all():
+    for shared, key in _attached:
+        shared.detach(key)
+
+
+def _release_all():
+    for (_, key), (shared, _) in list(_exported.items()):
+        shared.release(key)
+    _exported.clear()
+
+
+def entries(root=SHARE_ROOT):
+    # (device dir, key, index or None if its owner is gone) of every export
+    for device in sorted(os.listdir(root)) if os.path.isdir(root) else []:
+        device_dir = os.path.join(root, device)
+        for name in sorted(os.listdir(device_dir)):
+            if not name.endswith(".json"):
+                continue
+            with open(os.path.join(device_dir, name)) as f:
+                index = json.load(f)
+            yield device_dir, name[:-len(".json")], index if _alive(index["owner"]) else None
+
+
+def cleanup(root=SHARE_ROOT):
+    # Removes the exports of dead processes and whatever they left behind
+    removed = 0
+    for device_dir, key, index in list(entries(root)):
+        if index is None:
+            for suffix in [".json", ".handle", ".bin", ".refs", ".lock"]:
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(os.path.join(device_dir, f"{key}{suffix}"))
+            removed += 1
+    for device in os.listdir(root) if os.path.isdir(root) else []:
+        device_dir = os.path.join(root, device)
+        for name in os.listdir(device_dir):
+            # Exports interrupted before their index was written
+            if name.endswith(".tmp") and not _alive(int(name.rsplit(".", 2)[-2])):
+                os.remove(os.path.join(device_dir, name))
+    return removed
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(allow_abbrev=False)
+    parser.add_argument("--root", type=str, default=SHARE_ROOT)
+    parser.add_argument("--list", action="store_true", help="List the exported models")
+    parser.add_argument("--cleanup", action="store_true", help="Remove the exports of dead processes")
+    opt = parser.parse_args()
+
+    if opt.cleanup:
+        print(f"Removed {cleanup(opt.root)} stale exports from {opt.root}")
+    if opt.list:
+        for device_dir, key, index in entries(opt.root):
+            status = "stale" if index is None else f"owner {index['owner']}, {index['size'] / 2**20:.0f} MiB"
+            with contextlib.suppress(FileNotFoundError), open(os.path.join(device_dir, f"{key}.refs")) as f:
+                status += f", attached {json.load(f)}"
+            print(f"{os.path.basename(device_dir)}/{key}: {status}")
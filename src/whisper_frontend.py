@@ -0,0 +1,128 @@
+# Whisper's log-mel frontend as batched torch ops on the model's device,
+# in place of the numpy feature extractor the HF pipeline runs on the CPU
+# for every request. Audio is cut into the 30 sec windows Whisper decodes,
+# and the features of each window are cached under a hash of its samples,
+# so repeated audio skips the frontend altogether. AudioStream assembles
+# windows from audio that arrives in pieces. tests/test_whisper_frontend.py
+# compares the features with WhisperFeatureExtractor on the CPU.
+
+import collections
+import hashlib
+import numpy as np
+import torch
+
+
+class AudioStream:
+    # Buffers streamed samples and hands out full windows as they fill up
+    def __init__(self, window_samples):
+        self.window_samples = window_samples
+        self._pieces = []
+        self._buffered = 0
+
+    def feed(self, samples):
+        self._pieces.append(np.asarray(samples, dtype=np.float32))
+        self._buffered += len(samples)
+        windows = []
+        while self._buffered >= self.window_samples:
+            buffer = np.concatenate(self._pieces)
+            windows.append(buffer[:self.window_samples])
+            self._pieces = [buffer[self.window_samples:]]
+            self._buffered -= self.window_samples
+        return windows
+
+    def flush(self):
+        # Whatever is left, zero padded by the frontend
+        if self._buffered == 0:
+            return []
+        buffer = np.concatenate(self._pieces)
+        self._pieces = []
+        self._buffered = 0
+        return [buffer]
+
+
+class WhisperFrontend:
+    def __init__(self, feature_extractor, device, cache_entries=32):
+        self.sampling_rate = feature_extractor.sampling_rate
+        self.n_fft = feature_extractor.n_fft
+        self.hop_length = feature_extractor.hop_length
+        self.window_samples = feature_extractor.n_samples
+        self.num_frames = feature_extractor.nb_max_frames
+
+        # Falls back to computing on the CPU without a GPU
+        if device.type == "cuda" and not torch.cuda.is_available():
+            device = torch.device("cpu")
+        self.device = device
+        self._window = torch.hann_window(self.n_fft, device=device)
+        self._mel_filters = torch.from_numpy(feature_extractor.mel_filters).to(device, torch.float32)
+
+        self.cache_entries = cache_entries
+        self._cache = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def split(self, audio):
+        # One or more 30 sec windows, the last one zero padded
+        audio = np.asarray(audio, dtype=np.float32)
+        num_windows = max(1, -(-len(audio) // self.window_samples))
+        return [audio[i * self.window_samples:(i + 1) * self.window_samples] for i in range(num_windows)]
+
+    def resample(self, audio, sampling_rate):
+        if sampling_rate == self.sampling_rate:
+            return np.asarray(audio, dtype=np.float32)
+        import torchaudio # type: ignore
+        audio = torch.as_tensor(audio, dtype=torch.float32, device=self.device)
+        return torchaudio.functional.resample(audio, sampling_rate, self.sampling_rate).cpu().numpy()
+
+    def log_mel(self, windows):
+        # [num_windows, samples] => [num_windows, n_mels, frames]
+        waveform = torch.zeros(len(windows), self.window_samples, device=self.device)
+        for i, window in enumerate(windows):
+            waveform[i, :len(window)] = torch.from_numpy(window).to(self.device)
+
+        stft = torch.stft(waveform, self.n_fft, self.hop_length, window=self._window, return_complex=True)
+        magnitudes = (stft[..., :-1].abs() ** 2).contiguous()
+        mel_spec = self._mel_filters.T @ magnitudes
+
+        log_spec = torch.clamp(mel_spec, min=1e-10).log10()
+        max_val = log_spec.amax(dim=(1, 2), keepdim=True)
+        log_spec = torch.maximum(log_spec, max_val - 8.0)
+        return (log_spec + 4.0) / 4.0
+
+    def _key(self, window):
+        return hashlib.blake2b(window.tobytes(), digest_size=16).digest()
+
+    def features(self, audios):
+        # Features of every window of every audio, and the range of windows
+        # that belongs to each audio. Only windows missing from the cache
+        # go through log_mel, in one batch.
+        windows = []
+        spans = []
+        for audio in audios:
+            audio_windows = self.split(audio)
+            spans.append((len(windows), len(windows) + len(audio_windows)))
+            windows.extend(audio_windows)
+
+        keys = [self._key(window) for window in windows]
+        missing = {}
+        for i, key in enumerate(keys):
+            if key in self._cache:
+                self._cache.move_to_end(key)
+            elif key not in missing:
+                missing[key] = i
+        self.hits += len(keys) - len(missing)
+        self.misses += len(missing)
+
+        features = {}
+        if missing:
+            computed = self.log_mel([windows[i] for i in missing.values()])
+            features = dict(zip(missing, computed))
+        for key in keys:
+            if key not in features:
+                features[key] = self._cache[key]
+        for key in missing:
+            # A copy, so the cache does not pin the whole batch
+            self._cache[key] = features[key].clone()
+        while len(self._cache) > self.cache_entries:
+            self._cache.popitem(last=False)
+
+        return torch.stack([features[key] for key in keys]), spans
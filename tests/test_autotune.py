@@ -0,0 +1,50 @@
+# Batch size sweep, table and pick on a fake model whose memory grows with
+# the batch size and that runs out of it at 40
+import pytest
+
+from autotune import DEFAULT_BATCH_SIZES, load_table, pick, save_table, sweep, table_path # type: ignore
+
+
+def measure(batch_size):
+    if batch_size >= 40:
+        raise RuntimeError("CUDA out of memory. Tried to allocate 2.00 GiB")
+    latency = 0.01 + 0.002 * batch_size
+    return {"tput": batch_size / latency, "p99_ms": latency * 1000,
+            "peak_mem_mb": 1000 + 100 * batch_size, "energy_req_j": float("nan"), "energy_status": "cpu"}
+
+
+def test_sweep_backs_off_from_oom():
+    rows = sweep(measure, DEFAULT_BATCH_SIZES)
+    # Within an eighth of 32 of the first size that ran out of memory
+    assert [row["batch_size"] for row in rows] == [1, 2, 4, 8, 16, 32, 64, 48, 40, 36]
+    assert max(row["batch_size"] for row in rows if row["status"] == "ok") == 36
+
+
+def test_sweep_backs_off_from_budget():
+    rows = sweep(measure, DEFAULT_BATCH_SIZES, mem_budget_mb=2700)
+    assert max(row["batch_size"] for row in rows if row["status"] == "ok") == 16
+
+
+def test_pick_within_limits(tmp_path):
+    rows = sweep(measure, DEFAULT_BATCH_SIZES)
+    path = table_path("cpu", str(tmp_path))
+    save_table(path, "bert", "eager", rows)
+    save_table(path, "whisper", "eager", rows[:3])
+    # Replaces the model's rows, does not append
+    save_table(path, "bert", "eager", rows)
+    table = load_table(path)
+    assert len(table) == len(rows) + 3
+    assert set(table[table["status"] == "ok"]["energy_status"]) == {"cpu"}
+    assert pick(table, "bert") == 36
+    assert pick(table, "bert", slo_ms=50) == 16
+    assert pick(table, "bert", mem_budget_mb=2000) == 8
+    assert pick(table, "bert", slo_ms=5) is None
+    assert pick(table, "gpt") is None
+
+
+def test_other_errors_propagate():
+    def broken(batch_size):
+        raise RuntimeError("CUDA error: an illegal memory access was encountered")
+
+    with pytest.raises(RuntimeError, match="illegal memory access"):
+        sweep(broken, DEFAULT_BATCH_SIZES)
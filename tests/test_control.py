@@ -0,0 +1,86 @@
+# Control plane between the orchestrator and executors, with executors on
+# threads of the test instead of processes
+import os
+import socket
+import threading
+import time
+
+import pandas as pd
+import pytest
+
+from control import ControlClient, ControlServer, READY, START, recv_msg, send_msg # type: ignore
+from stats import compute_stats # type: ignore
+
+
+@pytest.fixture
+def server(tmp_path):
+    server = ControlServer(str(tmp_path / "control.sock"))
+    yield server
+    server.close()
+
+
+def executor(socket_path, tid):
+    # Reports progress once started and its results once stopped
+    client = ControlClient(socket_path, tid)
+    client.ready()
+    stopped = threading.Event()
+    client.wait_for_start(on_stop=stopped.set)
+    client.progress(tid, (1.0, 10 * (tid + 1), None))
+    stopped.wait()
+    client.send_results((tid, [f"model{tid}", 10.0 * (tid + 1), [0.01, 0.02], {}]))
+
+
+def failing_executor(socket_path, tid):
+    # Dies once the experiment has started, without results
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.connect(socket_path)
+    send_msg(sock, READY, {"tid": tid, "pid": os.getpid()})
+    assert recv_msg(sock)[0] == START
+    sock.close()
+
+
+def start_executors(server, targets):
+    threads = [threading.Thread(target=target, args=(server.socket_path, tid), daemon=True)
+               for tid, target in enumerate(targets)]
+    for thread in threads:
+        thread.start()
+    infos = server.wait_for_ready(len(threads), is_alive=lambda: True, timeout=10)
+    assert sorted(info["tid"] for info in infos) == list(range(len(threads)))
+    server.start()
+    return threads
+
+
+def test_ready_start_results(server):
+    threads = start_executors(server, [executor, executor])
+    progress = []
+    deadline = time.monotonic() + 10
+    while len(progress) < 2 and time.monotonic() < deadline:
+        progress.extend(server.receive_progress(0.1))
+    assert sorted(progress) == [(0, (1.0, 10, None)), (1, (1.0, 20, None))]
+
+    server.stop()
+    results = server.collect_results()
+    for thread in threads:
+        thread.join(timeout=10)
+    assert sorted(tid for tid, _ in results) == [0, 1]
+    assert server.failed == []
+
+
+def test_missing_executor(server, tmp_path):
+    threads = start_executors(server, [executor, failing_executor, executor])
+    deadline = time.monotonic() + 10
+    while not server.failed and time.monotonic() < deadline:
+        server.receive_progress(0.1)
+    assert server.failed == [1]
+
+    server.stop()
+    results = server.collect_results()
+    for thread in threads:
+        thread.join(timeout=10)
+    assert sorted(tid for tid, _ in results) == [0, 2]
+
+    # The remaining models keep their own columns
+    compute_stats(results, "tm", str(tmp_path / "results"))
+    tput = pd.read_csv(tmp_path / "results" / "tput.csv")
+    assert list(tput.columns) == ["mode", "load", "0_model0", "2_model2"]
+    assert tput["0_model0"][0] == 10.0 and tput["2_model2"][0] == 30.0
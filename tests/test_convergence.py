@@ -0,0 +1,53 @@
+# Convergence detection on synthetic runs with a known warm up transient
+import math
+
+import numpy as np
+
+from convergence import ConvergenceMonitor # type: ignore
+from histogram import LogHistogram # type: ignore
+
+
+def synthetic_run(rng, duration, latency, jitter, transient, interval=1.0):
+    # Snapshots of a closed loop model whose latency starts 3x higher and
+    # decays to its steady value over `transient` secs
+    hist = LogHistogram()
+    now, completed, next_snapshot = 0.0, 0, interval
+    snapshots = []
+    while now < duration:
+        slowdown = 1 + 2 * math.exp(-5 * now / transient) if transient else 1
+        sample = latency * slowdown * rng.lognormal(0, jitter)
+        now += sample
+        completed += 1
+        hist.record(sample)
+        if now >= next_snapshot:
+            snapshots.append((now, completed, hist.snapshot()))
+            next_snapshot = now + interval
+    return snapshots
+
+
+
+def test_monitor_converges_on_steady_state():
+    # A bert-like model with short, jittery requests that converges in
+    # seconds and a diffusion-like one with few, steady requests
+    rng = np.random.default_rng(1)
+    runs = {0: synthetic_run(rng, 300, 0.01, 0.2, 5), 1: synthetic_run(rng, 300, 2.5, 0.02, 20)}
+    monitor = ConvergenceMonitor(len(runs), target=0.05)
+    converged_at = {}
+    for second in range(1, 301):
+        for tid, snapshots in runs.items():
+            while snapshots and snapshots[0][0] <= second:
+                monitor.add(tid, *snapshots.pop(0))
+            widths = monitor.relative_widths(tid)
+            if tid not in converged_at and widths and all(width <= 0.05 for width in widths.values()):
+                converged_at[tid] = second
+        if monitor.converged():
+            break
+
+    assert monitor.converged()
+    assert converged_at[0] < converged_at[1]
+    for tid, latency in [(0, 0.01), (1, 2.5)]:
+        estimate = monitor.estimate(tid)
+        # The steady p50 is within the interval and the transient was cut
+        lo, hi = estimate["total_p50"][1:]
+        assert lo * 0.97 <= latency <= hi * 1.03
+        assert estimate["transient"] > 0
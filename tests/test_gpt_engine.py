@@ -0,0 +1,69 @@
+# Continuous batching against HF generate() on a tiny, randomly
+# initialized GPT-J on the CPU
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("transformers")
+from gpt_engine import GPTEngine, PrefixCache # type: ignore
+
+PROMPTS = [
+    "The NBA season is heating up",
+    "The NBA season is heating up with intense matchups",
+    "Discuss the impact of recent trades",
+    "Analyzing the rise of young talents",
+    "The NBA season is heating up",
+]
+MAX_LENGTH = 60
+
+
+class ByteTokenizer:
+    # Stand-in tokenizer for the tiny model: one token per byte
+    eos_token_id = 256
+
+    def encode(self, text):
+        return list(text.encode("utf-8"))
+
+    def decode(self, token_ids, skip_special_tokens=True):
+        return bytes(t for t in token_ids if t < 256).decode("utf-8", errors="replace")
+
+
+def tiny_gptj(seed=0):
+    # Same architecture as GPT-J 6B, small enough to run on a CPU
+    from transformers import GPTJConfig, GPTJForCausalLM # type: ignore
+    torch.manual_seed(seed)
+    config = GPTJConfig(
+        vocab_size=257,
+        n_positions=512,
+        n_embd=64,
+        n_layer=2,
+        n_head=4,
+        rotary_dim=8,
+        bos_token_id=ByteTokenizer.eos_token_id,
+        eos_token_id=ByteTokenizer.eos_token_id
+    )
+    return GPTJForCausalLM(config).eval()
+
+
+@pytest.mark.parametrize("max_batch_size", [1, 3])
+def test_greedy_outputs_match_generate(max_batch_size):
+    model = tiny_gptj()
+    tokenizer = ByteTokenizer()
+    expected = []
+    for prompt in PROMPTS:
+        ids = tokenizer.encode(prompt)
+        output = model.generate(
+            torch.tensor([ids]),
+            attention_mask=torch.ones(1, len(ids), dtype=torch.long),
+            max_length=MAX_LENGTH,
+            do_sample=False,
+            eos_token_id=tokenizer.eos_token_id,
+            pad_token_id=tokenizer.eos_token_id
+        )
+        expected.append(output[0].tolist())
+
+    engine = GPTEngine(model, tokenizer, torch.device("cpu"), max_batch_size=max_batch_size,
+                       max_length=MAX_LENGTH, prefix_cache=PrefixCache(), do_sample=False)
+    seqs = engine.generate(PROMPTS)
+    assert [seq.prompt_ids + seq.output_ids for seq in seqs] == expected
+    # The repeated prompt and the shared prefix come from the cache
+    assert engine.prefix_cache.hits > 0 and engine.prefix_cache.reused_tokens > 0
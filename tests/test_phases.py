@@ -0,0 +1,47 @@
+# Phases timed by PhaseTimer against the same work timed with a sync, and
+# the overhead of an empty phase
+import time
+
+import pytest
+
+torch = pytest.importorskip("torch")
+from phases import PhaseTimer # type: ignore
+
+
+@pytest.fixture(scope="module")
+def device():
+    return torch.device("cuda" if torch.cuda.is_available() else "cpu")
+
+
+@pytest.mark.parametrize("name, on_device", [("host", False), ("matmul", True)])
+def test_phase_matches_synchronized(device, name, on_device):
+    timer = PhaseTimer(device)
+    x = torch.randn(1024, 1024, device=device)
+    work = (lambda: [x @ x for _ in range(20)]) if on_device else (lambda: sum(range(200000)))
+    work()
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+    start = time.perf_counter()
+    for _ in range(20):
+        with timer.phase(name, 1, on_device=on_device):
+            work()
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+    measured = (time.perf_counter() - start) / 20
+    timer.flush()
+    error = timer.hists[name].percentile(50) / measured - 1
+    # Events only see the device's share of a phase, never more
+    assert -0.5 < error < 0.2
+
+
+def test_overhead(device):
+    timer = PhaseTimer(device)
+    num_phases = 10000
+    start = time.perf_counter()
+    for _ in range(num_phases):
+        with timer.phase("empty", 1, on_device=True):
+            pass
+    overhead = (time.perf_counter() - start) / num_phases
+    timer.flush()
+    assert overhead < 50e-6
+    assert len(timer.hists["empty"]) == num_phases
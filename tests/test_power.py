@@ -0,0 +1,67 @@
+# A recorded nvidia-smi pwr.csv replayed into pwr.bin, without a GPU
+import os
+import time
+
+import numpy as np
+import pytest
+
+from power import POWER_FILE, PowerSampler, ReplayBackend, energy, load_power # type: ignore
+
+PWR_CSV = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                       "results", "a100", "bert", "bert-1", "pwr.csv")
+
+
+@pytest.fixture(scope="module")
+def samples(tmp_path_factory):
+    backend = ReplayBackend(PWR_CSV)
+    expected = [backend.read() for _ in range(len(backend))]
+    backend = ReplayBackend(PWR_CSV)
+    output = str(tmp_path_factory.mktemp("power") / POWER_FILE)
+    sampler = PowerSampler(backend, output, interval=0.005)
+    sampler.start()
+    time.sleep(0.5)
+    sampler.stop()
+    return load_power(output), expected
+
+
+def test_replay_keeps_the_rows_of_its_device(tmp_path):
+    # nvidia-smi interleaves the rows of every GPU of the machine, and GPUs
+    # that report no utilization ([N/A]) have no samples
+    with open(PWR_CSV) as f:
+        header = f.readline()
+    rows = []
+    for i in range(6):
+        for device in range(3):
+            util = "[N/A]" if device == 2 else f"{10 * device + i} %"
+            rows.append(f"2024/05/02 15:24:17.{i:03}, NVIDIA A100 80GB PCIe, P0, 30, 81920 MiB, 81024 MiB, "
+                        f"{device} MiB, 0 %, {util}, {100 * device + i}.5 W\n")
+    pwr_csv = tmp_path / "pwr.csv"
+    pwr_csv.write_text(header + "".join(rows))
+
+    backend = ReplayBackend(str(pwr_csv), device_index=1, num_devices=3)
+    assert [backend.read() for _ in range(len(backend))] == [(100 + i + 0.5, 10 + i, 1) for i in range(6)]
+    assert len(ReplayBackend(str(pwr_csv), device_index=2, num_devices=3)) == 0
+
+
+def test_records_are_monotonic(samples):
+    samples, expected = samples
+    assert len(samples) > 10
+    assert np.all(np.diff(samples["t"]) > 0)
+    # Replayed in order, looping around once the recording runs out
+    for i, sample in enumerate(samples):
+        power, util, mem_used = expected[i % len(expected)]
+        assert sample["power"] == pytest.approx(power)
+        assert sample["util"] == pytest.approx(util)
+        assert sample["mem_used"] == pytest.approx(mem_used)
+
+
+def test_energy_is_trapezoidal_integral(samples):
+    samples, _ = samples
+    t = (samples["t"] - samples["t"][0]) / 1e9
+    assert energy(samples) == pytest.approx(np.trapezoid(samples["power"].astype(np.float64), t))
+    # Restricted to a window of the run
+    start, end = samples["t"][len(samples) // 4], samples["t"][3 * len(samples) // 4]
+    window = samples[(samples["t"] >= start) & (samples["t"] <= end)]
+    t = (window["t"] - window["t"][0]) / 1e9
+    assert energy(samples, start, end) == pytest.approx(np.trapezoid(window["power"].astype(np.float64), t))
+    assert energy(samples[:1]) == 0.0
@@ -0,0 +1,51 @@
+# Every precision variant against fp32 on a small model on the CPU
+import copy
+
+import pytest
+
+torch = pytest.importorskip("torch")
+from quantize import DTYPES, PRECISIONS, footprint, quantize # type: ignore
+
+
+class TinyLM(torch.nn.Module):
+    # Embeddings, a few MLP blocks and a tied output projection, the layout
+    # of the real models at a size the CPU runs in no time
+    def __init__(self, vocab=1000, hidden=256, layers=4):
+        super().__init__()
+        self.embed = torch.nn.Embedding(vocab, hidden)
+        self.blocks = torch.nn.ModuleList(torch.nn.Sequential(
+            torch.nn.LayerNorm(hidden), torch.nn.Linear(hidden, 4 * hidden), torch.nn.GELU(),
+            torch.nn.Linear(4 * hidden, hidden)) for _ in range(layers))
+        self.head = torch.nn.Linear(hidden, vocab, bias=False)
+        self.head.weight = self.embed.weight
+
+    def forward(self, ids):
+        x = self.embed(ids)
+        for block in self.blocks:
+            x = x + block(x)
+        return self.head(x)
+
+
+
+@pytest.fixture(scope="module")
+def reference():
+    torch.manual_seed(0)
+    model = TinyLM().eval()
+    ids = torch.randint(0, 1000, (8, 32))
+    with torch.no_grad():
+        expected = model(ids)
+    return model, ids, expected
+
+
+@pytest.mark.parametrize("precision", PRECISIONS)
+def test_precision_matches_fp32(reference, precision):
+    model, ids, expected = reference
+    variant = copy.deepcopy(model)
+    variant = quantize(variant, precision) if precision not in DTYPES else variant.to(DTYPES[precision])
+    assert footprint(variant) <= footprint(model)
+    # Half precision matmuls are not supported on the CPU by every
+    # PyTorch version, those variants only check their footprint
+    if precision not in ["fp16", "bf16"]:
+        with torch.no_grad():
+            outputs = variant(ids)
+        assert float((outputs - expected).norm() / expected.norm()) < 0.05
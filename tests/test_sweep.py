@@ -0,0 +1,36 @@
+# A small sweep end to end on dry_run.py models and three fake GPUs, with
+# executors failing at start-up
+import pytest
+
+from sweep import Sweep, expand_spec, is_complete # type: ignore
+
+SPEC = {
+    "device-type": "a100",
+    "modes": ["tm", "mps-uncap"],
+    "duration": 2,
+    "retries": 5,
+    "args": ["--sink", "quiet"],
+    "mixes": ["bert-1", "bert-1 whisper-1", {"mix": "whisper-1 gpt-1", "duration": 3}, "bert-1"],
+}
+
+
+def test_expand_spec(tmp_path):
+    jobs = expand_spec(SPEC, str(tmp_path))
+    # The repeated mix is one set of jobs
+    assert len(jobs) == 6
+    assert {job.duration for job in jobs if job.mix == ["whisper-1", "gpt-1"]} == {3}
+    with pytest.raises(ValueError, match="closed loop"):
+        expand_spec(dict(SPEC, modes=["inproc"], **{"load-mode": "poisson", "loads": [0.5]}), str(tmp_path))
+
+
+def test_dry_run_sweep_retries_and_resumes(tmp_path, monkeypatch):
+    result_root, log_dir = str(tmp_path / "results"), str(tmp_path / "logs")
+    monkeypatch.setenv("DRY_RUN_FAIL_RATE", "0.2")
+    sweep = Sweep(SPEC, [0, 1, 2], result_root, log_dir, dry_run=True)
+    assert sweep.run()
+    assert all(is_complete(job) for job in sweep.jobs)
+
+    # A second run finds nothing left to do
+    monkeypatch.delenv("DRY_RUN_FAIL_RATE")
+    resumed = Sweep(SPEC, [0, 1, 2], result_root, log_dir, dry_run=True)
+    assert not [job for job in resumed.jobs if not is_complete(job)]
@@ -0,0 +1,26 @@
+# Synthetic models against the single-model runs they are calibrated from
+import numpy as np
+import pytest
+
+from synthetic import DEFAULT_PROFILES, get_profile, load_profiles # type: ignore
+
+PROFILES = load_profiles(DEFAULT_PROFILES)
+
+
+def test_profiles_found():
+    assert PROFILES
+
+
+@pytest.mark.parametrize("name", sorted(PROFILES))
+def test_sampled_latencies_match_profile(name):
+    profile = PROFILES[name]
+    rng = np.random.default_rng(0)
+    sampled = np.quantile(profile.sample_latency(rng, 100000), [0.5, 0.9, 0.99])
+    assert np.abs(sampled / profile.latencies[1:4] - 1).max() < 0.02
+    assert len(profile.sample_steps(rng)) == profile.num_steps
+
+
+@pytest.mark.parametrize("model", sorted({profile.model for profile in PROFILES.values()}))
+def test_latency_grows_with_batch_size(model):
+    scaled = [get_profile(PROFILES, model, batch_size) for batch_size in [1, 2, 4, 8]]
+    assert all(a.latencies[1] <= b.latencies[1] for a, b in zip(scaled, scaled[1:]))
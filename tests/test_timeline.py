@@ -0,0 +1,53 @@
+# Energy attribution on a synthetic run with known per-model energy, and
+# the ring buffer of the timeline recorder
+import time
+
+import numpy as np
+
+from power import POWER_DTYPE # type: ignore
+from timeline import RECORD_DTYPE, TIMELINE_FILE, TimelineRecorder, _active_time, attribute, load_timelines # type: ignore
+
+
+def test_attribution_matches_ground_truth():
+    # Two models on a GPU drawing 100 W idle and 100 W more per active
+    # model, sampled every 100 ms: model 0 always busy with 50 ms batches
+    # of 2 requests, model 1 busy half of the time with 500 ms batches
+    rng = np.random.default_rng(0)
+    duration = 60.0
+    base = time.monotonic_ns()
+    timelines = {}
+    for tid, (batch, gap, requests) in enumerate([(0.05, 0.0, 2), (0.5, 0.5, 1)]):
+        starts = np.arange(0, duration, batch + gap) + rng.uniform(0, 0.01)
+        starts = starts[starts + batch < duration]
+        timelines[tid] = np.zeros(len(starts), dtype=RECORD_DTYPE)
+        timelines[tid]["start"] = base + (starts * 1e9).astype(np.int64)
+        timelines[tid]["end"] = base + ((starts + batch) * 1e9).astype(np.int64)
+        timelines[tid]["requests"] = requests
+
+    # Ground truth at 1 ms: each active model gets an even share of the power
+    fine = base + np.arange(0, int(duration * 1e9) + 1, 10**6, dtype=np.int64)
+    busy = np.vstack([np.diff(_active_time(timelines[tid], fine)) * 1e3 for tid in sorted(timelines)])
+    power = 100 + 100 * busy.sum(axis=0)
+    expected = (busy * power / np.maximum(busy.sum(axis=0), 1)).sum(axis=1) / 1e3
+    samples = np.zeros(len(power[::100]), dtype=POWER_DTYPE)
+    samples["t"] = fine[:-1][::100]
+    samples["power"] = power[::100]
+
+    results, idle = attribute(samples, timelines)
+    total = sum(result["energy"] for result in results.values()) + idle
+    assert abs(total / (power.sum() / 1e3) - 1) <= 0.02
+    for tid, result in results.items():
+        assert abs(result["energy"] / expected[tid] - 1) <= 0.05
+        assert result["requests"] == timelines[tid]["requests"].sum()
+
+
+def test_ring_buffer_keeps_newest(tmp_path):
+    recorder = TimelineRecorder(str(tmp_path / TIMELINE_FILE.format(0)), capacity=100)
+    for i in range(250):
+        recorder.record(i, i + 0.5, 1)
+    recorder.close()
+    kept = load_timelines(str(tmp_path))[0]
+    assert len(kept) == 100
+    # Oldest first
+    assert kept["start"][0] == 150 * 10**9
+    assert np.all(np.diff(kept["start"]) > 0)
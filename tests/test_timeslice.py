@@ -0,0 +1,83 @@
+# Order of steps under each time-slicing policy, on stub models that
+# advance a virtual clock instead of running on a device
+import threading
+
+import pytest
+
+from timeslice import SliceScheduler, get_policy # type: ignore
+
+
+class VirtualClock:
+    # Advanced by the stub models instead of real time passing
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class StubModel:
+    # Runs num_steps steps of step_time virtual secs per request
+    def __init__(self, name, num_steps, step_time, clock, trace):
+        self.name = name
+        self.num_steps = num_steps
+        self.step_time = step_time
+        self.clock = clock
+        self.trace = trace
+        self.time_slice = None
+
+    def infer(self):
+        for step in range(self.num_steps):
+            if step > 0:
+                self.time_slice.yield_step()
+            self.clock.now += self.step_time
+            self.trace.append(self.name)
+        return 1
+
+
+def run_stubs(policy, stubs, num_reqs):
+    # stubs: [(name, num_steps, step_time, weight, slo)]; returns the order
+    # the steps ran in and the per lane device time
+    clock = VirtualClock()
+    trace = []
+    scheduler = SliceScheduler(get_policy(policy), clock=clock)
+    models = []
+    for name, num_steps, step_time, weight, slo in stubs:
+        model = StubModel(name, num_steps, step_time, clock, trace)
+        model.time_slice = scheduler.add_lane(weight, slo)
+        models.append(model)
+
+    def run_lane(model):
+        model.time_slice.join()
+        for _ in range(num_reqs):
+            model.time_slice.new_request()
+            model.infer()
+        model.time_slice.leave()
+
+    threads = [threading.Thread(target=run_lane, args=(model,)) for model in models]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return "".join(trace), [lane.used for lane in scheduler.lanes]
+
+
+# D: a diffusion-like model with long requests of many steps,
+# B: a bert-like model with short requests of few steps
+STUBS = [("D", 5, 1.0, 1.0, None), ("B", 2, 0.5, 1.0, 2.0)]
+
+
+@pytest.mark.parametrize("policy, order", [
+    # Alternate steps, including at request boundaries
+    ("round-robin", "DBDBDBDBDDDDDD"),
+    # B's requests always have the earliest deadline
+    ("edf", "BBBBDDDDDDDDDD"),
+    # Equal weights: whoever has had less device time runs
+    ("weighted", "DBBDBBDDDDDDDD"),
+])
+def test_policy_order(policy, order):
+    trace, used = run_stubs(policy, STUBS, num_reqs=2)
+    assert trace == order
+    assert used == [10.0, 2.0]
+    # Does not depend on thread timing
+    assert run_stubs(policy, STUBS, num_reqs=2)[0] == trace
@@ -0,0 +1,63 @@
+# Weights shared between processes on the CPU: the first to load a small
+# model exports it, the others attach, and nothing is left after they exit
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+torch = pytest.importorskip("torch")
+import weight_share # type: ignore
+
+SCRIPT = f'''
+import os, sys, time, torch
+sys.path.insert(0, {os.path.dirname(os.path.abspath(weight_share.__file__))!r})
+import weight_share
+def build():
+    torch.manual_seed(0)
+    model = torch.nn.Sequential(torch.nn.Embedding(1000, 256), torch.nn.Linear(256, 1024),
+                                torch.nn.GELU(), torch.nn.Linear(1024, 1000, bias=False))
+    model[3].weight = model[0].weight
+    return model
+shared = weight_share.SharedWeights(torch.device("cpu"), sys.argv[1])
+with shared.lock("tiny"):
+    model = shared.attach("tiny", lambda: build().to("meta"))
+    role = "attached"
+    if model is None:
+        model, role = build(), "exported"
+        shared.export("tiny", model)
+out = model(torch.arange(16)).sum().item()
+tied = model[3].weight is model[0].weight
+print(role, round(out, 3), tied, flush=True)
+time.sleep(float(sys.argv[2]))
+'''
+
+
+def test_processes_share_weights(tmp_path):
+    root = str(tmp_path)
+    # The exporter exits first and has to wait for the others
+    procs = [subprocess.Popen([sys.executable, "-c", SCRIPT, root, str(1 if i == 0 else 3)],
+                              stdout=subprocess.PIPE, text=True)
+             for i in range(3)]
+    start = time.monotonic()
+    outputs = [proc.communicate()[0].split() for proc in procs]
+    elapsed = time.monotonic() - start
+
+    assert sorted(output[0] for output in outputs) == ["attached", "attached", "exported"]
+    assert len({output[1] for output in outputs}) == 1
+    assert all(output[2] == "True" for output in outputs)
+    assert elapsed >= 3
+    assert all(name.endswith(".lock") for name in os.listdir(os.path.join(root, "cpu")))
+    assert weight_share.cleanup(root) == 0
+
+
+def test_exports_are_released_from_their_own_dir(tmp_path):
+    shares = [weight_share.SharedWeights(torch.device("cpu"), str(tmp_path / name)) for name in ["a", "b"]]
+    for shared in shares:
+        shared.export("tiny", torch.nn.Linear(4, 4))
+    assert all(os.path.exists(os.path.join(shared.dir, "tiny.json")) for shared in shares)
+
+    weight_share._release_all()
+    for shared in shares:
+        assert not os.path.exists(os.path.join(shared.dir, "tiny.json"))
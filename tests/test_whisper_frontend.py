@@ -0,0 +1,48 @@
+# Batched log-mel frontend against HF's WhisperFeatureExtractor on the CPU
+import numpy as np
+import pytest
+
+torch = pytest.importorskip("torch")
+transformers = pytest.importorskip("transformers")
+from whisper_frontend import AudioStream, WhisperFrontend # type: ignore
+
+
+@pytest.fixture
+def feature_extractor():
+    return transformers.WhisperFeatureExtractor()
+
+
+@pytest.fixture
+def audio(feature_extractor):
+    rng = np.random.default_rng(0)
+    short = rng.uniform(-0.5, 0.5, 5 * feature_extractor.sampling_rate).astype(np.float32)
+    long = rng.uniform(-0.5, 0.5, 70 * feature_extractor.sampling_rate).astype(np.float32)
+    return short, long
+
+
+def test_features_match_feature_extractor(feature_extractor, audio):
+    short, long = audio
+    frontend = WhisperFrontend(feature_extractor, torch.device("cpu"))
+    features, spans = frontend.features([short, long, short])
+
+    windows = frontend.split(short) + frontend.split(long) + frontend.split(short)
+    expected = feature_extractor(windows, sampling_rate=feature_extractor.sampling_rate,
+                                 return_tensors="np").input_features
+    assert len(features) == len(windows)
+    assert np.abs(features.numpy() - expected).max() <= 1e-4
+    # The second short clip comes from the cache
+    assert frontend.hits > 0
+
+
+def test_streamed_windows_match(feature_extractor, audio):
+    _, long = audio
+    frontend = WhisperFrontend(feature_extractor, torch.device("cpu"))
+    features, _ = frontend.features([long])
+
+    stream = AudioStream(frontend.window_samples)
+    streamed = []
+    for piece in np.array_split(long, 7):
+        streamed.extend(stream.feed(piece))
+    streamed.extend(stream.flush())
+    streamed_features, _ = frontend.features(streamed)
+    assert torch.equal(streamed_features, features)